@@ -0,0 +1,119 @@
+"""Margen de concurrencia: rutas sync en el threadpool vs rutas async.
+
+Levanta en proceso dos apps sobre la misma db de items. Cada request espera
+`--wait` segundos y despues lista 20 items, como orders que espera a users/items
+y recien ahi escribe en su db:
+
+- threadpool: `def` + `Session` sync + espera bloqueante (el modelo anterior).
+- async: `async def` + `AsyncSession` + espera con `await` (el modelo actual).
+
+Con `--concurrency` clientes en paralelo, el modelo threadpool queda topado por
+los ~40 workers de Starlette; el async escala con la concurrencia.
+
+    python -m bench.async_concurrency --concurrency 200 --requests 2000 --wait 0.2
+"""
+import argparse, asyncio, importlib, os, statistics, tempfile, time
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from common.db import make_async_engine, make_engine
+
+crud = importlib.import_module("items-service.app.crud")
+models = importlib.import_module("items-service.app.models")
+
+
+def build_apps(url: str, wait: float, pool_size: int) -> tuple[dict[str, FastAPI], dict]:
+    sync_engine = make_engine("items", url=url, pool_size=pool_size)
+    async_engine = make_async_engine("items", url=url, pool_size=pool_size)
+    models.Base.metadata.create_all(bind=sync_engine)
+    with Session(sync_engine) as db:
+        db.execute(insert(models.Item), [{"name": f"i{i}", "sku": f"S{i}", "stock": 10} for i in range(1000)])
+        db.commit()
+    inflight = {"now": 0, "max": 0}
+
+    def enter():
+        inflight["now"] += 1
+        inflight["max"] = max(inflight["max"], inflight["now"])
+
+    threadpool = FastAPI()
+
+    def get_sync_db():
+        with Session(sync_engine) as db:
+            yield db
+
+    @threadpool.get("/")
+    def sync_route(db: Session = Depends(get_sync_db)):
+        enter()
+        try:
+            time.sleep(wait)
+            rows = db.query(models.Item).order_by(models.Item.id).limit(20).all()
+            return len(rows)
+        finally:
+            inflight["now"] -= 1
+
+    async_app = FastAPI()
+
+    async def get_async_db():
+        async with AsyncSession(async_engine) as db:
+            yield db
+
+    @async_app.get("/")
+    async def async_route(db: AsyncSession = Depends(get_async_db)):
+        enter()
+        try:
+            await asyncio.sleep(wait)
+            rows = await crud.list_items(db, 20)
+            return len(rows)
+        finally:
+            inflight["now"] -= 1
+
+    return {"threadpool": threadpool, "async": async_app}, inflight
+
+
+async def load(app: FastAPI, concurrency: int, requests: int) -> tuple[list[float], float]:
+    latencies = []
+    queue = iter(range(requests))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in queue:
+                start = time.perf_counter()
+                r = await client.get("/")
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+
+def pct(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[int(p) - 1] * 1000
+
+
+async def main_async(args):
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='async-bench-'), 'items.db')}"
+    apps, inflight = build_apps(url, args.wait, args.pool_size)
+    print(f"{args.requests} requests, {args.concurrency} clientes, espera downstream {args.wait * 1000:.0f} ms")
+    for label, app in apps.items():
+        inflight["max"] = 0
+        latencies, elapsed = await load(app, args.concurrency, args.requests)
+        print(f"{label:>10}: {args.requests / elapsed:8,.0f} req/s  p50 {pct(latencies, 50):7.1f} ms  "
+              f"p99 {pct(latencies, 99):7.1f} ms  en vuelo max {inflight['max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--wait", type=float, default=0.2, help="espera simulada del downstream (s)")
+    parser.add_argument("--pool-size", type=int, default=20)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Polling del catalogo: GET /items completo vs GET condicional vs cache del gateway.
+
+Levanta el cluster (`bench.cluster`), carga `--items` items y mide `GET /items/?limit=N`
+de cuatro formas:
+
+- `items sin ETag`: directo a items-service, sin `If-None-Match` (arma y serializa la pagina).
+- `items 304`: directo a items-service con el ETag de la respuesta anterior.
+- `gateway sin cache`: por el gateway con `Cache-Control: no-cache` y sin ETag del cliente
+  (revalida siempre contra items, que contesta 304; el body sale del cache).
+- `gateway cache`: por el gateway, copia fresca (no llega a items-service).
+
+    python -m bench.catalog_poll --items 1000 --limit 1000 --requests 500
+"""
+import argparse, asyncio, time
+
+import httpx
+
+from .cluster import Cluster
+from .load import percentile
+
+
+async def poll(client: httpx.AsyncClient, url: str, n: int, headers: dict) -> list[float]:
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        r = await client.get(url, headers=headers)
+        if r.status_code not in (200, 304):
+            r.raise_for_status()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+async def measure(cluster: Cluster, args) -> dict:
+    async with httpx.AsyncClient(timeout=30) as client:
+        gateway, items = cluster.url("gateway"), cluster.url("items")
+        sem = asyncio.Semaphore(16)
+
+        async def create(i: int):
+            async with sem:
+                r = await client.post(f"{items}/", json={"name": f"item {i}", "sku": f"SKU-{i}", "stock": 100})
+                r.raise_for_status()
+
+        await asyncio.gather(*(create(i) for i in range(args.items)))
+        url = f"/?limit={args.limit}"
+        tag = (await client.get(f"{items}{url}")).headers["etag"]
+        cases = {
+            "items sin ETag": (f"{items}{url}", {}),
+            "items 304": (f"{items}{url}", {"If-None-Match": tag}),
+            "gateway sin cache": (f"{gateway}/items{url}", {"Cache-Control": "no-cache"}),
+            "gateway cache": (f"{gateway}/items{url}", {}),
+        }
+        results = {}
+        for label, (target, headers) in cases.items():
+            await poll(client, target, args.warmup, headers)
+            results[label] = await poll(client, target, args.requests, headers)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    # TTL largo: en el caso "gateway cache" la copia no vence durante la medicion
+    with Cluster(env={"GATEWAY_CACHE_TTL": "3600"}) as cluster:
+        results = asyncio.run(measure(cluster, args))
+    print(f"GET /items/?limit={args.limit} con {args.items} items, {args.requests} requests de a uno")
+    print(f"{'':>18} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8}")
+    for label, times in results.items():
+        print(f"{label:>18} {percentile(times, 50) * 1000:8.2f} {percentile(times, 95) * 1000:8.2f} "
+              f"{len(times) / sum(times):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
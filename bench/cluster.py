@@ -0,0 +1,159 @@
+"""Levanta users, items, orders y el gateway con uvicorn en puertos libres y dbs temporales.
+
+Orders llama a users a traves de `DelayProxy`, un proxy TCP que por defecto no
+agrega nada y que los escenarios pueden volver lento para simular un downstream
+degradado sin reiniciar los servicios.
+
+Con `monolith=True` levanta solo el gateway con `GATEWAY_MONOLITH=1` (los tres
+servicios adentro, sin red entre ellos); los demas puertos quedan sin usar.
+"""
+import asyncio, os, random, socket, subprocess, sys, tempfile, threading, time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = {
+    "users": "users-service.app.main",
+    "items": "items-service.app.main",
+    "orders": "orders-service.app.main",
+    "gateway": "gateway.app.main",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class DelayProxy:
+    """Proxy TCP en un thread propio. Cada chunk del cliente espera `delay` segundos
+    (y con probabilidad `tail_rate`, `tail_delay`) antes de llegar al servicio."""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.port = free_port()
+        self.delay = self.tail_delay = self.tail_rate = 0.0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, name="delay-proxy", daemon=True).start()
+        self._ready.wait()
+
+    def set_delay(self, delay: float = 0.0, tail_delay: float = 0.0, tail_rate: float = 0.0):
+        self.delay, self.tail_delay, self.tail_rate = delay, tail_delay, tail_rate
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", self.port))
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, client_reader, client_writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+        except OSError:
+            client_writer.close()
+            return
+
+        async def pipe(reader, writer, delayed: bool):
+            try:
+                while chunk := await reader.read(65536):
+                    if delayed and (self.delay or self.tail_rate):
+                        tail = self.tail_delay if random.random() < self.tail_rate else 0.0
+                        await asyncio.sleep(self.delay + tail)
+                    writer.write(chunk)
+                    await writer.drain()
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                writer.close()
+
+        await asyncio.gather(pipe(client_reader, up_writer, True), pipe(up_reader, client_writer, False))
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class Cluster:
+    """Los 4 procesos uvicorn con sus dbs en un directorio temporal."""
+
+    def __init__(self, workdir: str | None = None, env: dict | None = None, monolith: bool = False):
+        self.workdir = workdir or tempfile.mkdtemp(prefix="bench-cluster-")
+        self.monolith = monolith
+        self.ports = {name: free_port() for name in SERVICES}
+        self.extra_env = env or {}
+        self.procs: dict[str, subprocess.Popen] = {}
+        self.users_proxy: DelayProxy | None = None
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.ports[name]}"
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": ROOT,
+            "LOG_LEVEL": "warn",
+            "USERS_DATABASE_URL": f"sqlite:///{os.path.join(self.workdir, 'users.db')}",
+            "ITEMS_DATABASE_URL": f"sqlite:///{os.path.join(self.workdir, 'items.db')}",
+            "ORDERS_DATABASE_URL": f"sqlite:///{os.path.join(self.workdir, 'orders.db')}",
+            "USERS_SERVICE_URL": f"http://127.0.0.1:{self.users_proxy.port}" if self.users_proxy else self.url("users"),
+            "ITEMS_SERVICE_URL": self.url("items"),
+            "ORDERS_SERVICE_URL": self.url("orders"),
+        })
+        if self.monolith:
+            env["GATEWAY_MONOLITH"] = "1"
+        env.update(self.extra_env)
+        return env
+
+    def start(self, timeout: float = 30.0):
+        services = {"gateway": SERVICES["gateway"]} if self.monolith else SERVICES
+        if not self.monolith:
+            self.users_proxy = DelayProxy(self.ports["users"])
+        env = self._env()
+        # el gateway va directo a users; sólo orders pasa por el proxy
+        gateway_env = dict(env, USERS_SERVICE_URL=self.url("users"))
+        for name, module in services.items():
+            log = open(os.path.join(self.workdir, f"{name}.log"), "wb")
+            self.procs[name] = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(self.ports[name]),
+                 "--app-dir", ROOT, "--log-level", "warning", "--no-access-log"],
+                cwd=self.workdir, env=gateway_env if name == "gateway" else env,
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+        deadline = time.monotonic() + timeout
+        for name in services:
+            while True:
+                if self.procs[name].poll() is not None:
+                    raise RuntimeError(f"{name} termino al arrancar, ver {self.workdir}/{name}.log")
+                try:
+                    # /ready ademas llena el pool de la db: la primera medicion no paga los connect
+                    if httpx.get(f"{self.url(name)}/ready", timeout=1).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} no respondio /ready en {timeout}s")
+                time.sleep(0.1)
+        return self
+
+    def stop(self):
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.users_proxy is not None:
+            self.users_proxy.close()
+
+    def __enter__(self):
+        try:
+            return self.start()
+        except BaseException:
+            self.stop()
+            raise
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,70 @@
+"""Rafaga de GETs identicos al gateway, con y sin single-flight (coalescing).
+
+Levanta el cluster dos veces (`bench.cluster`) con el cache de respuestas del
+gateway apagado, una con `GATEWAY_COALESCE_PATHS=/items` y otra sin coalescing.
+En cada una manda `--rounds` rafagas de `--burst` `GET /items/?limit=N` a la vez
+y cuenta cuantas llegaron a items-service (de su `/metrics`).
+
+    python -m bench.get_burst --items 1000 --burst 200 --rounds 3
+"""
+import argparse, asyncio, re, time
+
+import httpx
+
+from .cluster import Cluster
+from .load import percentile
+
+
+def upstream_gets(metrics: str) -> int:
+    return sum(int(float(v)) for v in re.findall(
+        r'^http_requests_total\{service="items",method="GET",route="/",status="200"\} (\S+)$', metrics, re.M))
+
+
+async def measure(cluster: Cluster, args) -> dict:
+    limits = httpx.Limits(max_connections=args.burst, keepalive_expiry=1)
+    async with httpx.AsyncClient(base_url=cluster.url("gateway"), timeout=60, limits=limits) as client:
+        sem = asyncio.Semaphore(8)
+
+        async def create(i: int):
+            async with sem:
+                r = await client.post("/items/", json={"name": f"item {i}", "sku": f"SKU-{i}", "stock": 100})
+                r.raise_for_status()
+
+        await asyncio.gather(*(create(i) for i in range(args.items)))
+
+        async def get() -> float:
+            start = time.perf_counter()
+            (await client.get(f"/items/?limit={args.limit}")).raise_for_status()
+            return time.perf_counter() - start
+
+        times, elapsed = [], 0.0
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            times += await asyncio.gather(*(get() for _ in range(args.burst)))
+            elapsed += time.perf_counter() - start
+        upstream = upstream_gets(httpx.get(cluster.url("items") + "/metrics").text)
+    return {"p50": percentile(times, 50) * 1000, "p95": percentile(times, 95) * 1000,
+            "burst_ms": elapsed / args.rounds * 1000, "upstream": upstream, "total": len(times)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--burst", type=int, default=200, help="requests simultaneas por rafaga")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for label, paths in (("sin coalescing", ""), ("coalescing", "/items")):
+        env = {"GATEWAY_CACHE_PATHS": "", "GATEWAY_COALESCE_PATHS": paths}
+        with Cluster(env=env) as cluster:
+            results[label] = asyncio.run(measure(cluster, args))
+    print(f"{args.rounds} rafagas de {args.burst} GET /items/?limit={args.limit} ({args.items} items)")
+    print(f"{'':>15} {'p50 ms':>8} {'p95 ms':>8} {'ms/rafaga':>10} {'a items':>10}")
+    for label, r in results.items():
+        print(f"{label:>15} {r['p50']:8.1f} {r['p95']:8.1f} {r['burst_ms']:10.1f} {r['upstream']:>5}/{r['total']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Reservas por segundo sobre un solo SKU caliente: SQLite (camino actual) vs motor en memoria.
+
+En proceso, como `bench.reserve_stress` (sin HTTP: en esta maquina el stack HTTP
+solo ya topa en unos cientos de req/s), `--requests` reservas de 1 unidad con
+`--workers` en paralelo sobre una db temporal:
+
+- `sqlite`: `crud.reserve_stock`, una transaccion (y un commit) por reserva.
+- `memoria`: `hot.HotStock.reserve` con journal (un fsync por tanda) y write-behind.
+- `memoria sin fsync`: lo mismo con `ITEMS_HOT_FSYNC=0`.
+
+Al final compara el stock en la db (despues del ultimo flush) con las reservas hechas.
+
+Con `--crash` ademas levanta el cluster con `ITEMS_HOT_SKUS` (y sin flush periodico:
+todo lo reservado queda solo en el journal), mata a items-service con SIGKILL en
+medio de una carga de `POST /reserve`, lo vuelve a levantar sobre la misma db y
+journal y verifica el stock recuperado: tiene que ser el inicial menos las reservas
+confirmadas (200), menos a lo sumo las que estaban en vuelo al morir.
+
+    python -m bench.hot_reserve --requests 20000 --workers 64 --crash
+"""
+import argparse, asyncio, importlib, os, sqlite3, tempfile, time
+
+os.environ.setdefault("LOG_LEVEL", "warn")  # sin los logs de arranque y flush del motor en memoria
+
+import httpx
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from common.auth import add_service_auth
+from common.db import make_async_engine
+
+from .cluster import Cluster
+
+crud = importlib.import_module("items-service.app.crud")
+hot = importlib.import_module("items-service.app.hot")
+models = importlib.import_module("items-service.app.models")
+
+SKU = "HOT-1"
+
+
+async def run_local(mode: str, stock: int, requests: int, workers: int) -> tuple[float, int, int]:
+    """Devuelve (segundos, reservas hechas, stock final en la db)."""
+    workdir = tempfile.mkdtemp(prefix="hot-reserve-")
+    engine = make_async_engine("items", url=f"sqlite:///{os.path.join(workdir, 'items.db')}",
+                               pool_size=workers, max_overflow=0)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with AsyncSession(engine) as db:
+        db.add(models.Item(name="hot", sku=SKU, stock=stock))
+        await db.commit()
+
+    if mode == "sqlite":
+        async def reserve():
+            async with AsyncSession(engine) as db:
+                try:
+                    return await crud.reserve_stock(db, SKU, 1)
+                except OperationalError:  # "database is locked": espero mas que SQLITE_BUSY_TIMEOUT_MS
+                    return None
+    else:
+        journal = hot.Journal(os.path.join(workdir, "items.db.hot"), fsync=mode == "memoria")
+        stock_engine = hot.HotStock([SKU], journal, hot.FLUSH_INTERVAL)
+        await stock_engine.start(async_sessionmaker(engine, expire_on_commit=False))
+
+        async def reserve():
+            return await stock_engine.reserve(SKU, 1)
+
+    sem = asyncio.Semaphore(workers)
+
+    async def one():
+        async with sem:
+            return await reserve()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    if mode != "sqlite":
+        await stock_engine.stop()
+
+    async with AsyncSession(engine) as db:
+        final = (await crud.get_item_by_sku(db, SKU)).stock
+    await engine.dispose()
+    return elapsed, sum(r is not None for r in results), final
+
+
+async def hammer(url: str, seconds: float, concurrency: int, kill) -> tuple[int, int]:
+    """`POST /reserve` hasta que muere el servicio. Devuelve (confirmadas, fallidas)."""
+    limits = httpx.Limits(max_connections=concurrency)
+    ok = failed = 0
+    async with httpx.AsyncClient(base_url=url, headers=add_service_auth({}), limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal ok, failed
+            while True:
+                try:
+                    r = await client.post("/reserve", json={"sku": SKU, "qty": 1})
+                except httpx.TransportError:
+                    failed += 1
+                    return
+                ok += r.status_code == 200
+
+        async def killer():
+            await asyncio.sleep(seconds)
+            kill()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)), killer())
+    return ok, failed
+
+
+def run_crash(stock: int, seconds: float, concurrency: int) -> dict:
+    # sin flush periodico: todo lo reservado tiene que volver del journal
+    env = {"ITEMS_HOT_SKUS": SKU, "ITEMS_HOT_FLUSH_INTERVAL": "3600"}
+    with Cluster(env=env) as cluster:
+        httpx.post(cluster.url("items") + "/", json={"name": "hot", "sku": SKU, "stock": stock}).raise_for_status()
+        ok, failed = asyncio.run(hammer(cluster.url("items"), seconds, concurrency, cluster.procs["items"].kill))
+    # de nuevo arriba sobre la misma db y journal: al arrancar aplica lo que no llego a la db
+    with Cluster(workdir=cluster.workdir, env=env):
+        pass
+    db = sqlite3.connect(os.path.join(cluster.workdir, "items.db"))
+    final = db.execute("SELECT stock FROM items WHERE sku = ?", (SKU,)).fetchone()[0]
+    db.close()
+    return {"ok": ok, "in_flight": failed, "expected": stock - ok, "stock": final}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--stock", type=int, default=1_000_000)
+    parser.add_argument("--crash", action="store_true", help="probar la recuperacion matando items-service")
+    parser.add_argument("--crash-after", type=float, default=3, help="segundos de carga antes del SIGKILL")
+    args = parser.parse_args()
+
+    print(f"{args.requests} reservas de 1 unidad sobre {SKU}, {args.workers} en paralelo (en proceso)")
+    print(f"{'':>18} {'reservas/s':>11} {'ok':>7} {'fallidas':>9} {'stock db':>9} {'esperado':>9}")
+    for mode in ("sqlite", "memoria", "memoria sin fsync"):
+        elapsed, ok, final = asyncio.run(run_local(mode, args.stock, args.requests, args.workers))
+        print(f"{mode:>18} {ok / elapsed:11.0f} {ok:7} {args.requests - ok:9} {final:9} {args.stock - ok:9}")
+
+    if args.crash:
+        r = run_crash(args.stock, args.crash_after, args.workers)
+        lost = r["expected"] - r["stock"]
+        verdict = "ok" if 0 <= lost <= r["in_flight"] else "MAL"
+        print(f"\nkill -9 a los {args.crash_after:g} s: {r['ok']} confirmadas, {r['in_flight']} en vuelo; "
+              f"stock recuperado {r['stock']}, esperado {r['expected']} (-{lost} en vuelo) -> {verdict}")
+
+
+if __name__ == "__main__":
+    main()
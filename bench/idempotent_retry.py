@@ -0,0 +1,138 @@
+"""Reintentos y hedge de `common.http` contra `/reserve`, con y sin Idempotency-Key.
+
+En proceso: items-service montado con `http.mount` detras de un transport que
+simula la red (sin el ruido del stack HTTP de esta maquina):
+
+- `respuestas perdidas`: items aplica la reserva pero con probabilidad `--lose` la
+  respuesta no llega (timeout) y `common.http` reintenta. `sin clave` saca el
+  `Idempotency-Key` antes de llegar a items (como antes): cada respuesta perdida
+  es una reserva de mas. `con clave` es el comportamiento nuevo.
+- `cola lenta`: con probabilidad `--slow` el request tarda `--tail` segundos de mas
+  en llegar. Sin hedge esa latencia la paga el caller; con hedge, pasado el p95 sale
+  un segundo request (con la misma clave) y gana el primero que responda.
+
+En cada caso compara las reservas confirmadas con las unidades que se descontaron.
+
+    python -m bench.idempotent_retry --requests 2000 --lose 0.05 --slow 0.05 --tail 0.2
+"""
+import argparse, asyncio, importlib, os, random, statistics, tempfile, time
+
+os.environ.setdefault("LOG_LEVEL", "warn")
+os.environ["ITEMS_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='idempotent-retry-'), 'items.db')}"
+
+import httpx
+
+from common import http
+from common.auth import add_service_auth
+
+items_main = importlib.import_module("items-service.app.main")
+items_db = importlib.import_module("items-service.app.db")
+crud = importlib.import_module("items-service.app.crud")
+
+URL = "http://items.bench"
+SKU = "RETRY-1"
+STOCK = 10_000_000
+RETRY = http.RetryPolicy(attempts=3, timeout=5, backoff=0.005, max_backoff=0.02)
+BREAKER = http.BreakerPolicy(max_fails=1_000_000)  # aca se mide la idempotencia, no el breaker
+
+
+class FaultyNetwork(httpx.AsyncBaseTransport):
+    """Entre `common.http` e items: respuestas que se pierden, requests lentos y (opcional) sin clave."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, lose: float = 0.0, slow: float = 0.0,
+                 tail: float = 0.0, keys: bool = True, seed: int = 1):
+        self.inner, self.lose, self.slow, self.tail, self.keys = inner, lose, slow, tail, keys
+        self.rng = random.Random(seed)
+        self.sent = 0
+        self.pending: set[asyncio.Future] = set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.sent += 1
+        if not self.keys:
+            request.headers.pop(http.IDEMPOTENCY_HEADER, None)
+        if self.rng.random() < self.slow:
+            await asyncio.sleep(self.tail)
+        # como en la red: si el caller cancela (hedge perdedor) el servicio igual termina el request
+        call = asyncio.ensure_future(self._call(request))
+        self.pending.add(call)
+        call.add_done_callback(self.pending.discard)
+        resp = await asyncio.shield(call)
+        if self.rng.random() < self.lose:
+            raise httpx.ReadTimeout("respuesta perdida", request=request)
+        return resp
+
+    async def _call(self, request: httpx.Request) -> httpx.Response:
+        resp = await self.inner.handle_async_request(request)
+        await resp.aread()
+        return resp
+
+
+async def stock() -> int:
+    async with items_db.SessionLocal() as db:
+        return (await crud.get_item_by_sku(db, SKU)).stock
+
+
+async def run(network: FaultyNetwork, requests: int, concurrency: int, hedge: bool) -> dict:
+    http._mounts[URL] = network
+    http._clients.clear()
+    http._latencies.clear()
+    http._breakers.clear()
+    before = await stock()
+    sem, latencies, ok = asyncio.Semaphore(concurrency), [], 0
+
+    async def reserve():
+        nonlocal ok
+        async with sem:
+            start = time.perf_counter()
+            try:
+                r = await http.arequest("POST", f"{URL}/reserve", json={"sku": SKU, "qty": 1},
+                                        headers=add_service_auth({}), retry=RETRY, breaker=BREAKER, hedge=hedge)
+            except RuntimeError:  # agoto los reintentos
+                return
+            latencies.append(time.perf_counter() - start)
+            ok += r.status_code == 200
+
+    await asyncio.gather(*(reserve() for _ in range(requests)))
+    # los hedges perdedores siguen corriendo en items: se espera que terminen antes de contar
+    await asyncio.gather(*network.pending, return_exceptions=True)
+    await http.aclose()
+    latencies.sort()
+    q = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    return {"ok": ok, "units": before - await stock(), "sent": network.sent,
+            "p50": q(0.50), "p99": q(0.99), "max": latencies[-1] * 1000, "mean": statistics.mean(latencies) * 1000}
+
+
+async def main_async(args):
+    app = items_main.app
+    inner = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with items_db.SessionLocal() as db:
+        await crud.create_item(db, "retry", SKU, STOCK)
+
+    cases = [
+        ("respuestas perdidas", "sin clave", FaultyNetwork(inner, lose=args.lose, keys=False, seed=args.seed), False),
+        ("respuestas perdidas", "con clave", FaultyNetwork(inner, lose=args.lose, seed=args.seed), False),
+        ("cola lenta", "sin hedge", FaultyNetwork(inner, slow=args.slow, tail=args.tail, seed=args.seed), False),
+        ("cola lenta", "con hedge", FaultyNetwork(inner, slow=args.slow, tail=args.tail, seed=args.seed), True),
+    ]
+    print(f"{args.requests} reservas de 1 unidad, {args.concurrency} en vuelo; "
+          f"perdidas {args.lose:.0%}; lentas {args.slow:.0%} (+{args.tail * 1000:.0f} ms)")
+    print(f"{'':>30} {'ok':>6} {'desc.':>6} {'de mas':>6} {'enviados':>8} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}")
+    for scenario, label, network, hedge in cases:
+        r = await run(network, args.requests, args.concurrency, hedge)
+        print(f"{scenario + ', ' + label:>30} {r['ok']:6} {r['units']:6} {r['units'] - r['ok']:6} {r['sent']:8} "
+              f"{r['p50']:7.1f} {r['p99']:7.1f} {r['max']:7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--lose", type=float, default=0.05, help="fraccion de respuestas que no llegan")
+    parser.add_argument("--slow", type=float, default=0.05, help="fraccion de requests lentos")
+    parser.add_argument("--tail", type=float, default=0.2, help="segundos de mas de un request lento")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
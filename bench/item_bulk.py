@@ -0,0 +1,109 @@
+"""Carga del catalogo: un `POST /items/` por SKU vs `POST /items/bulk` (CSV y NDJSON), y export.
+
+Levanta el cluster (`bench.cluster`) y contra items-service mide:
+
+- `por fila`: `--rows` `POST /items/` con `--concurrency` requests en vuelo (SKUs nuevos).
+- `bulk csv (alta)`: el mismo volumen de SKUs nuevos en un solo `POST /items/bulk` en CSV.
+- `bulk ndjson (cambios)`: de nuevo todos los SKUs en NDJSON, con una fraccion `--changed` de filas
+  con otro stock (el caso del feed nocturno: la mayoria llega igual y no se escribe).
+- `export csv` / `export ndjson`: `GET /items/export` del catalogo completo.
+
+    python -m bench.item_bulk --rows 100000 --concurrency 8
+"""
+import argparse, asyncio, json, random, time
+
+import httpx
+
+from .cluster import Cluster
+
+
+def rows(prefix: str, n: int, rng: random.Random) -> list[dict]:
+    return [{"name": f"item {i}", "sku": f"{prefix}-{i:07d}", "stock": rng.randint(0, 1000)} for i in range(n)]
+
+
+def changes(data: list[dict], rng: random.Random, fraction: float) -> list[dict]:
+    return [{**r, "stock": r["stock"] + 1} if rng.random() < fraction else r for r in data]
+
+
+def to_csv(data: list[dict]) -> bytes:
+    return ("name,sku,stock\n" + "".join(f"{r['name']},{r['sku']},{r['stock']}\n" for r in data)).encode()
+
+
+def to_ndjson(data: list[dict]) -> bytes:
+    return "".join(json.dumps(r) + "\n" for r in data).encode()
+
+
+async def per_row(url: str, data: list[dict], concurrency: int) -> tuple[float, int]:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        sem, failed = asyncio.Semaphore(concurrency), 0
+
+        async def create(row):
+            nonlocal failed
+            async with sem:
+                r = await client.post("/", json=row)
+                failed += r.status_code != 201
+
+        start = time.perf_counter()
+        await asyncio.gather(*(create(row) for row in data))
+        return time.perf_counter() - start, failed
+
+
+def bulk(client: httpx.Client, body: bytes, content_type: str, chunk: int = 64 * 1024) -> tuple[float, dict]:
+    def stream():
+        for i in range(0, len(body), chunk):
+            yield body[i:i + chunk]
+
+    start = time.perf_counter()
+    r = client.post("/bulk", content=stream(), headers={"Content-Type": content_type})
+    r.raise_for_status()
+    return time.perf_counter() - start, r.json()
+
+
+def export(client: httpx.Client, fmt: str) -> tuple[float, int]:
+    start, size = time.perf_counter(), 0
+    with client.stream("GET", f"/export?format={fmt}") as r:
+        r.raise_for_status()
+        for chunk in r.iter_bytes():
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=8, help="requests en vuelo en el modo por fila")
+    parser.add_argument("--changed", type=float, default=0.1, help="fraccion de filas que cambian en la recarga")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    results = []
+    with Cluster() as cluster:
+        url = cluster.url("items")
+        client = httpx.Client(base_url=url, timeout=600)
+
+        elapsed, failed = asyncio.run(per_row(url, rows("ROW", args.rows, rng), args.concurrency))
+        results.append(("por fila", elapsed, f"{failed} fallidas"))
+
+        catalog = rows("BULK", args.rows, rng)
+        elapsed, out = bulk(client, to_csv(catalog), "text/csv")
+        results.append(("bulk csv (alta)", elapsed, f"{out['inserted']} nuevas, {out['failed']} fallidas"))
+
+        elapsed, out = bulk(client, to_ndjson(changes(catalog, rng, args.changed)), "application/x-ndjson")
+        results.append(("bulk ndjson (cambios)", elapsed,
+                        f"{out['updated']} actualizadas, {out['unchanged']} sin cambios, {out['failed']} fallidas"))
+
+        for fmt in ("csv", "ndjson"):
+            elapsed, size = export(client, fmt)
+            results.append((f"export {fmt}", elapsed, f"{size:,} bytes, {args.rows * 2} items"))
+
+    print(f"{args.rows} filas por caso")
+    print(f"{'':>22} {'segundos':>9} {'filas/s':>9}")
+    for label, elapsed, detail in results:
+        rate = args.rows * (2 if label.startswith("export") else 1) / elapsed
+        print(f"{label:>22} {elapsed:9.2f} {rate:9.0f}  {detail}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Busqueda de items: filtrar en el cliente (bajar todo el catalogo) vs `?q=` / `?sku_prefix=` con indices.
+
+Levanta el cluster (`bench.cluster`), carga `--items` items directo en la db de
+items-service (los triggers llenan el indice FTS5) y mide contra items-service:
+
+- `cliente q`: baja el catalogo completo en NDJSON y filtra por palabra en el nombre.
+- `server q`: `GET /items/?q=<palabra>&limit=N` (FTS5, ordenado por relevancia).
+- `cliente sku`: baja todo y filtra por prefijo de SKU.
+- `server sku`: `GET /items/?sku_prefix=<prefijo>&limit=N` (rango sobre el indice de sku).
+
+    python -m bench.item_search --items 100000 --requests 20
+"""
+import argparse, json, os, random, sqlite3, time
+
+import httpx
+
+from .cluster import Cluster
+from .load import percentile
+
+WORDS = ["tornillo", "tuerca", "arandela", "clavo", "bisagra", "cable", "caño", "codo", "llave",
+         "martillo", "pinza", "cinta", "lija", "mecha", "taco", "perno", "resorte", "valvula"]
+ADJECTIVES = ["hexagonal", "galvanizado", "inoxidable", "reforzado", "plano", "largo", "corto",
+              "negro", "blanco", "industrial", "mini", "doble"]
+
+
+def seed(db_path: str, n: int, rng: random.Random):
+    db = sqlite3.connect(db_path)
+    rows = ((f"{rng.choice(WORDS)} {rng.choice(ADJECTIVES)} {rng.randint(1, 500)}mm",
+             f"{rng.choice(WORDS)[:3].upper()}-{i:07d}", rng.randint(0, 1000)) for i in range(n))
+    with db:
+        db.executemany("INSERT INTO items (name, sku, stock) VALUES (?, ?, ?)", rows)
+    db.close()
+
+
+def timed(fn, n: int) -> tuple[list[float], int, int]:
+    times, size, count = [], 0, 0
+    for _ in range(n):
+        start = time.perf_counter()
+        size, count = fn()
+        times.append(time.perf_counter() - start)
+    return times, size, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100, help="resultados por pagina del lado del servidor")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with Cluster() as cluster:
+        seed(os.path.join(cluster.workdir, "items.db"), args.items, rng)
+        client = httpx.Client(base_url=cluster.url("items"), timeout=120)
+
+        def client_side(match):
+            def run():
+                r = client.get("/", headers={"Accept": "application/x-ndjson"})
+                found = [row for row in map(json.loads, r.text.splitlines()) if match(row)]
+                return len(r.content), len(found[:args.limit])
+            return run
+
+        def server_side(params):
+            def run():
+                r = client.get("/", params={**params, "limit": args.limit})
+                r.raise_for_status()
+                return len(r.content), len(r.json())
+            return run
+
+        word, prefix = "tornillo", "TOR-00001"
+        cases = {
+            "cliente q": client_side(lambda row: word in row["name"].split()),
+            "server q": server_side({"q": word}),
+            "cliente sku": client_side(lambda row: row["sku"].startswith(prefix)),
+            "server sku": server_side({"sku_prefix": prefix}),
+        }
+        results = {label: timed(fn, args.requests) for label, fn in cases.items()}
+
+    print(f"{args.items} items, {args.requests} busquedas por caso (primeros {args.limit} resultados)")
+    print(f"{'':>12} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>12} {'filas':>6}")
+    for label, (times, size, count) in results.items():
+        print(f"{label:>12} {percentile(times, 50) * 1000:9.1f} {percentile(times, 95) * 1000:9.1f} {size:12,} {count:6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Carga reproducible sobre todo el camino de una orden, contra los 4 servicios reales.
+
+Levanta users, items, orders y el gateway (`bench.cluster`) con dbs temporales,
+carga usuarios, items y ordenes, y corre cada escenario contra el gateway con
+`--concurrency` clientes durante `--duration` segundos:
+
+- list_heavy: listados paginados de items, users y orders.
+- order_burst: rafaga de `POST /orders` (y algun `POST /orders/batch`) sobre SKUs con stock de sobra.
+- hot_sku: todas las ordenes contra pocos SKUs con poco stock (409 cuando se agota).
+- order_async: la misma rafaga que order_burst en modo async (`Prefer: respond-async`, 202 + outbox).
+- degraded: `POST /orders` y listados con users lento (proxy con demora y cola larga).
+
+Reporta req/s y p50/p95/p99 por endpoint, guarda el resultado en JSON y, con
+`--baseline`, lo compara contra una corrida anterior y sale con codigo 1 si algo
+empeoro mas que `--threshold`.
+
+    python -m bench.load --duration 10 --concurrency 32
+    python -m bench.load --out data/bench/base.json
+    python -m bench.load --baseline data/bench/base.json --threshold 0.15
+    python -m bench.load --scenarios hot_sku,degraded
+"""
+import argparse, asyncio, json, os, platform, random, subprocess, sys, time
+from collections import Counter
+
+import httpx
+
+from common.auth import add_service_auth
+from .cluster import Cluster
+
+
+# --- Escenarios: cada uno devuelve (endpoint, metodo, path, body) para el proximo request ---
+
+class Scenario:
+    headers: dict = {}
+
+    def __init__(self, args):
+        self.args = args
+
+    def setup(self, cluster: Cluster):
+        pass
+
+    def teardown(self, cluster: Cluster):
+        pass
+
+    def next(self, rng: random.Random) -> tuple[str, str, str, dict | None]:
+        raise NotImplementedError
+
+
+def _random_order(rng: random.Random, args, skus: range) -> dict:
+    return {"user_id": rng.randint(1, args.users), "item_sku": f"SKU-{rng.choice(skus):06d}", "qty": 1}
+
+
+class ListHeavy(Scenario):
+    def next(self, rng):
+        r = rng.random()
+        if r < 0.5:
+            return "GET /items", "GET", f"/items/?limit=100&after={rng.randrange(self.args.items)}", None
+        if r < 0.8:
+            return "GET /users", "GET", f"/users/?limit=50&after={rng.randrange(self.args.users)}", None
+        return "GET /orders", "GET", f"/orders/?limit=100&after={rng.randrange(self.args.orders)}", None
+
+
+class OrderBurst(Scenario):
+    def next(self, rng):
+        skus = range(self.args.hot_skus, self.args.items)
+        if rng.random() < 0.05:
+            orders = [_random_order(rng, self.args, skus) for _ in range(50)]
+            return "POST /orders/batch", "POST", "/orders/batch", {"orders": orders}
+        return "POST /orders", "POST", "/orders/", _random_order(rng, self.args, skus)
+
+
+class OrderAsync(Scenario):
+    headers = {"Prefer": "respond-async"}
+
+    def next(self, rng):
+        skus = range(self.args.hot_skus, self.args.items)
+        return "POST /orders (202)", "POST", "/orders/", _random_order(rng, self.args, skus)
+
+
+class HotSku(Scenario):
+    def next(self, rng):
+        return "POST /orders", "POST", "/orders/", _random_order(rng, self.args, range(self.args.hot_skus))
+
+
+class Degraded(Scenario):
+    def setup(self, cluster):
+        cluster.users_proxy.set_delay(self.args.degraded_delay, self.args.degraded_tail, self.args.degraded_tail_rate)
+
+    def teardown(self, cluster):
+        cluster.users_proxy.set_delay()
+
+    def next(self, rng):
+        if rng.random() < 0.7:
+            skus = range(self.args.hot_skus, self.args.items)
+            return "POST /orders", "POST", "/orders/", _random_order(rng, self.args, skus)
+        return "GET /items", "GET", f"/items/?limit=100&after={rng.randrange(self.args.items)}", None
+
+
+SCENARIOS = {
+    "list_heavy": ListHeavy, "order_burst": OrderBurst, "order_async": OrderAsync,
+    "hot_sku": HotSku, "degraded": Degraded,
+}
+
+
+# --- Carga de datos ---
+
+async def seed(cluster: Cluster, args):
+    headers = add_service_auth({})
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def post(url, body):
+            async with sem:
+                r = await client.post(url, json=body)
+                r.raise_for_status()
+
+        users = cluster.url("users") + "/"
+        items = cluster.url("items") + "/"
+        await asyncio.gather(*(post(users, {"name": f"user {i}", "email": f"user{i}@bench.local"})
+                               for i in range(args.users)))
+        await asyncio.gather(*(post(items, {
+            "name": f"item {i}", "sku": f"SKU-{i:06d}",
+            "stock": args.hot_stock if i < args.hot_skus else 10**9,
+        }) for i in range(args.items)))
+        # ordenes historicas para los listados, en lotes por /orders/batch
+        rng = random.Random(args.seed)
+        skus = range(args.hot_skus, args.items)
+        for start in range(0, args.orders, 500):
+            batch = [_random_order(rng, args, skus) for _ in range(min(500, args.orders - start))]
+            r = await client.post(cluster.url("orders") + "/batch", json={"orders": batch})
+            r.raise_for_status()
+
+
+# --- Corrida y reporte ---
+
+def percentile(values: list[float], p: float) -> float:
+    # nearest-rank sobre los valores ordenados
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, args, rng: random.Random) -> dict:
+    samples: dict[str, dict] = {}
+
+    async def worker(wrng: random.Random, stop: float, record: bool):
+        while time.perf_counter() < stop:
+            endpoint, method, path, body = scenario.next(wrng)
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, path, json=body, headers=scenario.headers)
+                status = str(r.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if record:
+                s = samples.setdefault(endpoint, {"latencies": [], "status": Counter()})
+                s["latencies"].append(time.perf_counter() - start)
+                s["status"][status] += 1
+
+    for record, seconds in ((False, args.warmup), (True, args.duration)):
+        if seconds <= 0:
+            continue
+        stop = time.perf_counter() + seconds
+        workers = [worker(random.Random(rng.random()), stop, record) for _ in range(args.concurrency)]
+        started = time.perf_counter()
+        await asyncio.gather(*workers)
+        elapsed = time.perf_counter() - started
+
+    report = {}
+    for endpoint, s in sorted(samples.items()):
+        lat = s["latencies"]
+        errors = sum(n for status, n in s["status"].items() if not status.isdigit() or int(status) >= 500)
+        report[endpoint] = {
+            "requests": len(lat),
+            "rps": round(len(lat) / elapsed, 1),
+            "p50_ms": round(percentile(lat, 50) * 1000, 2),
+            "p95_ms": round(percentile(lat, 95) * 1000, 2),
+            "p99_ms": round(percentile(lat, 99) * 1000, 2),
+            "error_rate": round(errors / len(lat), 4),
+            "status": dict(s["status"]),
+        }
+    return report
+
+
+def print_report(results: dict):
+    for name, endpoints in results["scenarios"].items():
+        print(f"\n== {name}")
+        print(f"  {'endpoint':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>8}  status")
+        for endpoint, r in endpoints.items():
+            status = " ".join(f"{k}:{v}" for k, v in sorted(r["status"].items()))
+            print(f"  {endpoint:<22} {r['rps']:9.1f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+                  f"{r['error_rate']:8.2%}  {status}")
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_ms: float) -> list[str]:
+    """Regresiones contra la linea base: latencias y req/s que empeoran mas que `threshold`."""
+    regressions = []
+    print(f"\n== comparacion contra la linea base ({baseline['meta'].get('git', '?')}), umbral {threshold:.0%}")
+    for name, endpoints in results["scenarios"].items():
+        for endpoint, r in endpoints.items():
+            base = baseline["scenarios"].get(name, {}).get(endpoint)
+            if base is None:
+                continue
+            checks = [(k, r[k], base[k], r[k] > base[k] * (1 + threshold) and r[k] - base[k] > min_ms)
+                      for k in ("p50_ms", "p95_ms", "p99_ms")]
+            checks.append(("rps", r["rps"], base["rps"], r["rps"] < base["rps"] * (1 - threshold)))
+            checks.append(("error_rate", r["error_rate"], base["error_rate"],
+                           r["error_rate"] > base["error_rate"] + 0.01))
+            for key, now, before, bad in checks:
+                change = (now - before) / before if before else 0.0
+                flag = "REGRESION" if bad else ""
+                print(f"  {name:<12} {endpoint:<22} {key:<10} {before:10.2f} -> {now:10.2f} ({change:+7.1%}) {flag}")
+                if bad:
+                    regressions.append(f"{name} {endpoint} {key}: {before} -> {now}")
+    return regressions
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main_async(args) -> dict:
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = set(names) - SCENARIOS.keys()
+    if unknown:
+        raise SystemExit(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    results = {"meta": {
+        "git": _git_revision(), "python": platform.python_version(), "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "args": vars(args),
+    }, "scenarios": {}}
+
+    with Cluster() as cluster:
+        started = time.perf_counter()
+        await seed(cluster, args)
+        print(f"datos cargados en {time.perf_counter() - started:.1f}s: {args.users} users, "
+              f"{args.items} items, {args.orders} orders (dbs en {cluster.workdir})")
+        rng = random.Random(args.seed)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=cluster.url("gateway"), limits=limits, timeout=30) as client:
+            for name in names:
+                scenario = SCENARIOS[name](args)
+                scenario.setup(cluster)
+                try:
+                    results["scenarios"][name] = await run_scenario(client, scenario, args, rng)
+                finally:
+                    scenario.teardown(cluster)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=10, help="segundos medidos por escenario")
+    parser.add_argument("--warmup", type=float, default=1, help="segundos sin medir antes de cada escenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=5000, help="ordenes cargadas antes de medir")
+    parser.add_argument("--hot-skus", type=int, default=5)
+    parser.add_argument("--hot-stock", type=int, default=200)
+    parser.add_argument("--degraded-delay", type=float, default=0.02, help="demora fija hacia users (s)")
+    parser.add_argument("--degraded-tail", type=float, default=0.25, help="demora extra de la cola (s)")
+    parser.add_argument("--degraded-tail-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=os.path.join("data", "bench", time.strftime("load-%Y%m%d-%H%M%S.json")))
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.15, help="empeoramiento tolerado (0.15 = 15%%)")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="diferencia minima de latencia para contar")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print_report(results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresultados en {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regresiones:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nsin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Costo del middleware de metricas por request.
+
+Llama a una app FastAPI minima directo por ASGI (sin red ni cliente HTTP, asi
+no hay ruido), una vez sin instrumentar y otra con `instrument_app`, y reporta
+los microsegundos que agrega el middleware a cada request.
+
+    python -m bench.metrics_overhead --requests 20000
+"""
+import argparse, asyncio, time
+
+from fastapi import FastAPI
+
+from common.metrics import instrument_app
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id}
+
+    if instrumented:
+        instrument_app(app, "bench")
+    return app
+
+
+async def run(app: FastAPI, requests: int) -> float:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def call(i: int):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": "GET", "scheme": "http", "path": f"/items/{i}", "raw_path": f"/items/{i}".encode(),
+            "root_path": "", "query_string": b"", "headers": [], "server": ("bench", 80), "client": ("bench", 1),
+        }
+        await app(scope, receive, send)
+
+    for i in range(200):  # calentamiento (arma el middleware stack)
+        await call(i)
+    start = time.perf_counter()
+    for i in range(requests):
+        await call(i)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main_async(args):
+    plain, instrumented = build_app(False), build_app(True)
+    results = {"sin metricas": [], "con metricas": []}
+    for _ in range(args.rounds):  # alternar rondas para repartir el ruido
+        results["sin metricas"].append(await run(plain, args.requests))
+        results["con metricas"].append(await run(instrumented, args.requests))
+    best = {label: min(values) for label, values in results.items()}
+    print(f"{args.requests} requests x {args.rounds} rondas (mejor ronda)")
+    for label, us in best.items():
+        print(f"{label:>14}: {us:7.1f} us/request")
+    print(f"{'overhead':>14}: {best['con metricas'] - best['sin metricas']:7.1f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
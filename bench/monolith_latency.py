@@ -0,0 +1,79 @@
+"""Latencia por orden: servicios separados (3 saltos HTTP por loopback) vs modo monolito.
+
+Levanta el camino completo de dos formas (`bench.cluster`): los 4 procesos
+uvicorn, y solo el gateway con `GATEWAY_MONOLITH=1`. En cada una carga usuarios e
+items por el gateway y mide `POST /orders` de a uno (latencia por orden) y con
+`--concurrency` clientes (throughput).
+
+    python -m bench.monolith_latency --orders 500 --concurrency 16
+"""
+import argparse, asyncio, random, time
+
+import httpx
+
+from .cluster import Cluster
+from .load import percentile
+
+
+async def measure(base_url: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        for i in range(args.users):
+            (await client.post("/users/", json={"name": f"u{i}", "email": f"u{i}@bench.local"})).raise_for_status()
+        for i in range(args.items):
+            (await client.post("/items/", json={"name": f"i{i}", "sku": f"SKU-{i}", "stock": 10**9})).raise_for_status()
+        rng = random.Random(args.seed)
+
+        async def order() -> float:
+            body = {"user_id": rng.randint(1, args.users), "item_sku": f"SKU-{rng.randrange(args.items)}", "qty": 1}
+            start = time.perf_counter()
+            r = await client.post("/orders/", json=body)
+            r.raise_for_status()
+            return time.perf_counter() - start
+
+        for _ in range(args.warmup):
+            await order()
+        sequential = [await order() for _ in range(args.orders)]
+
+        queue = iter(range(args.orders))
+        concurrent = []
+
+        async def worker():
+            for _ in queue:
+                concurrent.append(await order())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        "p50": percentile(sequential, 50) * 1000,
+        "p95": percentile(sequential, 95) * 1000,
+        "rps": len(concurrent) / elapsed,
+        "p95_conc": percentile(concurrent, 95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = {}
+    for label, monolith in (("servicios", False), ("monolito", True)):
+        with Cluster(monolith=monolith) as cluster:
+            results[label] = asyncio.run(measure(cluster.url("gateway"), args))
+    print(f"POST /orders: {args.orders} de a uno y {args.orders} con {args.concurrency} clientes")
+    print(f"{'':>10} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8} {'p95 ms (conc)':>14}")
+    for label, r in results.items():
+        print(f"{label:>10} {r['p50']:8.2f} {r['p95']:8.2f} {r['rps']:8.1f} {r['p95_conc']:14.2f}")
+    saved = results["servicios"]["p50"] - results["monolito"]["p50"]
+    print(f"ahorro por orden (p50): {saved:.2f} ms ({saved / results['servicios']['p50']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Reportes de ordenes: agregar en el cliente (bajar todas las ordenes) vs filtros indexados y `/orders/stats`.
+
+Levanta el cluster (`bench.cluster`), carga `--orders` ordenes directo en la db de
+orders-service (repartidas en `--days` dias y `--skus` SKUs, con su rollup) y mide
+contra orders-service:
+
+- `cliente stats`: baja todas las ordenes en NDJSON y suma unidades por SKU y dia.
+- `server stats`: `GET /orders/stats?item_sku=<sku>` (lee solo el rollup).
+- `cliente sku`: baja todo y filtra las ordenes de un SKU.
+- `server sku`: `GET /orders/?item_sku=<sku>&limit=N` (indice (item_sku, id)).
+
+    python -m bench.order_stats --orders 200000 --requests 20
+"""
+import argparse, json, os, random, sqlite3, time
+from collections import Counter
+
+import httpx
+
+from .cluster import Cluster
+from .item_search import timed
+from .load import percentile
+
+DAY = 86400
+
+
+def seed(db_path: str, args, rng: random.Random):
+    db = sqlite3.connect(db_path)
+    start = time.time() - args.days * DAY
+    rows = ((rng.randint(1, 1000), f"SKU-{rng.randint(1, args.skus)}", rng.randint(1, 5), "CREATED",
+             start + rng.random() * args.days * DAY) for _ in range(args.orders))
+    with db:
+        db.executemany("INSERT INTO orders (user_id, item_sku, qty, status, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+        # el rollup se llena igual que en la migracion (orders-service lo mantiene al crear ordenes)
+        db.execute("DELETE FROM order_daily_sales")
+        db.execute("INSERT INTO order_daily_sales (item_sku, day, orders, units) "
+                   "SELECT item_sku, date(created_at, 'unixepoch'), count(*), sum(qty) FROM orders "
+                   "GROUP BY item_sku, date(created_at, 'unixepoch')")
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--skus", type=int, default=500)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=1000, help="filas por pagina del lado del servidor")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with Cluster() as cluster:
+        seed(os.path.join(cluster.workdir, "orders.db"), args, rng)
+        client = httpx.Client(base_url=cluster.url("orders"), timeout=300)
+        sku = "SKU-7"
+
+        def download():
+            r = client.get("/", headers={"Accept": "application/x-ndjson"})
+            return r, list(map(json.loads, r.text.splitlines()))
+
+        def client_stats():
+            r, orders = download()
+            units = Counter()
+            for o in orders:
+                if o["item_sku"] == sku:
+                    units[o["created_at"][:10]] += o["qty"]
+            return len(r.content), len(units)
+
+        def client_sku():
+            r, orders = download()
+            return len(r.content), len([o for o in orders if o["item_sku"] == sku][:args.limit])
+
+        def server(path, params):
+            def run():
+                r = client.get(path, params=params)
+                r.raise_for_status()
+                return len(r.content), len(r.json())
+            return run
+
+        cases = {
+            "cliente stats": client_stats,
+            "server stats": server("/stats", {"item_sku": sku}),
+            "cliente sku": client_sku,
+            "server sku": server("/", {"item_sku": sku, "limit": args.limit}),
+        }
+        results = {label: timed(fn, args.requests) for label, fn in cases.items()}
+
+    print(f"{args.orders} ordenes, {args.skus} SKUs, {args.days} dias, {args.requests} requests por caso")
+    print(f"{'':>14} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>12} {'filas':>6}")
+    for label, (times, size, count) in results.items():
+        print(f"{label:>14} {percentile(times, 50) * 1000:9.1f} {percentile(times, 95) * 1000:9.1f} {size:12,} {count:6}")
+
+
+if __name__ == "__main__":
+    main()
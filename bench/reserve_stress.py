@@ -0,0 +1,94 @@
+"""Stress de reservas concurrentes sobre un SKU caliente.
+
+Dispara miles de reservas de 1 unidad en paralelo contra un item con menos stock
+que reservas y verifica que nunca se sobrevenda: exactamente `stock` reservas
+salen bien, cada una ve un stock nuevo distinto y el final queda en 0.
+
+    python -m bench.reserve_stress                               # en proceso contra SQLite (aiosqlite)
+    python -m bench.reserve_stress --url http://127.0.0.1:8002   # contra items-service levantado
+"""
+import argparse, asyncio, importlib, os, tempfile, time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.db import make_async_engine
+
+crud = importlib.import_module("items-service.app.crud")
+models = importlib.import_module("items-service.app.models")
+
+
+async def run_local(sku: str, stock: int, requests: int, workers: int) -> tuple[list[int], int, float]:
+    path = os.path.join(tempfile.mkdtemp(prefix="reserve-stress-"), "items.db")
+    engine = make_async_engine("items", url=f"sqlite:///{path}", pool_size=workers, max_overflow=0)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with AsyncSession(engine) as db:
+        db.add(models.Item(name="hot", sku=sku, stock=stock))
+        await db.commit()
+
+    async def reserve():
+        async with AsyncSession(engine) as db:
+            row = await crud.reserve_stock(db, sku, 1)
+            return None if row is None else row.stock
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(reserve() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    async with AsyncSession(engine) as db:
+        final = (await crud.get_item_by_sku(db, sku)).stock
+    await engine.dispose()
+    return [r for r in results if r is not None], final, elapsed
+
+
+async def run_http(url: str, sku: str, stock: int, requests: int, workers: int) -> tuple[list[int], int, float]:
+    import httpx
+    from common.auth import add_service_auth
+
+    limits = httpx.Limits(max_connections=workers)
+    async with httpx.AsyncClient(base_url=url, headers=add_service_auth({}), limits=limits, timeout=60) as client:
+        r = await client.post("/", json={"name": "hot", "sku": sku, "stock": stock})
+        r.raise_for_status()
+        item_id = r.json()["id"]
+
+        async def reserve():
+            r = await client.post("/reserve", json={"sku": sku, "qty": 1})
+            return r.json()["stock"] if r.status_code == 200 else None
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(reserve() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+        r = await client.get("/", params={"after": item_id - 1, "limit": 1})
+        final = r.json()[0]["stock"]
+        await client.delete(f"/{item_id}")
+    return [r for r in results if r is not None], final, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stock", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=64, help="conexiones concurrentes")
+    parser.add_argument("--url", help="URL de items-service; sin esto corre en proceso")
+    args = parser.parse_args()
+
+    sku = f"HOT-{int(time.time() * 1000)}"
+    if args.url:
+        ok, final, elapsed = asyncio.run(run_http(args.url, sku, args.stock, args.requests, args.workers))
+    else:
+        ok, final, elapsed = asyncio.run(run_local(sku, args.stock, args.requests, args.workers))
+
+    expected = min(args.stock, args.requests)
+    assert len(ok) == expected, f"{len(ok)} reservas OK, esperadas {expected}"
+    assert min(ok, default=0) >= 0, "stock negativo"
+    assert sorted(ok) == list(range(args.stock - expected, args.stock)), "dos reservas vieron el mismo stock"
+    assert final == args.stock - expected, f"stock final {final}, esperado {args.stock - expected}"
+
+    print(f"reservas: {args.requests} ({len(ok)} ok, {args.requests - len(ok)} sin stock), "
+          f"workers: {args.workers}, stock final: {final}")
+    print(f"tiempo: {elapsed:.2f}s, throughput: {args.requests / elapsed:,.0f} reservas/s")
+
+
+if __name__ == "__main__":
+    main()
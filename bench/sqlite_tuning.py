@@ -0,0 +1,80 @@
+"""Throughput mixto lectura/escritura: engine sin pragmas vs `common.db.make_async_engine`.
+
+Durante `--seconds` corren `--writers` tareas reservando stock (UPDATE + commit)
+y `--readers` tareas listando paginas de 100 items, primero con el engine sin
+pragmas (journal rollback, synchronous=FULL) y despues con WAL + pragmas. Ambos
+usan el mismo pool, asi solo cambia la configuracion de SQLite.
+
+    python -m bench.sqlite_tuning --seconds 5 --writers 4 --readers 8
+"""
+import argparse, asyncio, importlib, os, random, tempfile, time
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from common.db import make_async_engine
+
+crud = importlib.import_module("items-service.app.crud")
+models = importlib.import_module("items-service.app.models")
+
+
+async def seed(engine, n_items: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.execute(insert(models.Item), [
+            {"name": f"item {i}", "sku": f"SKU-{i:06d}", "stock": 10**9} for i in range(n_items)
+        ])
+
+
+async def run(engine, n_items: int, seconds: float, writers: int, readers: int) -> dict:
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    stop = time.perf_counter() + seconds
+
+    async def writer():
+        while time.perf_counter() < stop:
+            try:
+                async with AsyncSession(engine) as db:
+                    await crud.reserve_stock(db, f"SKU-{random.randrange(n_items):06d}", 1)
+                counts["writes"] += 1
+            except Exception:
+                counts["errors"] += 1
+
+    async def reader():
+        while time.perf_counter() < stop:
+            async with AsyncSession(engine) as db:
+                await crud.list_items(db, 100, random.randrange(n_items))
+            counts["reads"] += 1
+
+    await asyncio.gather(*[writer() for _ in range(writers)], *[reader() for _ in range(readers)])
+    return {k: v / seconds if k != "errors" else v for k, v in counts.items()}
+
+
+async def compare(args):
+    tmp = tempfile.mkdtemp(prefix="sqlite-tuning-")
+    pool = {"poolclass": AsyncAdaptedQueuePool, "pool_size": args.writers + args.readers, "max_overflow": 0}
+    engines = {
+        "sin pragmas": create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'before.db')}", **pool),
+        "common.db (WAL)": make_async_engine("items", url=f"sqlite:///{os.path.join(tmp, 'after.db')}", **pool),
+    }
+    print(f"{args.writers} writers + {args.readers} readers, {args.seconds:g}s, {args.items} items")
+    for label, engine in engines.items():
+        await seed(engine, args.items)
+        r = await run(engine, args.items, args.seconds, args.writers, args.readers)
+        print(f"{label:>16}: {r['writes']:8,.0f} writes/s  {r['reads']:8,.0f} reads/s  errores: {r['errors']}")
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    args = parser.parse_args()
+
+    asyncio.run(compare(args))
+
+
+if __name__ == "__main__":
+    main()
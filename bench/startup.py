@@ -0,0 +1,128 @@
+"""Tiempo de arranque: uvicorn por servicio vs `run.py` (esquema una vez, preload y fork).
+
+Cada modo levanta users, items, orders y el gateway sobre dbs temporales nuevas y mide
+desde que lanza los procesos hasta que cada servicio respondio `/ready` desde todos
+sus workers (pide `/ready` con conexiones nuevas hasta ver `--workers` pids distintos):
+
+- `uvicorn`: un proceso por servicio, como `run.ps1` o `bench.cluster` (siempre 1 worker).
+- `uvicorn --workers N`: el multiproceso de uvicorn; cada worker importa la app y crea el esquema.
+- `run.py`: los mismos N workers por servicio forkeados desde un launcher que ya importo todo.
+
+    python -m bench.startup --workers 2 --rounds 3
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+
+import httpx
+
+from .cluster import ROOT, SERVICES, free_port
+
+
+def _env(workdir: str, ports: dict[str, int]) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT,
+               HTTP_BREAKER_STATE=os.path.join(workdir, "http_breakers.db"), GATEWAY_PORT=str(ports["gateway"]))
+    for name in ("users", "items", "orders"):
+        env[f"{name.upper()}_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, name + '.db')}"
+        env[f"{name.upper()}_SERVICE_URL"] = f"http://127.0.0.1:{ports[name]}"
+    return env
+
+
+def _wait_ready(ports: dict[str, int], workers: int, procs: list[subprocess.Popen], timeout: float = 120):
+    start = time.perf_counter()
+    pending = {name: set() for name in ports}
+    with httpx.Client(timeout=2, limits=httpx.Limits(max_keepalive_connections=0)) as client:
+        while pending:
+            if any(p.poll() is not None for p in procs):
+                raise RuntimeError("un proceso termino al arrancar")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"sin /ready de todos los workers en {timeout}s: {sorted(pending)}")
+            for name in list(pending):
+                try:
+                    r = client.get(f"http://127.0.0.1:{ports[name]}/ready")
+                except httpx.TransportError:
+                    continue
+                if r.status_code == 200:
+                    pending[name].add(r.json()["pid"])
+                    if len(pending[name]) >= workers:
+                        del pending[name]
+            time.sleep(0.01)
+
+
+def _stop(procs: list[subprocess.Popen]):
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def run(mode: str, workers: int) -> tuple[float, dict | None]:
+    """Devuelve (segundos hasta todo listo, reporte `launcher.ready` de run.py o None)."""
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    ports = {name: free_port() for name in SERVICES}
+    env = _env(workdir, ports)
+    log = open(os.path.join(workdir, "out.log"), "wb")
+    start = time.perf_counter()
+    if mode == "run.py":
+        procs = [subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py"), "--workers",
+                                   ",".join(f"{name}={workers}" for name in SERVICES)],
+                                  cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)]
+    else:
+        extra = ["--workers", str(workers)] if mode != "uvicorn" else []
+        procs = [subprocess.Popen([sys.executable, "-m", "uvicorn", f"{module}:app", "--port", str(ports[name]),
+                                   "--app-dir", ROOT, "--log-level", "warning", "--no-access-log", *extra],
+                                  cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+                 for name, module in SERVICES.items()]
+    try:
+        _wait_ready(ports, workers if mode != "uvicorn" else 1, procs)
+        elapsed = time.perf_counter() - start  # desde el Popen
+        report = _launcher_report(os.path.join(workdir, "out.log")) if mode == "run.py" else None
+    finally:
+        _stop(procs)
+        log.close()
+    return elapsed, report
+
+
+def _launcher_report(path: str, timeout: float = 10) -> dict | None:
+    # el launcher loguea `launcher.ready` despues de su propio /ready por la red
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(path, "rb") as f:
+            for line in f:
+                if b'"launcher.ready"' in line:
+                    return json.loads(line)
+        time.sleep(0.05)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"arranque de los 4 servicios hasta /ready de cada worker, mediana de {args.rounds} corridas")
+    print(f"{'':>22} {'workers':>8} {'ms':>8}")
+    reports = []
+    for mode in ("uvicorn", "uvicorn --workers", "run.py"):
+        times = []
+        for _ in range(args.rounds):
+            elapsed, report = run(mode, args.workers)
+            times.append(elapsed)
+            if report:
+                reports.append(report)
+        workers = 1 if mode == "uvicorn" else args.workers
+        print(f"{mode:>22} {workers:8} {statistics.median(times) * 1000:8.0f}")
+
+    if reports:
+        last = reports[-1]
+        print(f"\nrun.py (ultima corrida, launcher.ready): total {last['total_ms']:.0f} ms, "
+              f"del fork a todos listos {last['fork_to_ready_ms']:.0f} ms")
+        print(f"{'':>10} {'import ms':>10} {'esquema ms':>11} {'fork->ready ms':>15}")
+        for name, t in last["services"].items():
+            print(f"{name:>10} {t['import_ms']:10.0f} {t.get('schema_ms', 0):11.0f} {t['ready_ms']:15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
 import os
 from fastapi import Header, HTTPException
+from .tracing import trace_headers
 
 # busca en las variables de entorno el SS
 SECRET = os.getenv("SERVICE_SECRET", "dev-secret")
 
 def add_service_auth(headers: dict) -> dict:
-    """Agrega el token secreto a los headers antes de llamar otro servicio."""
+    """Agrega el token secreto (y los headers del trace en curso) antes de llamar otro servicio."""
     headers = headers.copy()
     headers["X-Service-Token"] = SECRET
+    headers.update(trace_headers())
     return headers
 
 def verify_service_token(x_service_token: str = Header(default=None)):
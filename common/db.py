@@ -0,0 +1,120 @@
+import os
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Pragmas de SQLite que se aplican a cada conexion nueva del pool
+JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")        # lectores no bloquean al escritor
+SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")       # en WAL: fsync solo en checkpoints
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))    # negativo = KiB (64 MiB)
+TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+
+# Pool de conexiones
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# Engine aparte (solo lectura) para las rutas GET
+SEPARATE_READ_ENGINE = os.getenv("DB_SEPARATE_READ_ENGINE", "0") == "1"
+
+# Crear el esquema al importar cada servicio. run.py lo crea una vez antes de forkear
+# los workers y lo apaga (DB_INIT_SCHEMA=0) para que no compitan por el mismo ALTER
+INIT_SCHEMA = os.getenv("DB_INIT_SCHEMA", "1") == "1"
+
+
+def database_url(name: str) -> str:
+    """URL de la db del servicio: `<NAME>_DATABASE_URL` o `sqlite:///data/<name>.db`."""
+    return os.getenv(f"{name.upper()}_DATABASE_URL", f"sqlite:///data/{name}.db")
+
+
+def _sqlite_pragmas(read_only: bool):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        cur.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        cur.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        cur.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+        cur.execute(f"PRAGMA temp_store={TEMP_STORE}")
+        if read_only:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+    return on_connect
+
+
+def make_engine(name: str, url: str | None = None, read_only: bool = False, **kwargs) -> Engine:
+    """Crea el engine de un servicio con pool configurable y pragmas de SQLite via evento connect."""
+    url = make_url(url or database_url(name))
+    options = {"pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}  # necesario para SQLite + threads
+        if url.database and url.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+    options.update(kwargs)
+
+    engine = create_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+def make_engines(name: str, url: str | None = None) -> tuple[Engine, Engine]:
+    """Devuelve (engine, read_engine). Sin DB_SEPARATE_READ_ENGINE=1 ambos son el mismo."""
+    engine = make_engine(name, url)
+    if not SEPARATE_READ_ENGINE:
+        return engine, engine
+    return engine, make_engine(name, url, read_only=True)
+
+
+def _async_url(url: str):
+    # sqlite:///x.db -> sqlite+aiosqlite:///x.db (driver async sobre el mismo archivo)
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.get_driver_name() != "aiosqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+
+def make_async_engine(name: str, url: str | None = None, read_only: bool = False, **kwargs) -> AsyncEngine:
+    """Version async de `make_engine` (aiosqlite), con el mismo pool y los mismos pragmas."""
+    url = _async_url(url or database_url(name))
+    options = {"pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT}
+    if url.get_backend_name() == "sqlite":
+        # aiosqlite usa NullPool por defecto: una conexion (y un thread) nuevo por sesion
+        options["poolclass"] = AsyncAdaptedQueuePool
+        if url.database and url.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(url.database)), exist_ok=True)
+    options.update(kwargs)
+
+    engine = create_async_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas(read_only))
+    return engine
+
+
+def make_async_engines(name: str, url: str | None = None) -> tuple[AsyncEngine, AsyncEngine]:
+    """Devuelve (engine, read_engine) async. Sin DB_SEPARATE_READ_ENGINE=1 ambos son el mismo."""
+    engine = make_async_engine(name, url)
+    if not SEPARATE_READ_ENGINE:
+        return engine, engine
+    return engine, make_async_engine(name, url, read_only=True)
+
+
+async def warm_up(*engines: AsyncEngine):
+    """Chequea la db y llena el pool: abre `pool_size` conexiones de cada engine con un `SELECT 1`.
+
+    Las conexiones vuelven al pool abiertas (con los pragmas ya aplicados), asi las
+    primeras requests no pagan el connect. Lanza la excepcion del driver si la db no responde.
+    """
+    for engine in dict.fromkeys(engines):  # sin DB_SEPARATE_READ_ENGINE los dos son el mismo
+        size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+        conns = []
+        try:
+            for _ in range(size):
+                conns.append(conn := await engine.connect())
+                await conn.execute(text("SELECT 1"))
+        finally:
+            for conn in conns:
+                await conn.close()
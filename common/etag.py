@@ -0,0 +1,68 @@
+"""Version por tabla y ETags para GETs condicionales.
+
+Cada servicio tiene una tabla `table_versions` (name -> version) que el crud
+incrementa en la misma transaccion que cualquier escritura. Las rutas GET leen
+solo esa fila (por PK) para armar el ETag; si el cliente manda un
+`If-None-Match` que coincide responden 304 sin correr la consulta.
+
+El detalle de una fila (`GET /users/{id}`) usa en cambio un hash de la fila misma
+(`row_etag`): un cambio en otra fila no invalida las copias que ya tienen los clientes.
+"""
+import hashlib, json, time
+from fastapi import Request, Response
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from .pagination import wants_ndjson
+
+
+def versions_table(metadata: MetaData) -> Table:
+    return Table(
+        "table_versions", metadata,
+        Column("name", String(60), primary_key=True),
+        Column("version", Integer, nullable=False),
+    )
+
+
+async def bump(db: AsyncSession, table: Table, name: str):
+    """Incrementa la version de `name` (sin commit: va en la transaccion de la escritura)."""
+    # la primera version sale del reloj: una db nueva no repite los ETags de una db anterior
+    stmt = insert(table).values(name=name, version=int(time.time() * 1000))
+    await db.execute(stmt.on_conflict_do_update(index_elements=[table.c.name],
+                                                set_={"version": table.c.version + 1}))
+
+
+async def current(db: AsyncSession, table: Table, name: str) -> int:
+    return await db.scalar(select(table.c.version).where(table.c.name == name)) or 0
+
+
+def make_etag(name: str, version: int, request: Request) -> str:
+    """ETag fuerte de la representacion: tabla, version y formato (json o ndjson segun Accept)."""
+    variant = "ndjson" if wants_ndjson(request) else "json"
+    return f'"{name}-{version}-{variant}"'
+
+
+def row_etag(name: str, row: dict) -> str:
+    """ETag fuerte de una fila: hash de sus campos serializados (cambia solo si cambia la fila)."""
+    digest = hashlib.blake2b(json.dumps(row, sort_keys=True, default=str).encode(), digest_size=12).hexdigest()
+    return f'"{name}-{digest}"'
+
+
+def matches(request: Request, etag: str) -> bool:
+    """`If-None-Match` con comparacion debil (RFC 9110 13.1.2): acepta `*` y listas."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def set_headers(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def not_modified(etag: str) -> Response:
+    return set_headers(Response(status_code=304), etag)
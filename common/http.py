@@ -1,50 +1,453 @@
-import httpx, time
+import asyncio, functools, os, random, sqlite3, threading, time, uuid, weakref
+from collections import deque
+from dataclasses import dataclass
+import httpx
+from . import tracing
+from .logging import log_json
+from .metrics import REGISTRY
 
-# Estado en memoria para breaker
-_failures = {}
-_open_until = {}
 MAX_FAILS = 3         # cuántos fallos antes de abrir breaker
 COOLDOWN = 10         # segundos que queda abierto el breaker
 
-# Verifica si el breaker esta abierto
-def _is_open(host: str) -> bool:
-    until = _open_until.get(host, 0)
-    return time.time() < until
-
-# Suma fallos, si alcanzamos el maximo abrimos el breaker
-def _record_failure(host: str):
-    _failures[host] = _failures.get(host, 0) + 1
-    if _failures[host] >= MAX_FAILS:
-        _open_until[host] = time.time() + COOLDOWN
-        _failures[host] = 0  # resetea contador
-
-# si el request es exitoso, limpiamos variables
-def _record_success(host: str):
-    _failures[host] = 0
-    _open_until[host] = 0
-
-
-def request(method: str, url: str, **kwargs):
-    """Cliente con timeout, retry y mini breaker."""
-    host = url.split("/")[2]  
-
-    # si el breaker esta abierto, no intentar llamar
-    if _is_open(host):
-        raise RuntimeError(f"Circuit breaker abierto para {host}")
-
-    # intentamos 3 veces
-    tries = 0
-    last_exc = None
-    while tries < 3:
-        tries += 1
+# Estado de los breakers compartido entre procesos (varios workers, ver run.py) en un
+# archivo SQLite; vacio = cada proceso con el suyo
+BREAKER_STATE_FILE = os.getenv("HTTP_BREAKER_STATE", "")
+BREAKER_SYNC = float(os.getenv("HTTP_BREAKER_SYNC", "0.25"))  # cada cuanto se relee el estado de un host
+
+# Limites del pool compartido (por proceso y por event loop)
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Los POST/PATCH salen con esta clave (la misma en todos los reintentos) para que el servicio no los aplique dos veces
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+HEDGE_WINDOW = 512    # ultimas latencias por host, metodo y ruta para calcular el delay del hedge
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Reintentos de una llamada: intentos, timeout por intento y backoff exponencial con jitter."""
+    attempts: int = 3
+    timeout: float = 3.0
+    backoff: float = 0.25      # base del backoff (segundos)
+    max_backoff: float = 2.0   # tope de espera entre intentos
+
+    def delay(self, attempt: int) -> float:
+        # "full jitter": espera aleatoria entre 0 y el backoff exponencial
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+@dataclass(frozen=True)
+class BreakerPolicy:
+    """Cuándo abrir el breaker de un host y cuántas pruebas dejar pasar al medio abrirlo."""
+    max_fails: int = MAX_FAILS
+    cooldown: float = COOLDOWN
+    half_open_probes: int = 1
+
+
+@dataclass(frozen=True)
+class HedgePolicy:
+    """Hedge: si un intento tarda mas que el percentil `quantile` reciente, sale otro igual y gana el primero."""
+    quantile: float = 0.95
+    default_delay: float = 0.05   # mientras no haya `min_samples` latencias del host
+    min_samples: int = 20
+    min_delay: float = 0.002
+
+
+DEFAULT_RETRY = RetryPolicy()
+DEFAULT_BREAKER = BreakerPolicy()
+DEFAULT_HEDGE = HedgePolicy()
+
+CLIENT_LATENCY = REGISTRY.histogram(
+    "http_client_request_duration_seconds", "Latencia de cada intento hacia otro servicio",
+    ("host", "method", "outcome"))
+CLIENT_RETRIES = REGISTRY.counter(
+    "http_client_retries_total", "Reintentos hacia otro servicio", ("host", "method"))
+BREAKER_STATE = REGISTRY.gauge(
+    "circuit_breaker_state", "Estado del breaker por host (0=closed, 1=half_open, 2=open)", ("host",))
+BREAKER_REJECTED = REGISTRY.counter(
+    "circuit_breaker_rejected_total", "Llamadas no hechas por breaker abierto", ("host",))
+CLIENT_HEDGES = REGISTRY.counter(
+    "http_client_hedges_total", "Segundos intentos en paralelo (hedge) y cual respondio primero", ("host", "method", "winner"))
+
+
+class CircuitOpenError(RuntimeError):
+    """El breaker del host está abierto, no se llama al servicio."""
+
+
+class UpstreamError(RuntimeError):
+    """Se agotaron los reintentos contra el servicio."""
+
+
+class BreakerStore:
+    """Fallos seguidos y hasta cuando esta abierto cada host, en un archivo SQLite que comparten los procesos.
+
+    La lectura de un host se cachea `BREAKER_SYNC` segundos y solo se escribe al fallar
+    o cuando se recupera un host que tenia fallos: una llamada normal no toca el archivo.
+    Los tiempos son de reloj (`time.time()`), comparables entre procesos.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+        self._cache: dict[str, tuple[float, int, float]] = {}  # host -> (leido en, fallos, abierto hasta)
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # tambien tras un fork: la conexion del padre no se comparte
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS breakers "
+                         "(host TEXT PRIMARY KEY, failures INTEGER NOT NULL, open_until REAL NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+            self._cache.clear()
+        return self._conn
+
+    def _read(self, db: sqlite3.Connection, host: str) -> tuple[int, float]:
+        row = db.execute("SELECT failures, open_until FROM breakers WHERE host = ?", (host,)).fetchone()
+        return row or (0, 0.0)
+
+    def _write(self, db: sqlite3.Connection, host: str, failures: int, open_until: float):
+        db.execute("INSERT INTO breakers (host, failures, open_until) VALUES (?, ?, ?) ON CONFLICT(host) "
+                   "DO UPDATE SET failures = excluded.failures, open_until = excluded.open_until",
+                   (host, failures, open_until))
+        self._cache[host] = (time.monotonic(), failures, open_until)
+
+    def get(self, host: str) -> tuple[int, float]:
+        """(fallos seguidos, abierto hasta) del host, releido a lo sumo cada `BREAKER_SYNC` segundos."""
+        cached = self._cache.get(host)
+        if cached is not None and time.monotonic() - cached[0] < BREAKER_SYNC and self._pid == os.getpid():
+            return cached[1], cached[2]
+        with self._lock:
+            failures, open_until = self._read(self._db(), host)
+        self._cache[host] = (time.monotonic(), failures, open_until)
+        return failures, open_until
+
+    def failure(self, host: str, policy: BreakerPolicy, force_open: bool) -> float:
+        """Suma un fallo del host; con `max_fails` seguidos (o `force_open`) lo abre. Devuelve hasta cuando esta abierto."""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")  # leer y sumar sin que otro proceso escriba en el medio
+            try:
+                failures, open_until = self._read(db, host)
+                failures += 1
+                if force_open or failures >= policy.max_fails:
+                    failures, open_until = 0, time.time() + policy.cooldown
+                self._write(db, host, failures, open_until)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return open_until
+
+    def success(self, host: str):
+        failures, open_until = self.get(host)
+        if failures or open_until:
+            with self._lock:
+                self._write(self._db(), host, 0, 0.0)
+
+
+_store = BreakerStore(BREAKER_STATE_FILE) if BREAKER_STATE_FILE else None
+
+
+class CircuitBreaker:
+    """Breaker por host con estados closed/open/half_open, seguro entre threads y corutinas.
+
+    Con `HTTP_BREAKER_STATE` los fallos seguidos y la apertura se comparten entre procesos
+    (`BreakerStore`); las pruebas de half_open siguen siendo de cada proceso.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = self.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, policy: BreakerPolicy) -> bool:
+        """Pide permiso para llamar. Devuelve True si la llamada es una prueba de half_open."""
+        with self._lock:
+            if self.state == self.CLOSED and _store is not None:
+                # otro proceso pudo haberlo abierto
+                self._open_shared(self._shared(_store.get, self.host, default=(0, 0.0))[1])
+            if self.state == self.OPEN:
+                if time.monotonic() < self._open_until:
+                    raise CircuitOpenError(f"Circuit breaker abierto para {self.host}")
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= policy.half_open_probes:
+                    raise CircuitOpenError(f"Circuit breaker medio abierto para {self.host}")
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probes = max(0, self._probes - 1)
+            self.state = self.CLOSED
+            self._failures = 0
+            if _store is not None:
+                self._shared(_store.success, self.host)
+
+    def record_failure(self, policy: BreakerPolicy, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probes = max(0, self._probes - 1)
+            if _store is not None:
+                open_until = self._shared(_store.failure, self.host, policy, probe or self.state == self.HALF_OPEN)
+                if open_until is not None:
+                    self._open_shared(open_until)
+                    return
+            self._failures += 1
+            # una prueba fallida en half_open vuelve a abrir enseguida
+            if probe or self.state == self.HALF_OPEN or self._failures >= policy.max_fails:
+                self.state = self.OPEN
+                self._open_until = time.monotonic() + policy.cooldown
+                self._failures = 0  # resetea contador
+
+    def _open_shared(self, open_until: float):
+        remaining = open_until - time.time()
+        if remaining > 0:
+            self.state = self.OPEN
+            self._open_until = time.monotonic() + remaining
+            self._failures = 0
+
+    def _shared(self, op, *args, default=None):
+        # si el archivo compartido falla, sigue el breaker de este proceso
         try:
-            with httpx.Client(timeout=3.0) as client:
-                resp = client.request(method, url, **kwargs)
-                resp.raise_for_status()
-                _record_success(host)
-                return resp
-        except Exception as e:
-            last_exc = e
-            _record_failure(host)
-            time.sleep(0.5 * tries)  # backoff 
-    raise last_exc
+            return op(*args)
+        except sqlite3.Error as e:
+            log_json("warn", "breaker.state.error", host=self.host, error=str(e))
+            return default
+
+
+# Un breaker por host
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+_STATE_VALUE = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+def _collect_breakers():
+    for host, breaker in list(_breakers.items()):
+        BREAKER_STATE.set(host, value=_STATE_VALUE[breaker.state])
+
+REGISTRY.register_collector(_collect_breakers)
+
+def get_breaker(host: str) -> CircuitBreaker:
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(host, CircuitBreaker(host))
+    return breaker
+
+
+# Un AsyncClient compartido por event loop (las conexiones quedan atadas al loop que las abrió)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+# Apps montadas en el proceso (modo monolito): origen ("http://host:puerto") -> transport ASGI
+_mounts: dict[str, httpx.AsyncBaseTransport] = {}
+
+def _origin(base_url: str) -> str:
+    url = httpx.URL(base_url)
+    return f"{url.scheme}://{url.netloc.decode('ascii')}"
+
+def mount(base_url: str, app):
+    """Despacha las llamadas a `base_url` directo a `app` (ASGI) dentro del proceso, sin red."""
+    # raise_app_exceptions=False: un error de la app llega como 500, igual que por la red
+    _mounts[_origin(base_url)] = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    _clients.clear()  # los clientes nuevos se crean con los mounts
+
+def transport_for(base_url: str) -> httpx.AsyncBaseTransport | None:
+    """Transport en proceso para `base_url`, o None si el servicio va por la red."""
+    return _mounts.get(_origin(base_url))
+
+def _get_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            mounts=dict(_mounts),
+        )
+    return client
+
+
+def _is_retryable(resp: httpx.Response) -> bool:
+    return resp.status_code >= 500
+
+
+class _Latencies:
+    """Ventana de las ultimas latencias de un host, metodo y ruta; el percentil se recalcula cada tanto."""
+
+    def __init__(self):
+        self.samples: deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self._sorted: list[float] = []
+        self._stale = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def delay(self, policy: HedgePolicy) -> float:
+        if len(self.samples) < policy.min_samples:
+            return policy.default_delay
+        if self._stale >= 32 or not self._sorted:
+            self._sorted, self._stale = sorted(self.samples), 0
+        value = self._sorted[min(len(self._sorted) - 1, int(policy.quantile * len(self._sorted)))]
+        return max(policy.min_delay, value)
+
+
+_latencies: dict[tuple[str, str, str], _Latencies] = {}
+
+
+@functools.lru_cache(maxsize=4096)
+def _route(url: str) -> str:
+    # /users/42 y /users/7 comparten ventana: los segmentos numericos cuentan como uno solo
+    return "/".join("{id}" if part.isdigit() else part for part in httpx.URL(url).path.split("/"))
+
+
+async def _send(client: httpx.AsyncClient, method: str, url: str, hedge: HedgePolicy | None,
+                host: str, **kwargs) -> httpx.Response:
+    """Un intento; con `hedge`, si no respondio en el p95 sale un segundo igual y gana el primero que responda."""
+    window = _latencies.get((host, method, _route(url)))
+    if window is None:
+        window = _latencies.setdefault((host, method, _route(url)), _Latencies())
+    start = time.perf_counter()
+    if hedge is None:
+        resp = await client.request(method, url, **kwargs)
+        window.add(time.perf_counter() - start)
+        return resp
+
+    first = asyncio.ensure_future(client.request(method, url, **kwargs))
+    pending, error = {first}, None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=window.delay(hedge))
+        if done:
+            resp = first.result()
+            window.add(time.perf_counter() - start)
+            return resp
+        second = asyncio.ensure_future(client.request(method, url, **kwargs))
+        started = {first: start, second: time.perf_counter()}
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()  # si el otro responde, ese gana
+                    continue
+                CLIENT_HEDGES.inc(host, method, "hedge" if task is second else "original")
+                window.add(time.perf_counter() - started[task])
+                return task.result()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def arequest(method: str, url: str, *, retry: RetryPolicy | None = None,
+                   breaker: BreakerPolicy | None = None, hedge: HedgePolicy | bool = False,
+                   **kwargs) -> httpx.Response:
+    """Cliente async con pool compartido, timeout, retry con jitter y breaker por host.
+
+    Las respuestas 4xx se devuelven tal cual (el servicio está sano); los errores
+    de red y los 5xx se reintentan y cuentan como fallo para el breaker.
+
+    Los POST/PATCH llevan `Idempotency-Key` (la del caller o una nueva), la misma en
+    todos los reintentos y hedges: el servicio que la respeta no aplica dos veces la
+    misma operacion aunque se haya perdido la respuesta. `hedge=True` (o una
+    `HedgePolicy`) solo para servicios que la respetan o metodos idempotentes.
+    """
+    retry = retry or DEFAULT_RETRY
+    breaker = breaker or DEFAULT_BREAKER
+    hedge = DEFAULT_HEDGE if hedge is True else (hedge or None)
+    host = url.split("/")[2]
+    cb = get_breaker(host)
+    client = _get_client()
+    headers = dict(kwargs.pop("headers", None) or {})
+    if method.upper() in ("POST", "PATCH") and not any(k.lower() == IDEMPOTENCY_HEADER.lower() for k in headers):
+        headers[IDEMPOTENCY_HEADER] = uuid.uuid4().hex
+
+    # un span por llamada y uno por intento: los reintentos y el backoff quedan a la vista
+    with tracing.span(f"{method} {host}{httpx.URL(url).path}", "client", url=url) as call:
+        last_exc: Exception | None = None
+        for attempt in range(1, retry.attempts + 1):
+            # si el breaker esta abierto, no intentar llamar
+            try:
+                probe = cb.acquire(breaker)
+            except CircuitOpenError:
+                BREAKER_REJECTED.inc(host)
+                if call is not None:
+                    call.set(breaker=cb.state)
+                raise
+            try_span = tracing.start_span(f"attempt {attempt}", "client", attempt=attempt)
+            start = time.perf_counter()
+            try:
+                resp = await _send(client, method, url, hedge, host, timeout=retry.timeout,
+                                   headers={**headers, **tracing.trace_headers(try_span)}, **kwargs)
+            except httpx.TransportError as e:
+                CLIENT_LATENCY.observe(host, method, "error", value=time.perf_counter() - start)
+                last_exc = e
+                cb.record_failure(breaker, probe)
+                if try_span is not None:
+                    try_span.set(error=type(e).__name__)
+            else:
+                CLIENT_LATENCY.observe(host, method, str(resp.status_code), value=time.perf_counter() - start)
+                if try_span is not None:
+                    try_span.set(status=resp.status_code)
+                if not _is_retryable(resp):
+                    cb.record_success(probe)
+                    if call is not None:
+                        call.set(status=resp.status_code, attempts=attempt)
+                    if try_span is not None:
+                        try_span.finish()
+                    return resp
+                last_exc = httpx.HTTPStatusError(
+                    f"{resp.status_code} desde {host}", request=resp.request, response=resp
+                )
+                cb.record_failure(breaker, probe)
+            if try_span is not None:
+                try_span.finish()
+            if attempt < retry.attempts:
+                CLIENT_RETRIES.inc(host, method)
+                await asyncio.sleep(retry.delay(attempt))  # backoff sin bloquear el thread
+        if call is not None:
+            call.set(attempts=retry.attempts)
+        raise UpstreamError(f"{method} {url} falló tras {retry.attempts} intentos: {last_exc}") from last_exc
+
+
+# Loop en un thread aparte para el wrapper sync: reutiliza el pool y el backoff async
+_sync_loop: asyncio.AbstractEventLoop | None = None
+_sync_loop_lock = threading.Lock()
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name="common-http", daemon=True).start()
+    return _sync_loop
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Versión sync de `arequest` para código que no corre en un event loop."""
+    future = asyncio.run_coroutine_threadsafe(arequest(method, url, **kwargs), _get_sync_loop())
+    return future.result()
+
+
+async def aclose():
+    """Cierra el cliente compartido del loop actual (llamar en el shutdown del servicio)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,122 @@
+"""Claves de idempotencia (`Idempotency-Key`) para POSTs que cambian estado.
+
+Cada servicio tiene una tabla `idempotency_keys` (key -> status y body de la
+respuesta). El crud guarda la clave en la misma transaccion que la escritura: si
+la misma clave llega dos veces a la vez, el segundo commit choca con la PK y se
+deshace entero. Una clave repetida devuelve la respuesta guardada en vez de
+volver a ejecutar; con otro request (otro `fingerprint`) es un 422.
+
+Dentro de un proceso, `exclusive(key)` deja pasar un request por clave a la vez:
+un reintento o hedge que llega mientras el primero sigue en curso lo espera y
+devuelve lo guardado, en vez de abrir otra transaccion que compita por el lock de
+escritura de SQLite.
+
+Las claves viven `IDEMPOTENCY_TTL` segundos; las vencidas se borran de a poco al
+guardar claves nuevas.
+"""
+import asyncio, contextlib, hashlib, json, os, random, time
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+HEADER = "Idempotency-Key"
+TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+PURGE_RATE = float(os.getenv("IDEMPOTENCY_PURGE_RATE", "0.001"))  # chance de purgar en cada save
+MAX_KEY_LENGTH = 200
+
+__all__ = ["HEADER", "keys_table", "key_from", "fingerprint", "exclusive", "lookup", "lookup_many", "save", "replay"]
+
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def keys_table(metadata: MetaData) -> Table:
+    return Table(
+        "idempotency_keys", metadata,
+        Column("key", String(MAX_KEY_LENGTH), primary_key=True),
+        Column("fingerprint", String(64), nullable=False),
+        Column("status_code", Integer, nullable=False),
+        Column("body", Text, nullable=False),
+        Column("created_at", Float, nullable=False),
+    )
+
+
+def key_from(request: Request) -> str | None:
+    key = request.headers.get(HEADER)
+    if key is not None and not (0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()):
+        raise HTTPException(status_code=400, detail=f"{HEADER} invalida (1 a {MAX_KEY_LENGTH} caracteres imprimibles)")
+    return key
+
+
+def fingerprint(*parts) -> str:
+    """Hash del request (ruta y datos que importan): la misma clave con otro request es un error del cliente."""
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+
+
+@contextlib.asynccontextmanager
+async def exclusive(key: str | None):
+    """Un request por clave a la vez en este proceso (sin clave no hace nada)."""
+    if key is None:
+        yield
+        return
+    while (running := _inflight.get(key)) is not None:
+        await asyncio.shield(running)
+    _inflight[key] = done = asyncio.get_running_loop().create_future()
+    try:
+        yield
+    finally:
+        del _inflight[key]
+        done.set_result(None)
+
+
+async def lookup(db: AsyncSession, table: Table, key: str, fp: str) -> tuple[int, dict] | None:
+    """(status_code, body) guardados para `key`, o None si no esta (o vencio)."""
+    row = (await db.execute(
+        select(table.c.fingerprint, table.c.status_code, table.c.body, table.c.created_at).where(table.c.key == key)
+    )).first()
+    if row is None:
+        return None
+    if row.created_at < time.time() - TTL:
+        # vencida: se borra (va con la transaccion del request) para poder guardarla de nuevo
+        await db.execute(delete(table).where(table.c.key == key))
+        return None
+    if row.fingerprint != fp:
+        raise HTTPException(status_code=422, detail=f"{HEADER} ya usada con otro request")
+    return row.status_code, json.loads(row.body)
+
+
+async def lookup_many(db: AsyncSession, table: Table, fps: dict[str, str]) -> dict[str, tuple[int, dict]]:
+    """Como `lookup` para varias claves (key -> fingerprint) en un solo SELECT."""
+    if not fps:
+        return {}
+    rows = (await db.execute(
+        select(table.c.key, table.c.fingerprint, table.c.status_code, table.c.body, table.c.created_at)
+        .where(table.c.key.in_(list(fps)))
+    )).all()
+    found, expired = {}, []
+    for key, fp, status_code, body, created_at in rows:
+        if created_at < time.time() - TTL:
+            expired.append(key)
+        elif fp != fps[key]:
+            raise HTTPException(status_code=422, detail=f"{HEADER} ya usada con otro request: {key}")
+        else:
+            found[key] = status_code, json.loads(body)
+    if expired:
+        await db.execute(delete(table).where(table.c.key.in_(expired)))
+    return found
+
+
+async def save(db: AsyncSession, table: Table, key: str, fp: str, status_code: int, body: dict):
+    """Guarda la respuesta de `key` (sin commit: va en la transaccion de la escritura)."""
+    now = time.time()
+    if random.random() < PURGE_RATE:
+        await db.execute(delete(table).where(table.c.created_at < now - TTL))
+    await db.execute(table.insert().values(key=key, fingerprint=fp, status_code=status_code,
+                                           body=json.dumps(body, default=str), created_at=now))
+
+
+def replay(response: Response, stored: tuple[int, dict]) -> dict:
+    """Arma la respuesta repetida: mismo status, mismo body y `Idempotent-Replayed: true`."""
+    status_code, body = stored
+    response.status_code = status_code
+    response.headers["Idempotent-Replayed"] = "true"
+    return body
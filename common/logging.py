@@ -1,16 +1,157 @@
-import json, sys, time, os
+import atexit, json, os, queue, random, sys, threading, time
+from .tracing import current_ids, current_service
 
 SERVICE_NAME = os.getenv("SERVICE_NAME", "unknown")
 
+# Nivel minimo, tamaño de la cola y cuándo escribir el lote (por tamaño o por tiempo)
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "warning": 30, "error": 40}
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))  # segundos
+
+def _parse_sampling(spec: str) -> dict[str, float]:
+    # "health.check=0.01,items.listed=0.1" -> {"health.check": 0.01, "items.listed": 0.1}
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        msg, _, rate = part.partition("=")
+        rates[msg.strip()] = float(rate)
+    return rates
+
+SAMPLING = _parse_sampling(os.getenv("LOG_SAMPLE", ""))
+
+# encoder mas rapido si esta instalado
+try:
+    import orjson
+
+    def _dumps(payload: dict) -> bytes:
+        return orjson.dumps(payload, default=str)
+except ImportError:  # pragma: no cover - depende del entorno
+    def _dumps(payload: dict) -> bytes:
+        return json.dumps(payload, default=str).encode()
+
+
+_min_level = LEVELS.get(LOG_LEVEL.lower(), 20)
+_stats = {"written": 0, "dropped": 0, "sampled_out": 0}
+_stats_lock = threading.Lock()
+
+def _count(key: str, n: int = 1):
+    with _stats_lock:
+        _stats[key] += n
+
+def log_stats() -> dict:
+    """Contadores del logger: lineas escritas, descartadas por cola llena y por muestreo."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+class _Writer(threading.Thread):
+    """Thread que vacia la cola, serializa en lote y escribe a stdout. Con `write` escribe
+    el lote con esa funcion (asi `common.tracing` manda los spans a `TRACE_FILE`)."""
+
+    def __init__(self, write=None, name: str = "log-writer"):
+        super().__init__(name=name, daemon=True)
+        self.queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.pid = os.getpid()
+        self.write = write or self._write
+
+    def run(self):
+        batch, waiters = [], []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):  # pedido de flush
+                waiters.append(item)
+            elif item is not None:
+                batch.append(item)
+            if waiters or len(batch) >= BATCH_SIZE or time.monotonic() >= deadline:
+                self.write(batch)
+                batch = []
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                for event in waiters:
+                    event.set()
+                waiters = []
+
+    def _write(self, batch: list[dict]):
+        if not batch:
+            return
+        lines = []
+        for payload in batch:
+            # el timestamp se formatea aca, fuera del request
+            payload["ts"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(payload["ts"]))
+            lines.append(_dumps(payload))
+        data = b"\n".join(lines) + b"\n"
+        try:
+            out = getattr(sys.stdout, "buffer", None)
+            if out is not None:
+                sys.stdout.flush()
+                out.write(data)
+                out.flush()
+            else:
+                sys.stdout.write(data.decode())
+                sys.stdout.flush()
+        except (OSError, ValueError):  # stdout cerrado
+            _count("dropped", len(batch))
+            return
+        _count("written", len(batch))
+
+
+_writer: _Writer | None = None
+_writer_lock = threading.Lock()
+
+def _get_writer() -> _Writer:
+    global _writer
+    writer = _writer
+    # tambien se recrea tras un fork: el thread no sobrevive en el proceso hijo
+    if writer is None or writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = _Writer()
+                _writer.start()
+            writer = _writer
+    return writer
+
+
 def log_json(level: str, msg: str, **kwargs):
-    '''Logear en formato json'''
+    '''Logear en formato json. Solo encola: la serializacion y el write van en otro thread.'''
+    if LEVELS.get(level.lower(), 20) < _min_level:
+        return
+    rate = SAMPLING.get(msg)
+    if rate is not None and random.random() >= rate:
+        _count("sampled_out")
+        return
     payload = {
-        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), # la convierte a string tipo 2025-09-08T00:12:34Z
+        "ts": time.time(),
         "level": level.lower(),
-        "service": SERVICE_NAME,
+        "service": current_service.get() or os.environ.get("SERVICE_NAME", SERVICE_NAME),
         "msg": msg,
-        **kwargs,
     }
-    #mandar texto a la consola de forma manual, flush lo fuerza a mostrarse
-    sys.stdout.write(json.dumps(payload) + "\n")
-    sys.stdout.flush()
+    # dentro de una request, el evento queda atado a su trace
+    trace_id, span_id = current_ids()
+    if trace_id is not None:
+        payload["trace_id"], payload["span_id"] = trace_id, span_id
+    payload.update(kwargs)
+    try:
+        _get_writer().queue.put_nowait(payload)
+    except queue.Full:
+        _count("dropped")
+
+
+def flush_logs(timeout: float = 2.0) -> bool:
+    """Espera a que se escriba todo lo encolado (llamar en el shutdown)."""
+    return _flush(_writer, timeout)
+
+def _flush(writer: _Writer | None, timeout: float) -> bool:
+    if writer is None or writer.pid != os.getpid() or not writer.is_alive():
+        return True
+    done = threading.Event()
+    try:
+        writer.queue.put(done, timeout=timeout)
+    except queue.Full:
+        return False
+    return done.wait(timeout)
+
+atexit.register(flush_logs)
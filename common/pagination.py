@@ -0,0 +1,59 @@
+import os
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+# Paginacion por cursor (keyset sobre id): ?limit=N&after=<ultimo id visto>
+DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "100"))
+MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
+NDJSON_CHUNK = int(os.getenv("NDJSON_CHUNK", "500"))  # filas por chunk en modo streaming
+
+NDJSON = "application/x-ndjson"
+
+def wants_ndjson(request: Request) -> bool:
+    """True si el cliente pidio `Accept: application/x-ndjson`."""
+    return NDJSON in request.headers.get("accept", "")
+
+def page_limit(limit: int | None, after: int | None) -> int | None:
+    """Filas por pagina. Sin `limit` ni `after` es None: la lista completa, como antes de paginar
+    (un cliente que no lee `X-Next-Cursor` no recibe una lista cortada sin enterarse)."""
+    if limit is None and after is None:
+        return None
+    return limit or DEFAULT_LIMIT
+
+def paginate(rows: list, limit: int | None) -> tuple[list, int | None]:
+    """Recibe hasta limit+1 filas; devuelve la pagina y el cursor siguiente (None si no hay mas)."""
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+def set_next_cursor(request: Request, response: Response, next_cursor: int | None, limit: int):
+    """Publica el cursor siguiente en `X-Next-Cursor` y en un header `Link: rel="next"`."""
+    if next_cursor is None:
+        return
+    response.headers["X-Next-Cursor"] = str(next_cursor)
+    # referencia relativa: funciona igual detras del gateway (otra ruta/host)
+    next_query = request.url.include_query_params(after=next_cursor, limit=limit).query
+    response.headers["Link"] = f'<?{next_query}>; rel="next"'
+
+def set_next_offset(request: Request, response: Response, offset: int, count: int, has_more: bool):
+    """Igual que `set_next_cursor` para resultados ordenados por relevancia (paginados por `offset`)."""
+    if not has_more:
+        return
+    response.headers["X-Next-Offset"] = str(offset + count)
+    next_query = request.url.include_query_params(offset=offset + count, limit=count).query
+    response.headers["Link"] = f'<?{next_query}>; rel="next"'
+
+def ndjson_response(session_factory, stmt, model) -> StreamingResponse:
+    """Streamea `stmt` como NDJSON leyendo en chunks de un cursor, con memoria constante.
+
+    Abre su propia sesion async: la de `get_db` se cierra antes de que termine el streaming.
+    """
+    async def rows():
+        async with session_factory() as db:
+            result = await db.stream_scalars(stmt.execution_options(yield_per=NDJSON_CHUNK))
+            async for chunk in result.partitions():
+                # con yield_per el identity map no retiene los objetos de chunks anteriores
+                yield "".join(model.model_validate(obj, from_attributes=True).model_dump_json() + "\n" for obj in chunk)
+
+    return StreamingResponse(rows(), media_type=NDJSON)
@@ -0,0 +1,381 @@
+"""Tracing liviano sin backend externo.
+
+Cada request lleva un trace id (header `X-Trace-Id`, o `X-Request-ID` si viene del
+cliente) y el id del span padre (`X-Parent-Span-Id`). Cada servicio registra spans
+de la request entrante, de las queries SQL y de las llamadas salientes; los spans
+terminados quedan en un buffer circular en memoria y, si se define `TRACE_FILE`,
+se agregan como JSONL a ese archivo (todos los servicios pueden compartirlo).
+
+Para reconstruir el camino critico de una orden:
+
+    python -m common.tracing --file data/traces.jsonl --order-id 42
+    python -m common.tracing --file data/traces.jsonl --slowest 5
+"""
+import atexit, contextvars, os, queue, secrets, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+TRACE_HEADER = "X-Trace-Id"
+PARENT_HEADER = "X-Parent-Span-Id"
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "10000"))  # spans que guarda cada proceso
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# span en curso y servicio que atiende la request (para log_json)
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("trace_span", default=None)
+current_service: contextvars.ContextVar[str | None] = contextvars.ContextVar("trace_service", default=None)
+
+
+def _new_id(nbytes: int = 8) -> str:
+    return secrets.token_hex(nbytes)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "service", "name", "kind", "start", "duration_ms", "attrs", "_t0")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: str | None, service: str | None, attrs: dict):
+        self.trace_id, self.parent_id = trace_id, parent_id
+        self.span_id = _new_id()
+        self.service = service or current_service.get() or os.environ.get("SERVICE_NAME", "unknown")
+        self.name, self.kind, self.attrs = name, kind, attrs
+        self.start = time.time()            # reloj de pared: comparable entre procesos
+        self._t0 = time.perf_counter()      # duracion con reloj monotono
+        self.duration_ms: float | None = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._t0) * 1000
+            _collector.add(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "service": self.service, "name": self.name, "kind": self.kind,
+            "start": self.start, "duration_ms": round(self.duration_ms or 0.0, 3), "attrs": self.attrs,
+        }
+
+
+class _Collector:
+    """Buffer circular de spans terminados, mas el archivo JSONL opcional.
+
+    El archivo lo escribe un thread aparte (el `_Writer` de `common.logging`, con su cola
+    y sus lotes): en el request solo se encola el span, sin lock ni write."""
+
+    def __init__(self, size: int, path: str):
+        self.spans: deque[Span] = deque(maxlen=size)
+        self._fd = None
+        self._pid = None
+        self._writer = None
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        self.spans.append(span)  # deque.append es atomico
+        if self.path:
+            try:
+                self._get_writer().queue.put_nowait(span.to_dict())
+            except queue.Full:  # como los logs: con la cola llena el span queda solo en memoria
+                pass
+
+    def _get_writer(self):
+        writer = self._writer
+        # tambien se recrea tras un fork: el thread no sobrevive en el proceso hijo
+        if writer is None or writer.pid != os.getpid():
+            with self._lock:
+                if self._writer is None or self._writer.pid != os.getpid():
+                    from .logging import _Writer
+                    self._writer = _Writer(self._write, name="trace-writer")
+                    self._writer.start()
+                writer = self._writer
+        return writer
+
+    def _write(self, batch: list[dict]):
+        """Corre en el thread writer: serializa el lote y lo agrega con un solo write."""
+        from .logging import _dumps  # mismo encoder que los logs (orjson si esta)
+
+        if not batch:
+            return
+        data = b"".join(_dumps(span) + b"\n" for span in batch)
+        try:
+            if self._fd is None or self._pid != os.getpid():
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                self._pid = os.getpid()
+            # un solo write con O_APPEND: los lotes de varios procesos no se mezclan
+            os.write(self._fd, data)
+        except OSError:
+            pass
+
+    def close(self, timeout: float = 2.0):
+        from .logging import _flush
+
+        _flush(self._writer, timeout)  # lo que quedo en la cola
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def trace(self, trace_id: str) -> list[Span]:
+        return [s for s in list(self.spans) if s.trace_id == trace_id]
+
+
+_collector = _Collector(TRACE_BUFFER, TRACE_FILE)
+atexit.register(_collector.close)
+
+
+def get_trace(trace_id: str) -> list[dict]:
+    """Spans de un trace que quedan en el buffer de este proceso."""
+    return [s.to_dict() for s in _collector.trace(trace_id)]
+
+
+def current_span() -> "Span | None":
+    return _current.get()
+
+
+def current_ids() -> tuple[str | None, str | None]:
+    """(trace_id, span_id) del span en curso, para taggear logs."""
+    span = _current.get()
+    return (span.trace_id, span.span_id) if span is not None else (None, None)
+
+
+def annotate(**attrs):
+    """Agrega atributos al span en curso (ej. `order_id`) para poder buscarlo despues."""
+    span = _current.get()
+    if span is not None:
+        span.set(**attrs)
+
+
+def start_span(name: str, kind: str = "internal", *, trace_id: str | None = None,
+               parent_id: str | None = None, service: str | None = None, **attrs) -> "Span | None":
+    """Abre un span hijo del actual (sin volverlo el actual). Hay que llamar `finish()`."""
+    if not TRACING_ENABLED:
+        return None
+    parent = _current.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent is not None else _new_id(16)
+        parent_id = parent.span_id if parent is not None else parent_id
+    return Span(name, kind, trace_id, parent_id, service, attrs)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attrs):
+    """Span como context manager; mientras dura es el span actual (padre de los que se abran adentro)."""
+    s = start_span(name, kind, **attrs)
+    if s is None:
+        yield None
+        return
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=type(e).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        s.finish()
+
+
+def trace_headers(span: "Span | None" = None) -> dict:
+    """Headers para propagar el trace en una llamada saliente."""
+    span = span or _current.get()
+    if span is None:
+        return {}
+    return {TRACE_HEADER: span.trace_id, PARENT_HEADER: span.span_id}
+
+
+class TracingMiddleware:
+    """Middleware ASGI puro: abre el span de la request entrante y devuelve `X-Trace-Id`."""
+
+    def __init__(self, app, service: str):
+        self.app, self.service = app, service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        # el servicio va siempre: en modo monolito varias apps comparten el proceso
+        service_token = current_service.set(self.service)
+        if not TRACING_ENABLED:
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                current_service.reset(service_token)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]
+                   if k in (b"x-trace-id", b"x-parent-span-id", b"x-request-id")}
+        trace_id = headers.get("x-trace-id") or headers.get("x-request-id") or _new_id(16)
+        s = Span(f"{scope['method']} {scope['path']}", "server", trace_id[:64],
+                 headers.get("x-parent-span-id"), self.service, {})
+        span_token = _current.set(s)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                s.set(status=message["status"])
+                raw = list(message.get("headers", []))
+                # el gateway ya puede traerlo desde el servicio: no duplicarlo
+                if not any(k.lower() == b"x-trace-id" for k, _ in raw):
+                    raw.append((b"x-trace-id", s.trace_id.encode("latin-1")))
+                message["headers"] = raw
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            s.set(error=type(e).__name__)
+            raise
+        finally:
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                s.name = f"{scope['method']} {route.path}"
+            _current.reset(span_token)
+            current_service.reset(service_token)
+            s.finish()
+
+
+def trace_engine(engine):
+    """Un span por query SQL y por commit del engine (sync o async)."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        op = statement.lstrip().split(None, 1)[0].upper() if statement else "?"
+        conn.info.setdefault("trace_spans", []).append(start_span(f"db {op}", "db", statement=statement[:200]))
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        s = conn.info["trace_spans"].pop()
+        if s is not None:
+            s.finish()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if stack:
+            s = stack.pop()
+            if s is not None:
+                s.set(error=type(context.original_exception).__name__)
+                s.finish()
+
+    # el COMMIT no pasa por el cursor y no hay evento "after": envolvemos el do_commit del dialecto
+    do_commit = sync_engine.dialect.do_commit
+
+    def _do_commit(dbapi_connection):
+        s = start_span("db COMMIT", "db")
+        try:
+            do_commit(dbapi_connection)
+        finally:
+            if s is not None:
+                s.finish()
+
+    sync_engine.dialect.do_commit = _do_commit
+
+
+def trace_app(app, service: str, engines=()):
+    """Monta el middleware de tracing y abre spans para las queries de los engines."""
+    app.add_middleware(TracingMiddleware, service=service)
+    for engine in {id(e): e for e in engines}.values():
+        trace_engine(engine)
+
+
+# --- Reconstruccion del camino critico a partir del archivo JSONL ---
+
+def load_spans(path: str) -> list[dict]:
+    import json
+
+    spans = []
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                spans.append(json.loads(line))
+    return spans
+
+
+def critical_path(spans: list[dict]) -> set[str]:
+    """Ids de los spans en el camino critico: desde la raiz, el hijo que termina ultimo y,
+    hacia atras, los hijos que terminaron antes de que empiece el siguiente del camino.
+
+    El hijo que termina ultimo siempre entra, aunque termine despues que el padre: pasa
+    cuando el span del servicio cierra al terminar de mandar el body, o por relojes."""
+    children: dict[str | None, list[dict]] = {}
+    ids = {s["span_id"] for s in spans}
+    for s in spans:
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+    end = lambda s: s["start"] + s["duration_ms"] / 1000
+
+    path: set[str] = set()
+
+    def walk(span: dict):
+        path.add(span["span_id"])
+        cursor = end(span)
+        for i, child in enumerate(sorted(children.get(span["span_id"], []), key=end, reverse=True)):
+            if i == 0 or end(child) <= cursor:
+                walk(child)
+                cursor = child["start"]
+
+    for root in children.get(None, []):
+        walk(root)
+    return path
+
+
+def format_trace(spans: list[dict]) -> str:
+    """Arbol del trace con offsets, duraciones y tiempo propio; `*` marca el camino critico."""
+    if not spans:
+        return "(sin spans)"
+    ids = {s["span_id"] for s in spans}
+    children: dict[str | None, list[dict]] = {}
+    for s in sorted(spans, key=lambda s: s["start"]):
+        children.setdefault(s["parent_id"] if s["parent_id"] in ids else None, []).append(s)
+    t0 = min(s["start"] for s in spans)
+    critical = critical_path(spans)
+    lines = [f"trace {spans[0]['trace_id']}  ({len(spans)} spans)",
+             f"{'':2}{'inicio':>9} {'dur ms':>9} {'propio':>9}  span"]
+
+    def walk(span: dict, depth: int):
+        own = span["duration_ms"] - sum(c["duration_ms"] for c in children.get(span["span_id"], []))
+        mark = "*" if span["span_id"] in critical else " "
+        attrs = " ".join(f"{k}={v}" for k, v in span["attrs"].items() if k != "statement")
+        lines.append(f"{mark} {(span['start'] - t0) * 1000:9.1f} {span['duration_ms']:9.1f} {max(own, 0):9.1f}  "
+                     f"{'  ' * depth}[{span['service']}] {span['name']} {attrs}".rstrip())
+        for child in children.get(span["span_id"], []):
+            walk(child, depth + 1)
+
+    for root in children.get(None, []):
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_id", nargs="?", help="trace a mostrar")
+    parser.add_argument("--file", default=TRACE_FILE or "data/traces.jsonl", help="archivo JSONL (TRACE_FILE)")
+    parser.add_argument("--order-id", type=int, help="buscar el trace que creo esta orden")
+    parser.add_argument("--slowest", type=int, default=0, help="mostrar los N traces mas lentos")
+    args = parser.parse_args()
+
+    by_trace: dict[str, list[dict]] = {}
+    for s in load_spans(args.file):
+        by_trace.setdefault(s["trace_id"], []).append(s)
+
+    if args.order_id is not None:
+        trace_ids = [t for t, spans in by_trace.items()
+                     if any(s["attrs"].get("order_id") == args.order_id for s in spans)]
+    elif args.trace_id:
+        trace_ids = [args.trace_id] if args.trace_id in by_trace else []
+    else:
+        # duracion de un trace = la de su span raiz mas largo
+        total = lambda t: max(s["duration_ms"] for s in by_trace[t])
+        trace_ids = sorted(by_trace, key=total, reverse=True)[:args.slowest or 1]
+    if not trace_ids:
+        raise SystemExit("trace no encontrado")
+    print("\n\n".join(format_trace(by_trace[t]) for t in trace_ids))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Control de admision del gateway: rate limits y concurrencia por servicio.
+
+- Token bucket por cliente (IP, o el header `GATEWAY_CLIENT_HEADER`) y por ruta
+  (`GATEWAY_ROUTE_LIMITS`). Sin tokens: 429 con `Retry-After`.
+- Por cada servicio (users/items/orders) hasta `GATEWAY_UPSTREAM_CONCURRENCY`
+  llamadas en vuelo y una cola corta (`GATEWAY_UPSTREAM_QUEUE`) ordenada por
+  prioridad: primero las rutas criticas (`POST /orders`), despues las escrituras
+  y al final los GET. Con la cola llena una request mas prioritaria desplaza a la
+  ultima de menor prioridad; si no hay lugar o se espera mas de
+  `GATEWAY_QUEUE_TIMEOUT`: 503 con `Retry-After`.
+
+Los limites se cambian en caliente con `PUT /admin/limits` (ver main.py).
+"""
+import asyncio, heapq, itertools, math, time
+from collections import OrderedDict
+from fastapi import Request
+from pydantic import BaseModel, Field
+from common.metrics import REGISTRY
+from . import settings
+
+SHED = REGISTRY.counter(
+    "gateway_shed_total", "Requests rechazadas por el control de admision", ("reason", "upstream"))
+UPSTREAM_ACTIVE = REGISTRY.gauge(
+    "gateway_upstream_active", "Llamadas en vuelo por servicio", ("upstream",))
+UPSTREAM_QUEUED = REGISTRY.gauge(
+    "gateway_upstream_queued", "Requests esperando lugar por servicio", ("upstream",))
+
+# prioridades de la cola (menor = antes)
+CRITICAL, NORMAL, BULK = 0, 1, 2
+
+
+class Shed(Exception):
+    """Request rechazada: `status_code` 429 (rate limit) o 503 (sin lugar)."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        super().__init__(reason)
+        self.reason, self.status_code = reason, status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        if not rate > 0:  # con rate 0 nunca se repone y `take` dividiria por cero
+            raise ValueError(f"rate invalido: {rate}")
+        self.rate, self.burst = rate, max(burst, 1.0)
+        self.tokens, self.updated = self.burst, time.monotonic()
+
+    def take(self) -> float:
+        """Consume un token. Devuelve 0, o cuantos segundos faltan para el proximo."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class UpstreamLimiter:
+    """Semaforo con cola acotada por prioridad."""
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float):
+        self.name, self.limit, self.queue, self.timeout = name, limit, queue, timeout
+        self.active = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []  # heap (prioridad, orden, future)
+        self._seq = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue:
+            # cola llena: desplazamos a la ultima de menor prioridad, si la hay
+            worst = max(self._waiters, default=None)
+            if worst is None or worst[0] <= priority:
+                raise Shed("queue_full", 503, self.timeout)
+            self._remove(worst)
+            worst[2].set_exception(Shed("preempted", 503, self.timeout))
+        entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, entry)
+        try:
+            await asyncio.wait_for(entry[2], self.timeout)
+        except asyncio.TimeoutError:
+            self._remove(entry)
+            raise Shed("queue_timeout", 503, self.timeout) from None
+        except asyncio.CancelledError:
+            fut = entry[2]
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release()  # ya nos habian pasado el lugar
+            else:
+                self._remove(entry)
+            raise
+
+    def release(self):
+        if self.active > self.limit:  # bajaron el limite: el lugar no se pasa
+            self.active -= 1
+            return
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # el lugar pasa directo a la siguiente
+                return
+        self.active -= 1
+
+    def resize(self, limit: int):
+        self.limit = limit
+        while self.active < self.limit and self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self.active += 1
+                fut.set_result(None)
+
+    def _remove(self, entry):
+        try:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        except ValueError:
+            pass
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+def _check_limit(what: str, rate: float, burst: float, allow_zero: bool = False):
+    """ValueError que nombra la regla si el rate no es > 0 (o 0 = sin limite) o la rafaga es < 1."""
+    if not (math.isfinite(rate) and (rate > 0 or allow_zero and rate == 0)):
+        raise ValueError(f"{what}: el rate tiene que ser mayor a 0, no {rate}")
+    if rate > 0 and not (math.isfinite(burst) and burst >= 1):
+        raise ValueError(f"{what}: la rafaga tiene que ser al menos 1, no {burst}")
+
+
+def _parse_routes(spec: str) -> dict[str, tuple[float, float]]:
+    """`"GET /items=50:100,POST /orders=200"` -> {"GET /items": (50, 100), "POST /orders": (200, 200)}."""
+    routes = {}
+    for rule in filter(None, (r.strip() for r in spec.split(","))):
+        route, _, limit = rule.rpartition("=")
+        rate, _, burst = limit.partition(":")
+        what = f"GATEWAY_ROUTE_LIMITS {rule!r}"
+        if not route.strip():
+            raise ValueError(f"{what}: falta la ruta (\"METODO /ruta=rate[:rafaga]\")")
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else max(rate, 1.0)  # sin rafaga: el rate (al menos 1)
+        except ValueError:
+            raise ValueError(f"{what}: rate y rafaga tienen que ser numeros") from None
+        _check_limit(what, rate, burst)
+        routes[_normalize(route)] = (rate, burst)
+    return routes
+
+
+def _normalize(route: str) -> str:
+    method, _, path = route.strip().partition(" ")
+    return f"{method.upper()} {path.strip().rstrip('/') or '/'}"
+
+
+class Admission:
+    def __init__(self):
+        self.client_rate = settings.CLIENT_RATE
+        self.client_burst = settings.CLIENT_BURST or settings.CLIENT_RATE
+        _check_limit("GATEWAY_CLIENT_RATE/GATEWAY_CLIENT_BURST", self.client_rate,
+                     settings.CLIENT_BURST or max(self.client_rate, 1.0), allow_zero=True)
+        self.routes = _parse_routes(settings.ROUTE_LIMITS)
+        self.critical = {_normalize(r) for r in settings.CRITICAL_ROUTES}
+        self._clients: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._route_buckets: dict[str, TokenBucket] = {}
+        self.limiters: dict[str, UpstreamLimiter] = {}
+
+    # rate limits
+    def check_rate(self, request: Request):
+        upstream = request.url.path.split("/")[1] or "/"
+        if self.client_rate > 0:
+            wait = self._client_bucket(self._client_id(request)).take()
+            if wait:
+                SHED.inc("rate_client", upstream)
+                raise Shed("rate_client", 429, wait)
+        rule = self._route_rule(request)
+        if rule is not None:
+            bucket = self._route_buckets.get(rule)
+            if bucket is None:
+                bucket = self._route_buckets[rule] = TokenBucket(*self.routes[rule])
+            wait = bucket.take()
+            if wait:
+                SHED.inc("rate_route", upstream)
+                raise Shed("rate_route", 429, wait)
+
+    def _client_id(self, request: Request) -> str:
+        if settings.CLIENT_HEADER and settings.CLIENT_HEADER in request.headers:
+            return request.headers[settings.CLIENT_HEADER]
+        return request.client.host if request.client else "-"
+
+    def _client_bucket(self, client: str) -> TokenBucket:
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self._clients) > settings.MAX_CLIENTS:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return bucket
+
+    def _route_rule(self, request: Request) -> str | None:
+        # la regla mas larga que contiene a la ruta ("GET /items" cubre "GET /items/5")
+        route = _normalize(f"{request.method} {request.url.path}")
+        method, path = route.split(" ", 1)
+        best = None
+        for rule in self.routes:
+            rule_method, rule_path = rule.split(" ", 1)
+            if rule_method == method and (path == rule_path or path.startswith(rule_path.rstrip("/") + "/")):
+                if best is None or len(rule) > len(best):
+                    best = rule
+        return best
+
+    # concurrencia por servicio
+    def priority(self, request: Request) -> int:
+        if _normalize(f"{request.method} {request.url.path}") in self.critical:
+            return CRITICAL
+        return BULK if request.method == "GET" else NORMAL
+
+    def limiter(self, name: str) -> UpstreamLimiter:
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = self.limiters[name] = UpstreamLimiter(
+                name, settings.UPSTREAM_CONCURRENCY, settings.UPSTREAM_QUEUE, settings.QUEUE_TIMEOUT)
+        return limiter
+
+    async def acquire(self, name: str, request: Request) -> UpstreamLimiter:
+        limiter = self.limiter(name)
+        try:
+            await limiter.acquire(self.priority(request))
+        except Shed as e:
+            SHED.inc(e.reason, name)
+            raise
+        return limiter
+
+    # cambios en caliente
+    def configure(self, patch: "LimitsIn"):
+        if patch.client is not None:
+            self.client_rate, self.client_burst = patch.client.rate, patch.client.burst or patch.client.rate
+            self._clients.clear()
+        if patch.routes is not None:
+            for route, limit in patch.routes.items():
+                route = _normalize(route)
+                self._route_buckets.pop(route, None)
+                if limit is None or limit.rate <= 0:
+                    self.routes.pop(route, None)
+                else:
+                    self.routes[route] = (limit.rate, limit.burst or limit.rate)
+        if patch.critical_routes is not None:
+            self.critical = {_normalize(r) for r in patch.critical_routes}
+        for name, up in (patch.upstreams or {}).items():
+            limiter = self.limiter(name)
+            if up.queue is not None:
+                limiter.queue = up.queue
+            if up.queue_timeout is not None:
+                limiter.timeout = up.queue_timeout
+            if up.concurrency is not None:
+                limiter.resize(up.concurrency)
+
+    def snapshot(self) -> dict:
+        return {
+            "client": {"rate": self.client_rate, "burst": self.client_burst},
+            "routes": {r: {"rate": rate, "burst": burst} for r, (rate, burst) in self.routes.items()},
+            "critical_routes": sorted(self.critical),
+            "upstreams": {
+                name: {"concurrency": l.limit, "queue": l.queue, "queue_timeout": l.timeout,
+                       "active": l.active, "queued": l.queued()}
+                for name, l in self.limiters.items()
+            },
+        }
+
+
+class RateIn(BaseModel):
+    rate: float = Field(ge=0, allow_inf_nan=False)               # requests por segundo (0 = sin limite)
+    burst: float | None = Field(default=None, ge=1, allow_inf_nan=False)
+
+class UpstreamIn(BaseModel):
+    concurrency: int | None = Field(default=None, ge=1)
+    queue: int | None = Field(default=None, ge=0)
+    queue_timeout: float | None = Field(default=None, gt=0)
+
+class LimitsIn(BaseModel):
+    client: RateIn | None = None
+    routes: dict[str, RateIn | None] | None = None  # null o rate 0 = quitar la regla
+    critical_routes: list[str] | None = None
+    upstreams: dict[str, UpstreamIn] | None = None
+
+
+admission = Admission()
+
+
+def _collect():
+    for name, limiter in admission.limiters.items():
+        UPSTREAM_ACTIVE.set(name, value=limiter.active)
+        UPSTREAM_QUEUED.set(name, value=limiter.queued())
+
+REGISTRY.register_collector(_collect)
@@ -0,0 +1,109 @@
+"""Cache de respuestas GET del gateway, por URL y con revalidacion por ETag.
+
+Guarda las respuestas 200 con `ETag` de las rutas de `GATEWAY_CACHE_PATHS`. Durante
+`GATEWAY_CACHE_TTL` segundos se sirven sin llamar al servicio; despues se revalidan
+con `If-None-Match` y un 304 del servicio renueva la entrada sin traer el body.
+Un POST/PUT/DELETE que pasa por el gateway borra las entradas de su prefijo.
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from fastapi import Request
+from common.metrics import REGISTRY
+from . import settings
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "gateway_cache_total", "Requests GET cacheables por resultado", ("result",))
+CACHE_ENTRIES = REGISTRY.gauge("gateway_cache_entries", "Respuestas en el cache del gateway")
+CACHE_BYTES = REGISTRY.gauge("gateway_cache_bytes", "Bytes de body en el cache del gateway")
+
+
+@dataclass
+class Entry:
+    etag: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    body: bytes
+    fresh_until: float
+
+    def fresh(self) -> bool:
+        return self.fresh_until > time.monotonic()
+
+
+class ResponseCache:
+    """LRU acotado por cantidad de entradas y por bytes de body."""
+
+    def __init__(self, size: int, max_bytes: int, ttl: float):
+        self.size, self.max_bytes, self.ttl = size, max_bytes, ttl
+        self._entries: OrderedDict[tuple, Entry] = OrderedDict()
+        self.bytes = 0
+        # sube con cada invalidacion: un GET que empezo antes de una escritura no guarda su copia
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple) -> Entry | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, entry: Entry, generation: int):
+        if generation != self.generation:
+            return
+        self.pop(key)
+        self._entries[key] = entry
+        self.bytes += len(entry.body)
+        while self._entries and (len(self._entries) > self.size or self.bytes > self.max_bytes):
+            _, old = self._entries.popitem(last=False)
+            self.bytes -= len(old.body)
+
+    def refresh(self, entry: Entry):
+        entry.fresh_until = time.monotonic() + self.ttl
+
+    def pop(self, key: tuple):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old.body)
+
+    def invalidate_prefix(self, prefix: str):
+        self.generation += 1
+        for key in [k for k in self._entries if k[0].startswith(prefix)]:
+            self.pop(key)
+
+
+cache = ResponseCache(settings.CACHE_SIZE, settings.CACHE_MAX_BYTES, settings.CACHE_TTL)
+
+
+def _collect():
+    CACHE_ENTRIES.set(value=len(cache))
+    CACHE_BYTES.set(value=cache.bytes)
+
+REGISTRY.register_collector(_collect)
+
+
+def prefix_of(request: Request, prefixes: list[str] = settings.CACHE_PATHS) -> str | None:
+    """Prefijo de `prefixes` que contiene la ruta (ej. `/items`), o None si no esta en la lista."""
+    path = request.url.path
+    for prefix in prefixes:
+        if path == prefix or path.startswith(prefix + "/"):
+            return prefix
+    return None
+
+
+def key_for(request: Request) -> tuple:
+    # el body depende del formato pedido (Vary: Accept) y de la codificacion
+    return (request.url.path + ("?" + request.url.query if request.url.query else ""),
+            request.headers.get("accept", ""), request.headers.get("accept-encoding", ""))
+
+
+def wants_revalidation(request: Request) -> bool:
+    """El cliente pide no usar una copia sin revalidar (`Cache-Control: no-cache` o `max-age=0`)."""
+    cc = request.headers.get("cache-control", "").lower()
+    return "no-cache" in cc or "max-age=0" in cc or request.headers.get("pragma", "").lower() == "no-cache"
+
+
+def storable(headers) -> bool:
+    cc = headers.get("cache-control", "").lower()
+    return "etag" in headers and "no-store" not in cc and "private" not in cc and "set-cookie" not in headers
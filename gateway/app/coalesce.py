@@ -0,0 +1,70 @@
+"""Single-flight: requests GET identicas y simultaneas comparten una llamada al servicio.
+
+La primera request de una clave (metodo, ruta, query y headers que cambian la
+respuesta) hace la llamada; las que llegan mientras tanto esperan y reciben la
+misma respuesta. Solo para las rutas de `GATEWAY_COALESCE_PATHS` y respuestas de
+hasta `GATEWAY_COALESCE_MAX_BODY` bytes; si la respuesta no se puede compartir
+(streaming, muy grande) o la primera request falla, cada una hace la suya.
+"""
+import asyncio
+from collections.abc import Awaitable, Callable
+from fastapi import Request
+from common.metrics import REGISTRY
+from . import settings
+from .cache import prefix_of
+
+COALESCED = REGISTRY.counter(
+    "gateway_coalesced_total", "Requests que esperaron la llamada de otra request identica", ("route",))
+IN_FLIGHT = REGISTRY.gauge("gateway_coalesce_in_flight", "Llamadas compartidas en curso")
+
+# headers que cambian la respuesta: dos requests con valores distintos no se comparten
+VARY_HEADERS = ("accept", "accept-encoding", "authorization", "cookie",
+                "if-none-match", "if-modified-since", "range", "cache-control")
+
+
+def key_for(request: Request) -> tuple | None:
+    """Clave de la request, o None si la ruta no se coalesce."""
+    if request.method != "GET":
+        return None
+    prefix = prefix_of(request, settings.COALESCE_PATHS)
+    if prefix is None:
+        return None
+    return (prefix, request.method, request.url.path, request.url.query,
+            tuple(request.headers.get(h, "") for h in VARY_HEADERS))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[tuple, asyncio.Future] = {}
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable]) -> tuple[object, bool]:
+        """Corre `fn` o espera a la llamada en curso con la misma clave.
+
+        Devuelve (resultado, compartido). Si la llamada en curso fallo, el resultado es None.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            COALESCED.inc(key[0])
+            # asyncio.wait: si cancelan a esta request no se cancela la del lider
+            await asyncio.wait([call])
+            if call.cancelled():
+                return None, True
+            return call.result(), True
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        IN_FLIGHT.inc()
+        try:
+            result = await fn()
+        except BaseException:
+            call.cancel()  # los que esperaban hacen su propia llamada
+            raise
+        else:
+            call.set_result(result)
+            return result, False
+        finally:
+            IN_FLIGHT.dec()
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+
+flights = SingleFlight()
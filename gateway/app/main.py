@@ -1,9 +1,81 @@
-from fastapi import FastAPI, Request, Response
+import os
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 import httpx
+from . import settings
 from .settings import USERS_SERVICE_URL, ITEMS_SERVICE_URL, ORDERS_SERVICE_URL
-from common.auth import add_service_auth
+from common.auth import add_service_auth, verify_service_token
+from common.logging import log_json, flush_logs
+from common.metrics import instrument_app
+from common import etag, http, tracing
+from . import monolith
+from . import cache, coalesce
+from .admission import admission, LimitsIn, Shed
+from .cache import cache as response_cache, Entry, CACHE_LOOKUPS
 
 app = FastAPI(title="API Gateway")
+instrument_app(app, "gateway")
+# crea el trace (o acepta X-Trace-Id / X-Request-ID del cliente) y lo devuelve en X-Trace-Id
+tracing.trace_app(app, "gateway")
+
+# Headers hop-by-hop (RFC 7230 6.1): son de cada conexion, no se reenvian
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade",
+}
+
+# Headers que uvicorn vuelve a poner en la respuesta del gateway
+RESPONSE_OWN_HEADERS = {"date", "server"}
+
+# Headers de una respuesta cacheada que no se repiten al servirla (son de la request original)
+NOT_CACHED_HEADERS = RESPONSE_OWN_HEADERS | {"x-trace-id"}
+
+# Headers que acompañan a un 304 (RFC 9110 15.4.5)
+NOT_MODIFIED_HEADERS = {"etag", "vary", "cache-control", "expires", "content-location"}
+
+# Modo monolito: los servicios corren en este proceso (ver monolith.py)
+if settings.MONOLITH:
+    monolith.mount_services()
+
+# Nombre de cada servicio (para los limites de concurrencia y las metricas)
+UPSTREAM_NAMES = {USERS_SERVICE_URL: "users", ITEMS_SERVICE_URL: "items", ORDERS_SERVICE_URL: "orders"}
+
+# Un cliente (pool de conexiones keep-alive) por servicio, vive lo que vive la app
+_clients: dict[str, httpx.AsyncClient] = {}
+
+def _new_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=http.transport_for(base_url),  # en modo monolito, la app en memoria
+        limits=httpx.Limits(
+            max_connections=settings.MAX_CONNECTIONS,
+            max_keepalive_connections=settings.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.CONNECT_TIMEOUT,
+            read=settings.READ_TIMEOUT,
+            write=settings.WRITE_TIMEOUT,
+            pool=settings.POOL_TIMEOUT,
+        ),
+    )
+
+@app.on_event("startup")
+async def startup():
+    if settings.MONOLITH:
+        await monolith.startup()
+    for base_url in (USERS_SERVICE_URL, ITEMS_SERVICE_URL, ORDERS_SERVICE_URL):
+        _clients[base_url] = _new_client(base_url)
+
+@app.on_event("shutdown")
+async def shutdown():
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+    if settings.MONOLITH:
+        await monolith.shutdown()
+    flush_logs()
 
 @app.get("/")
 def root():
@@ -13,43 +85,231 @@ def root():
 def health():
     return {"status": "ok"}
 
+# el gateway no tiene db: esta listo cuando el startup ya armo los clientes hacia los servicios
+@app.get("/ready")
+def ready():
+    if not _clients:
+        raise HTTPException(status_code=503, detail="gateway arrancando")
+    return {"status": "ready", "pid": os.getpid()}
+
+# Limites del control de admision: ver y cambiar en caliente (solo con X-Service-Token)
+@app.get("/admin/limits", dependencies=[Depends(verify_service_token)])
+def get_limits():
+    return admission.snapshot()
+
+@app.put("/admin/limits", dependencies=[Depends(verify_service_token)])
+def update_limits(payload: LimitsIn):
+    admission.configure(payload)
+    log_json("info", "gateway.limits.updated", **payload.model_dump(exclude_none=True))
+    return admission.snapshot()
+
 # Proxy hacia users-service
 @app.api_route("/users{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def users_proxy(request: Request, path: str = ""):
-    url = f"{USERS_SERVICE_URL}{path or '/'}"
-    return await _proxy(request, url)
+    return await _proxy(request, USERS_SERVICE_URL, path)
 
 # Proxy hacia items-service
 @app.api_route("/items{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def items_proxy(request: Request, path: str = ""):
-    url = f"{ITEMS_SERVICE_URL}{path or '/'}"
-    return await _proxy(request, url)
+    return await _proxy(request, ITEMS_SERVICE_URL, path)
 
 # Proxy hacia orders-service
 @app.api_route("/orders{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
 async def orders_proxy(request: Request, path: str = ""):
-    url = f"{ORDERS_SERVICE_URL}{path or '/'}"
-    return await _proxy(request, url)
+    return await _proxy(request, ORDERS_SERVICE_URL, path)
+
+def _strip_hop_by_hop(raw_headers) -> list[tuple[str, str]]:
+    """Quita los headers hop-by-hop, incluidos los que nombra el header Connection."""
+    headers = [(k.lower(), v) for k, v in raw_headers]
+    drop = set(HOP_BY_HOP)
+    for k, v in headers:
+        if k == "connection":
+            drop.update(token.strip().lower() for token in v.split(","))
+    return [(k, v) for k, v in headers if k not in drop]
+
+def _public_location(request: Request, upstream: str, path: str, location: str) -> str:
+    """Un Location que apunta al servicio (su URL interna) pasa a la URL del gateway:
+    `http://orders:8003/5` -> `http://<gateway>/orders/5`. Los demas quedan igual."""
+    upstream = upstream.rstrip("/")
+    if location != upstream and not location.startswith(upstream + "/"):
+        return location
+    public = str(request.url.replace(query=""))
+    if path:
+        public = public[:-len(path)]
+    return public.rstrip("/") + location[len(upstream):]
 
-async def _proxy(request: Request, url: str):
-    # Guardamos el Get/Post
-    method = request.method
+def _has_body(request: Request) -> bool:
+    return request.headers.get("content-length", "0") != "0" or "transfer-encoding" in request.headers
 
-    # Pasamos headers y body originales, al headers añadimos autenticacion interna
-    headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
+async def _stream_body(resp: httpx.Response):
+    # Reenvia el body del servicio tal cual llega (sin descomprimir) y libera la conexion
+    try:
+        async for chunk in resp.aiter_raw():
+            yield chunk
+    finally:
+        await resp.aclose()
+
+def _finish(span, **attrs):
+    if span is not None:
+        span.set(**attrs)
+        span.finish()
+
+def _from_cache(request: Request, entry: Entry, result: str) -> Response:
+    """Responde con la copia del cache (o 304 si el cliente ya la tiene)."""
+    tracing.annotate(cache=result)
+    if etag.matches(request, entry.etag):
+        response = Response(status_code=304)
+        headers = [(k, v) for k, v in entry.headers if k in NOT_MODIFIED_HEADERS]
+    else:
+        response = Response(content=entry.body, status_code=entry.status_code)
+        headers = entry.headers
+    response.raw_headers = [(k.encode("latin-1"), v.encode("latin-1"))
+                            for k, v in headers + [("x-cache", result.upper())]]
+    return response
+
+async def _store(key: tuple, entry: Entry | None, generation: int, resp: httpx.Response) -> tuple[Entry, str] | None:
+    """Actualiza el cache con la respuesta del servicio. Devuelve (entrada, resultado),
+    o None si la respuesta no se cachea (y hay que reenviarla tal cual)."""
+    if entry is not None and resp.status_code == 304:
+        await resp.aclose()
+        response_cache.refresh(entry)
+        return entry, "revalidated"
+    length = int(resp.headers.get("content-length", settings.CACHE_MAX_BODY + 1))
+    if resp.status_code != 200 or not cache.storable(resp.headers) or length > settings.CACHE_MAX_BODY:
+        if entry is not None:
+            response_cache.pop(key)
+        return None
+    try:
+        body = b"".join([chunk async for chunk in resp.aiter_raw()])
+    finally:
+        await resp.aclose()
+    entry = Entry(
+        etag=resp.headers["etag"],
+        status_code=resp.status_code,
+        headers=[(k, v) for k, v in _strip_hop_by_hop(resp.headers.multi_items()) if k not in NOT_CACHED_HEADERS],
+        body=body,
+        fresh_until=0,
+    )
+    response_cache.refresh(entry)
+    response_cache.put(key, entry, generation)
+    return entry, "miss"
+
+def _shed(e: Shed) -> JSONResponse:
+    tracing.annotate(shed=e.reason)
+    detail = "Demasiadas requests" if e.status_code == 429 else "Servicio saturado"
+    return JSONResponse({"detail": detail}, status_code=e.status_code,
+                        headers={"Retry-After": str(e.retry_after)})
+
+async def _proxy(request: Request, upstream: str, path: str):
+    # rate limits por cliente y por ruta: se rechaza antes de hacer nada
+    try:
+        admission.check_rate(request)
+    except Shed as e:
+        return _shed(e)
+
+    # GETs identicos en vuelo: una sola llamada al servicio para todos (ver coalesce.py)
+    key = coalesce.key_for(request)
+    if key is None:
+        return await _forward(request, upstream, path)
+    response, shared = await coalesce.flights.do(key, lambda: _forward(request, upstream, path, buffered=True))
+    if shared:
+        if response is None or isinstance(response, StreamingResponse):
+            # el lider fallo o su respuesta no se puede compartir: hacemos la nuestra
+            return await _forward(request, upstream, path)
+        tracing.annotate(coalesced=True)
+    return response
+
+async def _forward(request: Request, upstream: str, path: str, buffered: bool = False):
+    """Manda la request al servicio. Con `buffered`, las respuestas chicas se leen enteras
+    (un Response que se puede mandar a varios clientes) en vez de streamearse."""
+    client = _clients.get(upstream)
+    if client is None:  # por si se usa sin eventos de startup (ej. tests)
+        client = _clients[upstream] = _new_client(upstream)
+
+    # Cache de GETs: copia fresca -> se responde sin llamar al servicio
+    prefix = cache.prefix_of(request)
+    key = entry = None
+    if prefix is not None and request.method == "GET":
+        key, generation = cache.key_for(request), response_cache.generation
+        entry = response_cache.get(key)
+        if entry is not None and entry.fresh() and not cache.wants_revalidation(request):
+            CACHE_LOOKUPS.inc("hit")
+            return _from_cache(request, entry, "hit")
+
+    # Pasamos headers originales sin host ni hop-by-hop, y añadimos autenticacion interna
+    headers = dict(_strip_hop_by_hop(request.headers.items()))
+    headers.pop("host", None)
     headers = add_service_auth(headers)
-    body = await request.body()
+    if key is not None:
+        # revalidamos nuestra copia; el If-None-Match del cliente lo contestamos nosotros
+        headers.pop("if-none-match", None)
+        if entry is not None:
+            headers["if-none-match"] = entry.etag
 
     # Incluimos querystring
+    url = path or "/"
     qs = request.url.query
     if qs:
         url = f"{url}?{qs}"
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.request(method, url, headers=headers, content=body)
+    # span del salto al servicio (hasta recibir los headers); el servicio lo usa como padre
+    upstream_span = tracing.start_span(f"proxy {request.method} {upstream}{path or '/'}", "client")
+    headers.update(tracing.trace_headers(upstream_span))
+
+    # El body del cliente se reenvia en streaming, sin leerlo entero en memoria
+    content = request.stream() if _has_body(request) else None
+    upstream_req = client.build_request(request.method, url, headers=headers, content=content)
+
+    # lugar en el limite de concurrencia del servicio (cola por prioridad)
+    try:
+        limiter = await admission.acquire(UPSTREAM_NAMES.get(upstream, upstream), request)
+    except Shed as e:
+        _finish(upstream_span, shed=e.reason)
+        return _shed(e)
+    try:
+        resp = await client.send(upstream_req, stream=True)
+    except httpx.TimeoutException:
+        log_json("error", "gateway.upstream.timeout", upstream=upstream, path=url)
+        _finish(upstream_span, error="timeout")
+        return JSONResponse({"detail": "Timeout del servicio"}, status_code=504)
+    except httpx.TransportError:
+        log_json("error", "gateway.upstream.unavailable", upstream=upstream, path=url)
+        _finish(upstream_span, error="unavailable")
+        return JSONResponse({"detail": "Servicio no disponible"}, status_code=502)
+    finally:
+        # el lugar se libera al recibir los headers: el servicio ya hizo el trabajo
+        limiter.release()
+    _finish(upstream_span, status=resp.status_code)
+
+    if key is not None:
+        stored = await _store(key, entry, generation, resp)
+        CACHE_LOOKUPS.inc(stored[1] if stored else "bypass")
+        if stored is not None:
+            return _from_cache(request, *stored)
+    elif prefix is not None and request.method != "GET" and resp.status_code < 400:
+        # escritura por el gateway: las copias de ese prefijo ya no sirven
+        response_cache.invalidate_prefix(prefix)
+
+    out_headers = [
+        (k.encode("latin-1"), (_public_location(request, upstream, path, v) if k == "location" else v).encode("latin-1"))
+        for k, v in _strip_hop_by_hop(resp.headers.multi_items())
+        if k not in RESPONSE_OWN_HEADERS
+    ]
+    length = resp.headers.get("content-length")
+    if buffered and length is not None and int(length) <= settings.COALESCE_MAX_BODY:
+        try:
+            body = b"".join([chunk async for chunk in resp.aiter_raw()])
+        finally:
+            await resp.aclose()
+        response = Response(content=body, status_code=resp.status_code)
+        response.raw_headers = out_headers
+        return response
 
-    return Response(
-        content=resp.content,
+    response = StreamingResponse(
+        _stream_body(resp),
         status_code=resp.status_code,
-        media_type=resp.headers.get("content-type")
+        background=BackgroundTask(resp.aclose),
     )
+    # raw_headers conserva headers repetidos (ej. set-cookie)
+    response.raw_headers = out_headers
+    return response
@@ -0,0 +1,44 @@
+"""Modo monolito (`GATEWAY_MONOLITH=1`): users, items y orders en el proceso del gateway.
+
+Cada app se registra en `common.http.mount` con su URL (`USERS_SERVICE_URL`, ...),
+asi el proxy del gateway y las llamadas de orders a users/items van por un
+transport ASGI en memoria en vez de por sockets. Los servicios no cambian.
+"""
+import importlib
+from common import http, tracing
+from .settings import USERS_SERVICE_URL, ITEMS_SERVICE_URL, ORDERS_SERVICE_URL
+
+SERVICES = {
+    "users": ("users-service.app.main", USERS_SERVICE_URL),
+    "items": ("items-service.app.main", ITEMS_SERVICE_URL),
+    "orders": ("orders-service.app.main", ORDERS_SERVICE_URL),
+}
+
+_apps: dict[str, object] = {}
+
+
+def mount_services() -> dict:
+    for name, (module, base_url) in SERVICES.items():
+        app = importlib.import_module(module).app
+        http.mount(base_url, app)
+        _apps[name] = app
+    return _apps
+
+
+async def startup():
+    # el ASGITransport no manda eventos lifespan: corremos los on_event de cada servicio
+    for name, app in _apps.items():
+        token = tracing.current_service.set(name)  # logs y tareas de fondo con el servicio correcto
+        try:
+            await app.router.startup()
+        finally:
+            tracing.current_service.reset(token)
+
+
+async def shutdown():
+    for name, app in reversed(list(_apps.items())):
+        token = tracing.current_service.set(name)
+        try:
+            await app.router.shutdown()
+        finally:
+            tracing.current_service.reset(token)
@@ -2,4 +2,40 @@ import os
 
 USERS_SERVICE_URL = os.getenv("USERS_SERVICE_URL", "http://127.0.0.1:8001")
 ITEMS_SERVICE_URL = os.getenv("ITEMS_SERVICE_URL", "http://127.0.0.1:8002")
-ORDERS_SERVICE_URL = os.getenv("ORDERS_SERVICE_URL", "http://127.0.0.1:8003")
\ No newline at end of file
+ORDERS_SERVICE_URL = os.getenv("ORDERS_SERVICE_URL", "http://127.0.0.1:8003")
+
+# Modo monolito: el gateway monta users, items y orders en su proceso y los llama sin red
+MONOLITH = os.getenv("GATEWAY_MONOLITH", "0") == "1"
+
+# Pool de conexiones hacia cada servicio (uno por upstream)
+MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GATEWAY_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "30"))  # segundos
+
+# Timeouts hacia los servicios (segundos)
+CONNECT_TIMEOUT = float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("GATEWAY_READ_TIMEOUT", "30"))
+WRITE_TIMEOUT = float(os.getenv("GATEWAY_WRITE_TIMEOUT", "30"))
+POOL_TIMEOUT = float(os.getenv("GATEWAY_POOL_TIMEOUT", "5"))
+
+# Cache de respuestas GET con ETag (ver cache.py); GATEWAY_CACHE_PATHS vacio = sin cache
+CACHE_PATHS = [p.strip().rstrip("/") for p in os.getenv("GATEWAY_CACHE_PATHS", "/items,/users").split(",") if p.strip()]
+CACHE_TTL = float(os.getenv("GATEWAY_CACHE_TTL", "1"))                       # segundos sin revalidar
+CACHE_SIZE = int(os.getenv("GATEWAY_CACHE_SIZE", "512"))                     # entradas
+CACHE_MAX_BYTES = int(os.getenv("GATEWAY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_MAX_BODY = int(os.getenv("GATEWAY_CACHE_MAX_BODY", str(1024 * 1024)))  # respuestas mas grandes no se guardan
+
+# Single-flight: GETs identicos y simultaneos de estas rutas comparten una sola llamada al servicio
+COALESCE_PATHS = [p.strip().rstrip("/") for p in os.getenv("GATEWAY_COALESCE_PATHS", "/items,/users").split(",") if p.strip()]
+COALESCE_MAX_BODY = int(os.getenv("GATEWAY_COALESCE_MAX_BODY", str(4 * 1024 * 1024)))  # mas grande: cada uno la suya
+
+# Control de admision (ver admission.py); los limites se pueden cambiar con PUT /admin/limits
+CLIENT_RATE = float(os.getenv("GATEWAY_CLIENT_RATE", "0"))      # requests/s por cliente (0 = sin limite)
+CLIENT_BURST = float(os.getenv("GATEWAY_CLIENT_BURST", "0"))    # rafaga por cliente (0 = igual al rate)
+CLIENT_HEADER = os.getenv("GATEWAY_CLIENT_HEADER", "").lower()  # header que identifica al cliente (vacio = IP)
+MAX_CLIENTS = int(os.getenv("GATEWAY_MAX_CLIENTS", "10000"))    # buckets de clientes en memoria
+ROUTE_LIMITS = os.getenv("GATEWAY_ROUTE_LIMITS", "")            # "GET /items=50:100,POST /orders=200"
+CRITICAL_ROUTES = [r for r in os.getenv("GATEWAY_CRITICAL_ROUTES", "POST /orders").split(",") if r.strip()]
+UPSTREAM_CONCURRENCY = int(os.getenv("GATEWAY_UPSTREAM_CONCURRENCY", "64"))  # llamadas en vuelo por servicio
+UPSTREAM_QUEUE = int(os.getenv("GATEWAY_UPSTREAM_QUEUE", "64"))              # esperando lugar
+QUEUE_TIMEOUT = float(os.getenv("GATEWAY_QUEUE_TIMEOUT", "2"))               # segundos en cola antes del 503
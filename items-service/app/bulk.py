@@ -0,0 +1,229 @@
+"""Carga masiva (upsert por SKU) y export del catalogo, en streaming.
+
+`POST /items/bulk` lee el body de a pedazos (CSV con header, donde un campo entre
+comillas puede tener saltos de linea, o NDJSON, una fila por linea), valida cada
+fila con `ItemBulkIn` (stock >= 0) y hace upsert por SKU en chunks de `ITEMS_BULK_CHUNK`
+filas, un commit por chunk. Las filas invalidas (un stock negativo tambien) no frenan la
+carga: se devuelven con su numero de linea. Si un SKU se repite, gana la ultima fila.
+Una fila sin stock (sin la columna, con el campo vacio o sin la clave en NDJSON) solo
+cambia el nombre de un SKU existente; si el SKU es nuevo arranca con stock 0.
+
+`GET /items/export` escribe el catalogo completo en CSV o NDJSON leyendo la db con
+un cursor, con memoria constante.
+"""
+import codecs, csv, io, json, os
+from collections import deque
+from collections.abc import AsyncIterator
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from common.logging import log_json
+from common.pagination import NDJSON, NDJSON_CHUNK
+from . import crud, hot
+
+BULK_CHUNK = int(os.getenv("ITEMS_BULK_CHUNK", "1000"))            # filas por upsert/commit
+BULK_MAX_ERRORS = int(os.getenv("ITEMS_BULK_MAX_ERRORS", "1000"))  # errores detallados en la respuesta
+
+CSV = "text/csv"
+CSV_COLUMNS = ("id", "name", "sku", "stock")
+
+
+class BulkError(BaseModel):
+    line: int
+    sku: str | None = None
+    error: str
+
+class BulkOut(BaseModel):
+    received: int    # filas leidas (sin el header del CSV)
+    inserted: int
+    updated: int
+    unchanged: int   # el SKU ya estaba con el mismo nombre y stock (o la fila no trae stock): no se escribe
+    failed: int
+    errors: list[BulkError]  # hasta ITEMS_BULK_MAX_ERRORS
+
+
+def format_of(content_type: str) -> str | None:
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type == CSV:
+        return "csv"
+    if content_type in (NDJSON, "application/jsonl", "application/x-jsonlines"):
+        return "ndjson"
+    return None
+
+
+async def _text(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Lineas a medida que llegan los bytes, con su salto de linea (la ultima puede no tenerlo)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in stream:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def _lines(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, str]]:
+    """(numero de linea, linea) sin el fin de linea; lineas vacias se saltean."""
+    number = 0
+    async for line in _text(stream):
+        number += 1
+        if line.strip():
+            yield number, line.rstrip("\r\n")
+
+
+def _open_quote(line: str, quoted: bool) -> bool:
+    """Queda abierto un campo entre comillas al final de `line`? Mismas reglas que `csv` (dialecto excel):
+    las comillas solo abren al principio de un campo y `""` adentro es una comilla."""
+    i = 0
+    if not quoted and line.startswith('"'):
+        quoted, i = True, 1
+    while True:
+        if quoted:
+            j = line.find('"', i)
+            if j < 0:
+                return True
+            if line.startswith('"', j + 1):
+                i = j + 2
+                continue
+            quoted, i = False, j + 1
+        j = line.find(",", i)
+        if j < 0:
+            return False
+        i = j + 1
+        if line.startswith('"', i):
+            quoted, i = True, i + 1
+
+
+async def _csv_records(stream: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, list[str] | str]]:
+    """(linea donde empieza, valores) de cada registro; un campo entre comillas puede tener saltos de linea.
+
+    Un solo `csv.reader` lee de una cola de lineas y se le pide el registro siguiente
+    recien cuando esta completo (sin comillas abiertas), asi no se queda sin lineas a mitad.
+    """
+    buffered: deque[str] = deque()
+    reader = csv.reader(iter(buffered.popleft, None))
+    quoted = False
+    async for line in _text(stream):
+        buffered.append(line)
+        quoted = ('"' in line or quoted) and _open_quote(line, quoted)
+        # hasta vaciar la cola: con un `\r` suelto fuera de comillas `csv` corta el registro antes que nosotros
+        while not quoted and buffered:
+            start = reader.line_num + 1
+            try:
+                values = next(reader)
+            except csv.Error as e:
+                yield start, f"CSV invalido: {e}"
+                continue
+            except IndexError:  # el reader pidio otra linea en medio de un registro roto
+                yield start, "CSV invalido"
+                break
+            if len(values) > 1 or values and values[0].strip():  # las lineas en blanco no son filas
+                yield start, values
+    if quoted:
+        yield reader.line_num + 1, "Comillas sin cerrar"
+
+
+async def _rows(stream: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict | str]]:
+    """(linea, dict con la fila) o (linea, mensaje de error) si no se pudo leer."""
+    if fmt == "ndjson":
+        async for number, line in _lines(stream):
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, "JSON invalido"
+                continue
+            yield number, row if isinstance(row, dict) else "Se esperaba un objeto JSON"
+        return
+    header = None
+    async for number, values in _csv_records(stream):
+        if isinstance(values, str):
+            yield number, values
+            continue
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            missing = {"name", "sku"} - set(header)
+            if missing:
+                raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(missing))}")
+            continue
+        if len(values) != len(header):
+            yield number, f"Se esperaban {len(header)} columnas y hay {len(values)}"
+            continue
+        yield number, {k: v for k, v in zip(header, values) if k in ("name", "sku", "stock") and v != ""}
+
+
+def _describe(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+async def import_items(db: AsyncSession, stream: AsyncIterator[bytes], fmt: str, model) -> BulkOut:
+    out = BulkOut(received=0, inserted=0, updated=0, unchanged=0, failed=0, errors=[])
+
+    def fail(line: int, sku: str | None, error: str):
+        out.failed += 1
+        if len(out.errors) < BULK_MAX_ERRORS:
+            out.errors.append(BulkError(line=line, sku=sku, error=error))
+
+    chunk: dict[str, tuple[int, str, int | None]] = {}  # sku -> (linea, name, stock o None si no vino)
+
+    async def flush():
+        try:
+            inserted, updated, unchanged = await crud.upsert_items(
+                db, {sku: (name, stock) for sku, (_, name, stock) in chunk.items()})
+        except SQLAlchemyError as e:
+            await db.rollback()
+            log_json("error", "items.bulk.chunk.failed", rows=len(chunk), error=str(e.__cause__ or e))
+            for sku, (line, _, _) in chunk.items():
+                fail(line, sku, "Error guardando el chunk")
+        else:
+            out.inserted += inserted
+            out.updated += updated
+            out.unchanged += unchanged
+            # SKUs calientes: el stock que manda es el de memoria, se pisa ahi tambien (si vino)
+            await hot.engine.track(db, chunk)
+            for sku, (_, name, stock) in chunk.items():
+                if hot.engine.handles(sku):
+                    await hot.engine.set(sku, stock, name)
+        chunk.clear()
+
+    async for line, row in _rows(stream, fmt):
+        out.received += 1
+        if isinstance(row, str):
+            fail(line, None, row)
+            continue
+        try:
+            item = model.model_validate(row)
+        except ValidationError as e:
+            fail(line, row.get("sku") if isinstance(row.get("sku"), str) else None, _describe(e))
+            continue
+        chunk.pop(item.sku, None)  # repetido: cuenta una vez, con la ultima fila
+        # sin columna/campo stock (o vacio en el CSV) el stock del SKU existente no se toca
+        chunk[item.sku] = (line, item.name, item.stock if "stock" in item.model_fields_set else None)
+        if len(chunk) >= BULK_CHUNK:
+            await flush()
+    if chunk:
+        await flush()
+    return out
+
+
+def csv_response(session_factory, stmt) -> StreamingResponse:
+    """Como `ndjson_response` pero en CSV (con header)."""
+    async def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)  # \r\n (RFC 4180): asi tambien van entre comillas los nombres con \r
+        writer.writerow(CSV_COLUMNS)
+        async with session_factory() as db:
+            result = await db.stream(stmt.execution_options(yield_per=NDJSON_CHUNK))
+            async for chunk in result.partitions():
+                writer.writerows(chunk)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(rows(), media_type=f"{CSV}; charset=utf-8",
+                             headers={"Content-Disposition": 'attachment; filename="items.csv"'})
@@ -1,44 +1,188 @@
-from sqlalchemy.orm import Session
-from .models import Item
+import re
+from sqlalchemy import literal_column, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from common import etag, idempotency
+from .models import Item, idempotency_keys, items_fts, table_versions
 
-# metodo GET
-def list_items(db: Session):
-    return db.query(Item).all()
+# metodo GET (keyset: ordenado por id, solo ids mayores al cursor)
+def list_items_stmt(after: int | None = None, sku_prefix: str | None = None, min_stock: int | None = None):
+    stmt = select(Item).order_by(Item.id)
+    if after is not None:
+        stmt = stmt.where(Item.id > after)
+    return _filter(stmt, sku_prefix, min_stock)
 
-def get_item_by_sku(db: Session, sku: str):
-    return db.query(Item).filter(Item.sku == sku).first()
+async def list_items(db: AsyncSession, limit: int | None = None, after: int | None = None,
+                     sku_prefix: str | None = None, min_stock: int | None = None):
+    stmt = list_items_stmt(after, sku_prefix, min_stock)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return (await db.scalars(stmt)).all()
+
+def _filter(stmt, sku_prefix: str | None, min_stock: int | None):
+    if sku_prefix:
+        # rango [prefijo, prefijo con el ultimo caracter +1): usa el indice de sku (un LIKE no)
+        upper = sku_prefix[:-1] + chr(ord(sku_prefix[-1]) + 1)
+        stmt = stmt.where(Item.sku >= sku_prefix, Item.sku < upper)
+    if min_stock is not None:
+        stmt = stmt.where(Item.stock >= min_stock)
+    return stmt
+
+def fts_query(q: str) -> str | None:
+    """Texto libre -> consulta FTS5: cada palabra entre comillas y como prefijo (`"tor"*`), todas requeridas.
+    None si no queda ninguna palabra."""
+    terms = re.findall(r"\w+", q)
+    return " ".join(f'"{t}"*' for t in terms) or None
+
+# busqueda por nombre: ordenada por relevancia (bm25) y paginada por offset
+def search_items_stmt(query: str, sku_prefix: str | None = None, min_stock: int | None = None):
+    stmt = (
+        select(Item)
+        .join(items_fts, items_fts.c.rowid == Item.id)
+        .where(literal_column("items_fts").op("MATCH")(query))
+        .order_by(items_fts.c.rank, Item.id)
+    )
+    return _filter(stmt, sku_prefix, min_stock)
+
+async def search_items(db: AsyncSession, query: str, limit: int, offset: int = 0,
+                       sku_prefix: str | None = None, min_stock: int | None = None):
+    stmt = search_items_stmt(query, sku_prefix, min_stock).limit(limit).offset(offset)
+    return (await db.scalars(stmt)).all()
+
+async def get_item_by_sku(db: AsyncSession, sku: str):
+    return await db.scalar(select(Item).where(Item.sku == sku))
 
 # metodo POST
-def create_item(db: Session, name: str, sku: str, stock: int = 0):
+async def create_item(db: AsyncSession, name: str, sku: str, stock: int = 0):
     # Validación simple de SKU único
-    if get_item_by_sku(db, sku):
+    if await get_item_by_sku(db, sku):
         raise ValueError("SKU ya existente")
     item = Item(name=name, sku=sku, stock=stock)
     db.add(item)
-    db.commit()
-    db.refresh(item)
+    await etag.bump(db, table_versions, "items")
+    await db.commit()  # expire_on_commit=False: no hace falta refresh
     return item
 
+# carga masiva: un SELECT para ver que hay, un upsert (executemany) con lo que cambia y un commit
+async def upsert_items(db: AsyncSession, rows: dict[str, tuple[str, int | None]]) -> tuple[int, int, int]:
+    """Crea o actualiza por SKU {sku: (name, stock)}. Devuelve (insertados, actualizados, sin cambios).
+
+    Con stock None la fila no trae stock: un SKU existente lo conserva y uno nuevo arranca en 0.
+    """
+    existing = {
+        sku: (name, stock) for sku, name, stock in
+        await db.execute(select(Item.sku, Item.name, Item.stock).where(Item.sku.in_(list(rows))))
+    }
+    def same(sku, name, stock):
+        return sku in existing and existing[sku][0] == name and stock in (None, existing[sku][1])
+    changed = [(sku, name, stock) for sku, (name, stock) in rows.items() if not same(sku, name, stock)]
+    stmt = sqlite_insert(Item)
+    with_stock = [{"sku": sku, "name": name, "stock": stock} for sku, name, stock in changed if stock is not None]
+    if with_stock:
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[Item.sku], set_={"name": stmt.excluded.name, "stock": stmt.excluded.stock}),
+            with_stock,
+        )
+    # sin stock no se toca el de la db (las reservas lo siguen cambiando mientras tanto)
+    name_only = [{"sku": sku, "name": name, "stock": 0} for sku, name, stock in changed if stock is None]
+    if name_only:
+        await db.execute(
+            stmt.on_conflict_do_update(index_elements=[Item.sku], set_={"name": stmt.excluded.name}),
+            name_only,
+        )
+    if changed:
+        await etag.bump(db, table_versions, "items")
+    await db.commit()
+    inserted = sum(1 for sku in rows if sku not in existing)
+    return inserted, len(changed) - inserted, len(rows) - len(changed)
+
+def export_items_stmt():
+    return select(Item.id, Item.name, Item.sku, Item.stock).order_by(Item.id)
+
+# reserva atomica: un solo UPDATE condicional decide todo, sin leer antes la fila
+def _reserve_stmt(sku: str, qty: int):
+    return (
+        update(Item)
+        .where(Item.sku == sku, Item.stock >= qty)
+        .values(stock=Item.stock - qty)
+        .returning(Item.id, Item.name, Item.sku, Item.stock)
+        .execution_options(synchronize_session=False)
+    )
+
+def _release_stmt(sku: str, qty: int):
+    return (
+        update(Item)
+        .where(Item.sku == sku)
+        .values(stock=Item.stock + qty)
+        .returning(Item.id, Item.name, Item.sku, Item.stock)
+        .execution_options(synchronize_session=False)
+    )
+
+# Idempotency-Key: la clave se guarda en la misma transaccion que el cambio de stock, solo si
+# hubo cambio (un 404/409 no toca nada y se puede repetir). Un repetido concurrente choca con la
+# PK de la clave (IntegrityError) y su transaccion entera se deshace.
+def stock_fingerprint(op: str, sku: str, qty: int) -> str:
+    return idempotency.fingerprint(op, sku, qty)
+
+async def _save_keys(db: AsyncSession, op: str, lines, rows, keys):
+    for (sku, qty), row, key in zip(lines, rows, keys):
+        if key is not None and row is not None:
+            await idempotency.save(db, idempotency_keys, key, stock_fingerprint(op, sku, qty), 200, row._asdict())
+
+async def reserve_stock(db: AsyncSession, sku: str, qty: int, key: str | None = None):
+    """Descuenta `qty` si alcanza el stock. Devuelve la fila nueva, o None si no existe o no alcanza."""
+    return (await reserve_stock_batch(db, [(sku, qty)], [key]))[0]
+
+# devolucion de stock reservado (ej. orden cancelada o fallida)
+async def release_stock(db: AsyncSession, sku: str, qty: int, key: str | None = None):
+    """Suma `qty` al stock. Devuelve la fila nueva, o None si el SKU no existe."""
+    return (await release_stock_batch(db, [(sku, qty)], [key]))[0]
+
+# versiones en lote: todas las lineas en una sola transaccion (un solo commit/fsync)
+async def reserve_stock_batch(db: AsyncSession, lines: list[tuple[str, int]], keys: list[str | None] | None = None):
+    """Reserva cada (sku, qty) que alcance. Devuelve por linea la fila nueva o None."""
+    rows = [(await db.execute(_reserve_stmt(sku, qty))).first() for sku, qty in lines]
+    if any(row is not None for row in rows):
+        await etag.bump(db, table_versions, "items")
+        await _save_keys(db, "reserve", lines, rows, keys or [None] * len(lines))
+    await db.commit()
+    return rows
+
+async def release_stock_batch(db: AsyncSession, lines: list[tuple[str, int]], keys: list[str | None] | None = None):
+    rows = [(await db.execute(_release_stmt(sku, qty))).first() for sku, qty in lines]
+    if any(row is not None for row in rows):
+        await etag.bump(db, table_versions, "items")
+        await _save_keys(db, "release", lines, rows, keys or [None] * len(lines))
+    await db.commit()
+    return rows
+
+async def get_stock_by_skus(db: AsyncSession, skus: list[str]) -> dict[str, int]:
+    return dict((await db.execute(select(Item.sku, Item.stock).where(Item.sku.in_(skus)))).all())
+
 # metodo PUT
-def get_item_by_id(db: Session, item_id: int):
-    return db.query(Item).filter(Item.id == item_id).first()
+async def get_item_by_id(db: AsyncSession, item_id: int):
+    return await db.get(Item, item_id)
 
-def update_item(db: Session, item_id: int, name: str | None = None, sku: str | None = None, stock: int | None = None):
-    item = get_item_by_id(db, item_id)
+async def update_item(db: AsyncSession, item_id: int, name: str | None = None, sku: str | None = None, stock: int | None = None):
+    item = await get_item_by_id(db, item_id)
     if not item:
         return None
-    if sku and db.query(Item).filter(Item.sku == sku, Item.id != item_id).first():
+    if sku and await db.scalar(select(Item.id).where(Item.sku == sku, Item.id != item_id)):
         raise ValueError("SKU ya existente")
     if name is not None:  item.name = name
     if sku  is not None:  item.sku  = sku
     if stock is not None: item.stock = stock
-    db.commit(); db.refresh(item)
+    await etag.bump(db, table_versions, "items")
+    await db.commit()
     return item
 
 # metodo DELETE
-def delete_item(db: Session, item_id: int) -> bool:
-    item = get_item_by_id(db, item_id)
+async def delete_item(db: AsyncSession, item_id: int) -> bool:
+    item = await get_item_by_id(db, item_id)
     if not item:
         return False
-    db.delete(item); db.commit()
-    return True
\ No newline at end of file
+    await db.delete(item)
+    await etag.bump(db, table_versions, "items")
+    await db.commit()
+    return True
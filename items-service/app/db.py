@@ -1,17 +1,17 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+from common.db import make_engine, make_async_engines
 
-# SQLite local
-DATABASE_URL = "sqlite:///data/items.db"
+# SQLite local (ITEMS_DATABASE_URL, por defecto sqlite:///data/items.db) con WAL y pragmas
+# engine sync: solo para crear el esquema
+engine = make_engine("items")
 
-# Motor de db
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}  # necesario para SQLite + threads en dev
-)
+# engines async (aiosqlite) para las requests
+async_engine, async_read_engine = make_async_engines("items")
 
-# Instamciamos la sesion
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+# Instamciamos la sesion (y una de solo lectura para las rutas GET)
+SessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
 
 # creamos la Base de la db
 class Base(DeclarativeBase):
@@ -0,0 +1,399 @@
+"""Reservas en memoria para SKUs calientes (opcional), con journal y write-behind a SQLite.
+
+Con `ITEMS_HOT_SKUS="SKU-1,SKU-2"` el stock de esos SKUs vive en memoria y es la
+fuente de verdad: `/reserve` y `/release` (y sus versiones en lote) los resuelven
+sin tocar la db. El chequeo y el descuento van sin `await` de por medio, asi que en
+el event loop son atomicos sin locks.
+
+- Journal: cada cambio se agrega como `seq<TAB>sku<TAB>stock` (el stock nuevo, no la
+  diferencia) a `ITEMS_HOT_JOURNAL`. Las escrituras se agrupan: un `write` y un
+  `fsync` por tanda (`ITEMS_HOT_FSYNC=0` para no hacer fsync). La respuesta sale
+  cuando su linea ya esta en el journal.
+- Si una tanda falla se recorta el archivo a como estaba, cada operacion deshace su
+  cambio en memoria y responde error. Las lineas que se agregaron mientras tanto
+  traen un stock calculado con esos cambios, asi que la tanda siguiente termina con
+  una linea por cada SKU afectado con su stock actual en memoria (`seq` mayor: al
+  recuperar, pisa a las anteriores).
+- Write-behind: cada `ITEMS_HOT_FLUSH_INTERVAL` segundos se escribe en `items` el
+  ultimo stock de cada SKU que cambio y el ultimo `seq` guardado
+  (`hot_stock_state`), en una sola transaccion. Despues se borran los segmentos del
+  journal que ya quedaron en la db.
+- Recuperacion: al arrancar se leen los segmentos y se aplican las lineas con `seq`
+  mayor al guardado. Como cada linea trae el stock final, repetirla no cuenta dos veces.
+- Idempotencia: una reserva/devolucion con `Idempotency-Key` agrega la clave a su
+  linea (`seq<TAB>sku<TAB>stock<TAB>key<TAB>fingerprint`) y queda en memoria; el
+  flush la guarda en `idempotency_keys` en la misma transaccion que el stock. En
+  memoria se queda `KEY_GRACE` segundos mas, asi un request que ya miro la db no se
+  la pierde en el medio.
+
+El stock en memoria es de un proceso: items-service tiene que correr con un solo
+worker mientras haya SKUs calientes. Lo que devuelven `GET /items` sale de la db y
+puede atrasar hasta un flush.
+"""
+import asyncio, glob, json, os, time
+from typing import NamedTuple
+from fastapi import HTTPException
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from common import etag, idempotency
+from common.db import database_url
+from common.logging import log_json
+from common.metrics import REGISTRY
+from .models import Item, hot_stock_state, idempotency_keys, table_versions
+
+HOT_SKUS = [s.strip() for s in os.getenv("ITEMS_HOT_SKUS", "").split(",") if s.strip()]
+JOURNAL = os.getenv("ITEMS_HOT_JOURNAL", "") or (make_url(database_url("items")).database or "items.db") + ".hot"
+FSYNC = os.getenv("ITEMS_HOT_FSYNC", "1") == "1"
+FLUSH_INTERVAL = float(os.getenv("ITEMS_HOT_FLUSH_INTERVAL", "0.2"))
+JOURNAL_RETRY = 0.05  # segundos despues de una tanda fallida (las operaciones deshacen su cambio en el medio)
+KEY_GRACE = 60.0  # segundos que una clave ya guardada en la db sigue en memoria
+
+RESERVES = REGISTRY.counter("items_hot_reserve_total", "Reservas resueltas en memoria", ("result",))
+UNFLUSHED = REGISTRY.gauge("items_hot_unflushed", "SKUs calientes con cambios todavia no escritos en la db")
+JOURNAL_BATCHES = REGISTRY.counter("items_hot_journal_writes_total", "Tandas escritas al journal (un fsync cada una)")
+
+
+class StockRow(NamedTuple):
+    """Misma forma que la fila que devuelve `crud.reserve_stock`."""
+    id: int
+    name: str
+    sku: str
+    stock: int
+
+
+class Line(NamedTuple):
+    seq: int
+    sku: str
+    stock: int
+    key: str | None = None
+    fp: str | None = None
+
+
+class Journal:
+    """Archivo append-only en segmentos `<path>.<primer seq>`; escribe por tandas (group commit)."""
+
+    def __init__(self, path: str, fsync: bool):
+        self.path, self.fsync = path, fsync
+        self.lock = asyncio.Lock()  # escritura en curso vs rotacion
+        self._pending: list[Line] = []
+        self._done: asyncio.Future | None = None
+        self._wake = asyncio.Event()
+        self._fd: int | None = None
+        self.on_durable = None  # callback(lineas) cuando una tanda ya esta escrita
+        self.on_failed = None   # callback(lineas) cuando una tanda no se pudo escribir
+        self.extra_lines = None  # callback() -> lineas a agregar al final de la proxima tanda
+
+    def segments(self) -> list[str]:
+        return sorted(glob.glob(f"{glob.escape(self.path)}.*"), key=lambda p: int(p.rsplit(".", 1)[1]))
+
+    def read(self) -> list[Line]:
+        lines = []
+        for segment in self.segments():
+            with open(segment, encoding="utf-8") as f:
+                for raw in f:
+                    if not raw.endswith("\n"):
+                        break  # ultima linea cortada por un crash: nunca se confirmo
+                    try:
+                        seq, sku, stock, *key = raw.rstrip("\n").split("\t")
+                        lines.append(Line(int(seq), sku, int(stock), *key))
+                    except (TypeError, ValueError):
+                        break
+        return lines
+
+    def open(self, first_seq: int):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(f"{self.path}.{first_seq}", os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def rotate(self, first_seq: int) -> list[str]:
+        """Empieza un segmento nuevo; devuelve los anteriores (llamar con `lock` tomado)."""
+        old = self.segments()
+        os.close(self._fd)
+        self.open(first_seq)
+        return [s for s in old if s != f"{self.path}.{first_seq}"]
+
+    def append(self, line: Line) -> asyncio.Future:
+        if self._done is None:
+            self._done = asyncio.get_running_loop().create_future()
+        self._pending.append(line)
+        self._wake.set()
+        return self._done
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            async with self.lock:
+                lines, done = self._pending + self.extra_lines(), self._done
+                self._pending, self._done = [], None
+                if not lines:
+                    continue
+                size = os.fstat(self._fd).st_size
+                try:
+                    os.write(self._fd, "".join("\t".join(str(v) for v in line if v is not None) + "\n"
+                                               for line in lines).encode())
+                    if self.fsync:
+                        await asyncio.to_thread(os.fsync, self._fd)
+                except Exception as e:
+                    log_json("error", "items.hot.journal.failed", lines=len(lines), error=str(e))
+                    self._truncate(size)
+                    self.on_failed(lines)
+                    if done is not None:
+                        done.set_exception(e)
+                    failed = True
+                else:
+                    self.on_durable(lines)
+                    failed = False
+            if failed:
+                # las operaciones deshacen su cambio y la proxima tanda re-escribe el stock de esos SKUs
+                await asyncio.sleep(JOURNAL_RETRY)
+                self._wake.set()
+                continue
+            JOURNAL_BATCHES.inc()
+            if done is not None:
+                done.set_result(None)
+
+    def _truncate(self, size: int):
+        # que un pedazo de la tanda fallida no quede en el archivo (ni pegado a la linea siguiente)
+        try:
+            os.ftruncate(self._fd, size)
+        except OSError as e:
+            log_json("error", "items.hot.journal.truncate.failed", error=str(e))
+
+    async def drain(self):
+        if self._done is not None:
+            await self._done
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class HotStock:
+    def __init__(self, skus: list[str], journal: Journal, flush_interval: float):
+        self.skus = set(skus)
+        self.journal, self.flush_interval = journal, flush_interval
+        self.items: dict[str, list] = {}  # sku -> [id, name, stock]
+        self.seq = 0            # ultimo seq asignado
+        self.durable_seq = 0    # ultimo seq escrito en el journal
+        self.unflushed: dict[str, int] = {}  # sku -> stock ya en el journal y no en la db
+        self.resync: set[str] = set()  # SKUs de tandas fallidas: el journal puede no coincidir con la memoria
+        # Idempotency-Key -> [fingerprint, fila, seq, guardada en la db, cuando, fin de la escritura al journal]
+        self.keys: dict[str, list] = {}
+        self._tasks: list[asyncio.Task] = []
+        journal.on_durable = self._durable
+        journal.on_failed = self._failed
+        journal.extra_lines = self._resync_lines
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.skus)
+
+    def handles(self, sku: str) -> bool:
+        return sku in self.items
+
+    # arranque y parada
+    async def start(self, session_factory):
+        self.session_factory = session_factory
+        async with session_factory() as db:
+            flushed = await db.scalar(select(hot_stock_state.c.seq).where(hot_stock_state.c.name == "items")) or 0
+            rows = await db.execute(select(Item.id, Item.name, Item.sku, Item.stock).where(Item.sku.in_(self.skus)))
+            self.items = {sku: [item_id, name, stock] for item_id, name, sku, stock in rows}
+
+        # recuperacion: lo que quedo en el journal y no llego a la db (de cualquier SKU, aunque ya no sea caliente)
+        replayed = 0
+        for seq, sku, stock, key, fp in self.journal.read():
+            self.seq = max(self.seq, seq)
+            if seq > flushed:
+                self.unflushed[sku] = stock
+                replayed += 1
+                if sku in self.items:
+                    self.items[sku][2] = stock
+                if key is not None and sku in self.items:
+                    item = self.items[sku]
+                    self.keys[key] = [fp, StockRow(item[0], item[1], sku, stock), seq, False, time.monotonic(), None]
+        self.seq = self.durable_seq = max(self.seq, flushed)
+        self.journal.open(self.seq + 1)
+        await self.flush()
+        log_json("info", "items.hot.started", skus=sorted(self.items), missing=sorted(self.skus - set(self.items)),
+                 replayed=replayed, seq=self.seq)
+        self._tasks = [asyncio.create_task(self.journal.run()), asyncio.create_task(self._flusher())]
+
+    async def stop(self):
+        await self.journal.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        self.journal.close()
+
+    # operaciones (sin await entre el chequeo y el cambio)
+    async def reserve(self, sku: str, qty: int, key: str | None = None, fp: str | None = None):
+        """Como `crud.reserve_stock`: la fila nueva, o None si no alcanza el stock."""
+        if key in self.keys:
+            return await self.recall(key, fp)
+        item = self.items[sku]
+        if item[2] < qty:
+            RESERVES.inc("no_stock")
+            return None
+        item[2] -= qty
+        row = self._row(sku, item)  # antes del await: otras reservas pueden cambiar el stock mientras tanto
+        try:
+            await self._log(sku, item[2], key, fp)
+        except Exception:
+            item[2] += qty  # no quedo en el journal: la reserva no vale
+            raise
+        RESERVES.inc("ok")
+        return row
+
+    async def release(self, sku: str, qty: int, key: str | None = None, fp: str | None = None):
+        if key in self.keys:
+            return await self.recall(key, fp)
+        item = self.items[sku]
+        item[2] += qty
+        row = self._row(sku, item)
+        try:
+            await self._log(sku, item[2], key, fp)
+        except Exception:
+            item[2] -= qty
+            raise
+        return row
+
+    async def recall(self, key: str, fp: str) -> StockRow | None:
+        """La fila de una operacion ya hecha con `key` (espera a que este en el journal), o None."""
+        entry = self.keys.get(key)
+        if entry is None:
+            return None
+        if entry[0] != fp:
+            raise HTTPException(status_code=422, detail=f"{idempotency.HEADER} ya usada con otro request")
+        if entry[5] is not None:
+            await asyncio.shield(entry[5])
+        return entry[1]
+
+    async def set(self, sku: str, stock: int | None = None, name: str | None = None):
+        """Cambio desde PUT /items o la carga masiva: el nuevo stock pisa al de memoria."""
+        item = self.items[sku]
+        if name is not None:
+            item[1] = name
+        if stock is not None and stock != item[2]:
+            delta = stock - item[2]
+            item[2] = stock
+            try:
+                await self._log(sku, stock)
+            except Exception:
+                item[2] -= delta  # como reserve/release: sin pisar lo que cambio mientras tanto
+                raise
+
+    def stock(self, sku: str) -> int:
+        return self.items[sku][2]
+
+    async def track(self, db, skus):
+        """Empieza a manejar los SKUs calientes que se crearon despues del arranque."""
+        new = [sku for sku in skus if sku in self.skus and sku not in self.items]
+        if new:
+            rows = await db.execute(select(Item.id, Item.name, Item.sku, Item.stock).where(Item.sku.in_(new)))
+            for item_id, name, sku, stock in rows:
+                self.items.setdefault(sku, [item_id, name, stock])
+
+    def _row(self, sku: str, item: list) -> StockRow:
+        return StockRow(item[0], item[1], sku, item[2])
+
+    async def _log(self, sku: str, stock: int, key: str | None = None, fp: str | None = None):
+        self.seq += 1
+        done = self.journal.append(Line(self.seq, sku, stock, key, fp))
+        if key is None:
+            return await done
+        # la clave se ve desde ya: un repetido concurrente espera esta misma escritura
+        self.keys[key] = entry = [fp, self._row(sku, self.items[sku])._replace(stock=stock), self.seq, False,
+                                  time.monotonic(), done]
+        try:
+            await done
+        except Exception:
+            self.keys.pop(key, None)
+            raise
+        entry[5] = None
+
+    def _durable(self, lines):
+        for line in lines:
+            self.unflushed[line.sku] = line.stock
+        self.durable_seq = lines[-1].seq
+
+    def _failed(self, lines):
+        self.resync.update(line.sku for line in lines)
+
+    def _resync_lines(self) -> list[Line]:
+        # se llama al armar la tanda: el stock en memoria ya tiene deshechas las operaciones que fallaron
+        lines = []
+        for sku in sorted(self.resync):
+            if sku in self.items:
+                self.seq += 1
+                lines.append(Line(self.seq, sku, self.items[sku][2]))
+        self.resync.clear()
+        return lines
+
+    # write-behind
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:  # la db puede estar ocupada: se reintenta en el proximo
+                log_json("error", "items.hot.flush.failed", error=str(e))
+
+    async def flush(self):
+        self._forget_keys()
+        if not self.unflushed:
+            return
+        # sin escritura del journal en curso: todo lo escrito hasta durable_seq queda en los segmentos viejos
+        async with self.journal.lock:
+            changes, seq = self.unflushed, self.durable_seq
+            self.unflushed = {}
+            sealed = self.journal.rotate(seq + 1)
+            keys = [(key, entry) for key, entry in self.keys.items() if not entry[3] and entry[2] <= seq]
+        start = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                items = Item.__table__
+                await db.execute(
+                    update(items).where(items.c.sku == bindparam("b_sku")).values(stock=bindparam("b_stock")),
+                    [{"b_sku": sku, "b_stock": stock} for sku, stock in changes.items()],
+                )
+                stmt = sqlite_insert(hot_stock_state).values(name="items", seq=seq)
+                await db.execute(stmt.on_conflict_do_update(index_elements=[hot_stock_state.c.name], set_={"seq": seq}))
+                if keys:
+                    now = time.time()
+                    await db.execute(sqlite_insert(idempotency_keys).on_conflict_do_nothing(), [
+                        {"key": key, "fingerprint": entry[0], "status_code": 200,
+                         "body": json.dumps(entry[1]._asdict()), "created_at": now}
+                        for key, entry in keys
+                    ])
+                await etag.bump(db, table_versions, "items")
+                await db.commit()
+        except BaseException:
+            # lo que no se guardo vuelve a la cola (sin pisar cambios mas nuevos); los segmentos quedan
+            for sku, stock in changes.items():
+                self.unflushed.setdefault(sku, stock)
+            raise
+        for _, entry in keys:
+            entry[3] = True
+        for segment in sealed:
+            os.remove(segment)
+        log_json("info", "items.hot.flushed", skus=len(changes), seq=seq, keys=len(keys),
+                 ms=round((time.perf_counter() - start) * 1000, 1))
+
+    def _forget_keys(self):
+        # las claves ya guardadas en la db salen de memoria despues de KEY_GRACE
+        limit = time.monotonic() - KEY_GRACE
+        for key in [key for key, entry in self.keys.items() if entry[3] and entry[4] < limit]:
+            del self.keys[key]
+
+
+engine = HotStock(HOT_SKUS, Journal(JOURNAL, FSYNC), FLUSH_INTERVAL)
+
+
+def _collect():
+    UNFLUSHED.set(value=len(engine.unflushed))
+
+REGISTRY.register_collector(_collect)
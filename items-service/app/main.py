@@ -1,23 +1,59 @@
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from sqlalchemy.exc import SQLAlchemyError
 from .routers import router
-from common.logging import log_json
+from .db import SessionLocal, engine, async_engine, async_read_engine
+from .models import init_schema
+from . import hot
+from common.db import INIT_SCHEMA, warm_up
+from common.logging import log_json, flush_logs
+from common.metrics import instrument_app
+from common.tracing import trace_app
 
 # definimos que es el servicio items en variable de entorno
 os.environ["SERVICE_NAME"] = "items"
 
+# Crea tablas al importar (run.py las crea una vez antes de forkear los workers)
+if INIT_SCHEMA:
+    init_schema(engine)
+    engine.dispose()
+
 # iniciamos fastapi y agregamos endpoints
 app = FastAPI(title="Items Service")
 app.include_router(router)
+instrument_app(app, "items", engines=[async_engine, async_read_engine])
+trace_app(app, "items", engines=[async_engine, async_read_engine])
 
 # gancho de prendido (obsoleto)
 @app.on_event("startup")
-def startup():
+async def startup():
+    # reservas en memoria de SKUs calientes: recupera el journal antes de atender
+    if hot.engine.enabled:
+        await hot.engine.start(SessionLocal)
     log_json("info", "service.started")
 
+# cerramos los pools de conexiones de la db
+@app.on_event("shutdown")
+async def shutdown():
+    if hot.engine.enabled:
+        await hot.engine.stop()  # ultimo flush del stock en memoria
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+    flush_logs()
+
 # verificacion si todo esta bien
 @app.get("/health")
-def health():
+async def health():
     log_json("info", "health.check")
     return {"status": "ok"}
 
+# listo para recibir trafico: la db responde y el pool queda con sus conexiones abiertas
+@app.get("/ready")
+async def ready():
+    try:
+        await warm_up(async_engine, async_read_engine)
+    except SQLAlchemyError as e:
+        log_json("error", "ready.failed", error=str(e))
+        raise HTTPException(status_code=503, detail="db no disponible")
+    return {"status": "ready", "pid": os.getpid()}
+
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, Table, column, table, text
+from common.etag import versions_table
+from common.idempotency import keys_table
 from .db import Base
 
 # heredamos de Base, creammos nuestra db
@@ -8,4 +10,51 @@ class Item(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     sku = Column(String(60), unique=True, index=True, nullable=False) #codigo de barra. "Stock Keeping Unit"
-    stock = Column(Integer, nullable=False, default=0)
\ No newline at end of file
+    stock = Column(Integer, nullable=False, default=0)
+
+# version de cada tabla para los ETags (ver common.etag)
+table_versions = versions_table(Base.metadata)
+
+# respuestas de /reserve y /release por Idempotency-Key (ver common.idempotency)
+idempotency_keys = keys_table(Base.metadata)
+
+# ultimo seq del journal de reservas en memoria que ya esta en `items` (ver hot.py)
+hot_stock_state = Table(
+    "hot_stock_state", Base.metadata,
+    Column("name", String(20), primary_key=True),
+    Column("seq", Integer, nullable=False),
+)
+
+# Indice full-text (FTS5) sobre `name`, con contenido externo: guarda solo el indice y
+# lee las filas de `items`. Los triggers lo mantienen al dia con los INSERT/UPDATE/DELETE
+# (el UPDATE solo si cambia el nombre: las reservas de stock no lo tocan).
+items_fts = table("items_fts", column("rowid"), column("rank"))
+
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS items_fts
+       USING fts5(name, content='items', content_rowid='id', tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+         INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+         INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF name ON items BEGIN
+         INSERT INTO items_fts(items_fts, rowid, name) VALUES ('delete', old.id, old.name);
+         INSERT INTO items_fts(rowid, name) VALUES (new.id, new.name);
+       END""",
+]
+
+def create_search_index(engine):
+    """Crea el indice FTS5 y sus triggers; si el indice es nuevo lo llena con los items que ya existian."""
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'")).first()
+        for ddl in FTS_DDL:
+            conn.execute(text(ddl))
+        if not exists:
+            conn.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+def init_schema(engine):
+    """Crea las tablas que falten y el indice FTS5 (al importar main.py, o una vez desde run.py)."""
+    Base.metadata.create_all(bind=engine)
+    create_search_index(engine)
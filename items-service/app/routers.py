@@ -1,24 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Response
+import asyncio, os
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
 from common.auth import verify_service_token
 from common.logging import log_json
+from common import etag, idempotency
+from common.pagination import DEFAULT_LIMIT, MAX_LIMIT, page_limit, wants_ndjson, paginate, set_next_cursor, set_next_offset, ndjson_response
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from .db import SessionLocal, engine
-from .models import Base
-from . import crud
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import SessionLocal, ReadSessionLocal
+from .models import idempotency_keys, table_versions
+from . import bulk, crud, hot
 
 router = APIRouter(tags=["items"])
 
-# Crea tablas al importar el router
-Base.metadata.create_all(bind=engine)
+# offset maximo de la busqueda: mas alla, SQLite igual recorre y ordena todos los anteriores
+MAX_SEARCH_OFFSET = int(os.getenv("ITEMS_SEARCH_MAX_OFFSET", "10000"))
 
 # manejo de sesiones de db
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+# sesion para rutas GET (engine de solo lectura si DB_SEPARATE_READ_ENGINE=1)
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # Validacion de lo que entrara en metodo post
 class ItemIn(BaseModel):
@@ -26,6 +32,10 @@ class ItemIn(BaseModel):
     sku: str = Field(min_length=1, max_length=60)
     stock: int = 0
 
+# Fila de POST /items/bulk: como ItemIn pero sin stock negativo (como ItemUpdate)
+class ItemBulkIn(ItemIn):
+    stock: int = Field(default=0, ge=0)
+
 # Hereda de ItemsIn y agrega ID para el metodo get
 class ItemOut(ItemIn):
     id: int
@@ -36,55 +46,276 @@ class ItemUpdate(BaseModel):
     sku:  str | None = Field(default=None, max_length=60)
     stock: int | None = Field(default=None, ge=0) # ge significa greater or equal to 0
 
-# metodo get a /
+# Lineas de reserva/devolucion en lote (en lote la Idempotency-Key va por linea)
+class StockLine(BaseModel):
+    sku: str = Field(min_length=1, max_length=60)
+    qty: int = Field(gt=0)
+    key: str | None = Field(default=None, min_length=1, max_length=idempotency.MAX_KEY_LENGTH)
+
+class StockBatchIn(BaseModel):
+    lines: list[StockLine] = Field(min_length=1)
+
+class StockLineResult(StockLine):
+    ok: bool
+    stock: int | None = None
+    error: str | None = None  # "not_found" | "no_stock"
+
+class StockBatchOut(BaseModel):
+    results: list[StockLineResult]
+
+# metodo get a / (paginado por cursor; con Accept: application/x-ndjson streamea todo)
+# filtros: sku_prefix (rango sobre el indice de sku), min_stock y q (full-text sobre el nombre,
+# ordenado por relevancia y paginado por offset)
 @router.get("/", response_model=list[ItemOut])
-def list_items(db: Session = Depends(get_db)):
-    items = crud.list_items(db)
+async def list_items(request: Request, response: Response,
+               limit: int | None = Query(default=None, ge=1, le=MAX_LIMIT),
+               after: int | None = Query(default=None, ge=0),
+               q: str | None = Query(default=None, min_length=1, max_length=200),
+               sku_prefix: str | None = Query(default=None, min_length=1, max_length=60),
+               min_stock: int | None = Query(default=None, ge=0),
+               offset: int | None = Query(default=None, ge=0, le=MAX_SEARCH_OFFSET),
+               db: AsyncSession = Depends(get_read_db)):
+    query = None
+    if q is not None:
+        query = crud.fts_query(q)
+        if query is None:
+            raise HTTPException(status_code=400, detail="La busqueda no tiene palabras")
+        if after is not None:
+            raise HTTPException(status_code=400, detail="Con q se pagina con offset, no con after")
+    elif offset is not None:
+        raise HTTPException(status_code=400, detail="offset solo se usa con q")
+
+    # GET condicional: con la version de la tabla alcanza para responder 304 sin listar
+    tag = etag.make_etag("items", await etag.current(db, table_versions, "items"), request)
+    if etag.matches(request, tag):
+        return etag.not_modified(tag)
+    if wants_ndjson(request):
+        log_json("info", "items.streamed", after=after, q=q, sku_prefix=sku_prefix)
+        if query is not None:
+            stmt = crud.search_items_stmt(query, sku_prefix, min_stock).offset(offset or 0)
+        else:
+            stmt = crud.list_items_stmt(after, sku_prefix, min_stock)
+        return etag.set_headers(ndjson_response(ReadSessionLocal, stmt if limit is None else stmt.limit(limit), ItemOut), tag)
+    etag.set_headers(response, tag)
+    if query is not None:
+        limit, offset = limit or DEFAULT_LIMIT, offset or 0
+        rows = await crud.search_items(db, query, limit + 1, offset, sku_prefix, min_stock)
+        items = rows[:limit]
+        set_next_offset(request, response, offset, limit, len(rows) > limit)
+        log_json("info", "items.searched", q=q, count=len(items), offset=offset)
+        return items
+    page = page_limit(limit, after)  # sin limit ni after: todas
+    items, next_cursor = paginate(await crud.list_items(db, page and page + 1, after, sku_prefix, min_stock), page)
+    set_next_cursor(request, response, next_cursor, page)
     log_json("info", "items.listed", count=len(items))
     return items
 
+# carga masiva: CSV (text/csv, con header name,sku,stock) o NDJSON, upsert por SKU (ver bulk.py)
+@router.post("/bulk", response_model=bulk.BulkOut)
+async def bulk_upsert(request: Request, db: AsyncSession = Depends(get_db)):
+    fmt = bulk.format_of(request.headers.get("content-type", ""))
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Formato no soportado: usar text/csv o application/x-ndjson")
+    try:
+        out = await bulk.import_items(db, request.stream(), fmt, ItemBulkIn)
+    except ValueError as e:  # CSV sin las columnas necesarias
+        raise HTTPException(status_code=400, detail=str(e))
+    log_json("info", "items.bulk.imported", format=fmt, received=out.received, inserted=out.inserted,
+             updated=out.updated, unchanged=out.unchanged, failed=out.failed)
+    return out
+
+# export del catalogo completo en streaming: NDJSON (por defecto) o CSV (?format=csv o Accept: text/csv)
+@router.get("/export", response_model=None)
+async def export_items(request: Request, format: str | None = Query(default=None, pattern="^(csv|ndjson)$"),
+                       db: AsyncSession = Depends(get_read_db)):
+    as_csv = format == "csv" or (format is None and bulk.CSV in request.headers.get("accept", ""))
+    version = await etag.current(db, table_versions, "items")
+    tag = f'"items-{version}-{"csv" if as_csv else "ndjson"}"'
+    if etag.matches(request, tag):
+        return etag.not_modified(tag)
+    log_json("info", "items.exported", format="csv" if as_csv else "ndjson")
+    if as_csv:
+        return etag.set_headers(bulk.csv_response(ReadSessionLocal, crud.export_items_stmt()), tag)
+    return etag.set_headers(ndjson_response(ReadSessionLocal, crud.list_items_stmt(), ItemOut), tag)
+
 # metodo post a /
 @router.post("/", response_model=ItemOut, status_code=201)
-def create_item(payload: ItemIn, db: Session = Depends(get_db)):
+async def create_item(payload: ItemIn, db: AsyncSession = Depends(get_db)):
     try:
-        item = crud.create_item(db, payload.name, payload.sku, payload.stock)
+        item = await crud.create_item(db, payload.name, payload.sku, payload.stock)
+        await hot.engine.track(db, [item.sku])
         log_json("info", "item.created", item_id=item.id, sku=item.sku, stock=item.stock)
         return item
     except ValueError as e:
         log_json("warn", "item.create.conflict", sku=payload.sku)
         raise HTTPException(status_code=409, detail=str(e))
 
-# ruta reserve para verificar stock y existencia, descontar stock dependiendo de Orders qty    
+# Idempotency-Key: una reserva/devolucion repetida devuelve la fila de la primera vez
+async def _recall(db: AsyncSession, key: str, fp: str) -> tuple[int, dict] | None:
+    stored = await idempotency.lookup(db, idempotency_keys, key, fp)
+    if stored is None:
+        # SKU caliente: puede estar todavia solo en memoria (se mira despues de la db, ver hot.py)
+        row = await hot.engine.recall(key, fp)
+        stored = (200, row._asdict()) if row is not None else None
+    return stored
+
+async def _replay_conflict(db: AsyncSession, response: Response, key: str, fp: str):
+    # el mismo request llego dos veces a la vez y el otro guardo la clave primero: su cambio es el que vale
+    await db.rollback()
+    stored = await _recall(db, key, fp)
+    if stored is None:
+        raise HTTPException(status_code=409, detail=f"{idempotency.HEADER} en uso, reintentar")
+    log_json("info", "item.idempotency.replayed", key=key)
+    return idempotency.replay(response, stored)
+
+# ruta reserve para verificar stock y existencia, descontar stock dependiendo de Orders qty
 @router.post("/reserve", response_model=ItemOut, dependencies=[Depends(verify_service_token)])
-def reserve_item(sku: str = Body(..., embed=True), qty: int = Body(..., gt=0), db: Session = Depends(get_db)):
-    item = crud.get_item_by_sku(db, sku)
-    if not item:
-        log_json("warn", "item.reserve.not_found", sku=sku)
-        raise HTTPException(status_code=404, detail="Item no encontrado")
-    if item.stock < qty:
+async def reserve_item(request: Request, response: Response, sku: str = Body(..., embed=True),
+                       qty: int = Body(..., gt=0), db: AsyncSession = Depends(get_db)):
+    key, fp = idempotency.key_from(request), crud.stock_fingerprint("reserve", sku, qty)
+    async with idempotency.exclusive(key):
+        if key is not None and (stored := await _recall(db, key, fp)) is not None:
+            return idempotency.replay(response, stored)
+        if hot.engine.handles(sku):
+            # SKU caliente: se resuelve en memoria (ver hot.py)
+            row = await hot.engine.reserve(sku, qty, key, fp)
+            if row is None:
+                log_json("warn", "item.reserve.no_stock", sku=sku, requested=qty, available=hot.engine.stock(sku))
+                raise HTTPException(status_code=409, detail="Stock insuficiente")
+            return row._asdict()
+        try:
+            row = await crud.reserve_stock(db, sku, qty, key)
+        except IntegrityError:
+            return await _replay_conflict(db, response, key, fp)
+    if row is None:
+        # solo en el camino de error miramos la fila para distinguir 404 de 409
+        item = await crud.get_item_by_sku(db, sku)
+        if not item:
+            log_json("warn", "item.reserve.not_found", sku=sku)
+            raise HTTPException(status_code=404, detail="Item no encontrado")
         log_json("warn", "item.reserve.no_stock", sku=sku, requested=qty, available=item.stock)
         raise HTTPException(status_code=409, detail="Stock insuficiente")
-    item.stock -= qty
-    db.commit()
-    db.refresh(item)
-    log_json("info", "item.reserve.ok", item_id=item.id, new_stock=item.stock)
-    return item
+    log_json("info", "item.reserve.ok", item_id=row.id, new_stock=row.stock)
+    return row._asdict()
+
+# ruta release para devolver stock reservado
+@router.post("/release", response_model=ItemOut, dependencies=[Depends(verify_service_token)])
+async def release_item(request: Request, response: Response, sku: str = Body(..., embed=True),
+                       qty: int = Body(..., gt=0), db: AsyncSession = Depends(get_db)):
+    key, fp = idempotency.key_from(request), crud.stock_fingerprint("release", sku, qty)
+    async with idempotency.exclusive(key):
+        if key is not None and (stored := await _recall(db, key, fp)) is not None:
+            return idempotency.replay(response, stored)
+        if hot.engine.handles(sku):
+            return (await hot.engine.release(sku, qty, key, fp))._asdict()
+        try:
+            row = await crud.release_stock(db, sku, qty, key)
+        except IntegrityError:
+            return await _replay_conflict(db, response, key, fp)
+    if row is None:
+        log_json("warn", "item.release.not_found", sku=sku)
+        raise HTTPException(status_code=404, detail="Item no encontrado")
+    log_json("info", "item.release.ok", item_id=row.id, new_stock=row.stock)
+    return row._asdict()
+
+# reserva en lote: una sola transaccion, resultado por linea (las que fallan no descuentan nada)
+@router.post("/reserve/batch", response_model=StockBatchOut, dependencies=[Depends(verify_service_token)])
+async def reserve_batch(payload: StockBatchIn, db: AsyncSession = Depends(get_db)):
+    lines = [(l.sku, l.qty) for l in payload.lines]
+    rows = await _stock_batch(db, "reserve", lines, [l.key for l in payload.lines],
+                              hot.engine.reserve, crud.reserve_stock_batch)
+    failed = [sku for (sku, _), row in zip(lines, rows) if row is None]
+    stock = {sku: hot.engine.stock(sku) for sku in failed if hot.engine.handles(sku)}
+    cold = [sku for sku in failed if sku not in stock]
+    stock.update(await crud.get_stock_by_skus(db, cold) if cold else {})
+    results = []
+    for line, row in zip(payload.lines, rows):
+        if row is not None:
+            results.append(StockLineResult(**line.model_dump(), ok=True, stock=row.stock))
+        elif line.sku in stock:
+            results.append(StockLineResult(**line.model_dump(), ok=False, stock=stock[line.sku], error="no_stock"))
+        else:
+            results.append(StockLineResult(**line.model_dump(), ok=False, error="not_found"))
+    log_json("info", "item.reserve.batch", lines=len(lines), failed=len(failed))
+    return StockBatchOut(results=results)
+
+# devolucion en lote, tambien en una sola transaccion
+@router.post("/release/batch", response_model=StockBatchOut, dependencies=[Depends(verify_service_token)])
+async def release_batch(payload: StockBatchIn, db: AsyncSession = Depends(get_db)):
+    lines = [(l.sku, l.qty) for l in payload.lines]
+    rows = await _stock_batch(db, "release", lines, [l.key for l in payload.lines],
+                              hot.engine.release, crud.release_stock_batch)
+    results = [
+        StockLineResult(**line.model_dump(), ok=True, stock=row.stock) if row is not None
+        else StockLineResult(**line.model_dump(), ok=False, error="not_found")
+        for line, row in zip(payload.lines, rows)
+    ]
+    log_json("info", "item.release.batch", lines=len(lines))
+    return StockBatchOut(results=results)
+
+# lineas con una clave ya usada: la fila de la primera vez; lineas de SKUs calientes en memoria
+# (en orden, una tanda del journal); el resto en una transaccion
+async def _stock_batch(db: AsyncSession, op: str, lines: list[tuple[str, int]], keys: list[str | None],
+                       in_memory, in_db):
+    fps = [crud.stock_fingerprint(op, sku, qty) if key else None for (sku, qty), key in zip(lines, keys)]
+    keyed = {key: fp for key, fp in zip(keys, fps) if key}
+    if len(keyed) != sum(key is not None for key in keys):
+        raise HTTPException(status_code=422, detail="Claves de idempotencia repetidas en el lote")
+    rows = [None] * len(lines)
+    todo = await _recall_lines(db, keys, keyed, rows, range(len(lines)))
+    hot_idx = [i for i in todo if hot.engine.handles(lines[i][0])]
+    for i, row in zip(hot_idx, await asyncio.gather(*(in_memory(*lines[i], keys[i], fps[i]) for i in hot_idx))):
+        rows[i] = row
+    cold_idx = [i for i in todo if not hot.engine.handles(lines[i][0])]
+    for attempt in range(2):
+        if not cold_idx:
+            break
+        try:
+            for i, row in zip(cold_idx, await in_db(db, [lines[i] for i in cold_idx], [keys[i] for i in cold_idx])):
+                rows[i] = row
+            break
+        except IntegrityError:
+            # otro request con alguna de las mismas claves guardo primero: se deshace y se vuelve a mirar
+            await db.rollback()
+            if attempt:
+                raise HTTPException(status_code=409, detail=f"{idempotency.HEADER} en uso, reintentar")
+            cold_idx = await _recall_lines(db, keys, keyed, rows, cold_idx)
+    return rows
+
+async def _recall_lines(db: AsyncSession, keys: list[str | None], keyed: dict[str, str], rows: list, idx) -> list[int]:
+    """Completa `rows` con las lineas ya hechas; devuelve los indices que faltan."""
+    stored = await idempotency.lookup_many(db, idempotency_keys, {keys[i]: keyed[keys[i]] for i in idx if keys[i]})
+    for i in idx:
+        if keys[i] in stored:
+            rows[i] = hot.StockRow(**stored[keys[i]][1])
+    return [i for i in idx if keys[i] not in stored]
 
 # metodo put a /id
 @router.put("/{item_id}", response_model=ItemOut, summary="Actualizar item")
-def update_item_route(item_id: int, payload: ItemUpdate, db: Session = Depends(get_db)):
+async def update_item_route(item_id: int, payload: ItemUpdate, db: AsyncSession = Depends(get_db)):
+    current = await crud.get_item_by_id(db, item_id)
+    if current and hot.engine.handles(current.sku) and payload.sku not in (None, current.sku):
+        raise HTTPException(status_code=409, detail="No se puede cambiar el SKU de un item caliente")
     try:
-        updated = crud.update_item(db, item_id, payload.name, payload.sku, payload.stock)
+        updated = await crud.update_item(db, item_id, payload.name, payload.sku, payload.stock)
     except ValueError as e:
         raise HTTPException(status_code=409, detail=str(e))
     if not updated:
         raise HTTPException(status_code=404, detail="Item no encontrado")
+    if hot.engine.handles(updated.sku):
+        # el stock de un SKU caliente lo manda la memoria: el PUT lo pisa ahi (y queda en el journal)
+        await hot.engine.set(updated.sku, payload.stock, payload.name)
+        return {**ItemOut.model_validate(updated, from_attributes=True).model_dump(), "stock": hot.engine.stock(updated.sku)}
+    await hot.engine.track(db, [updated.sku])
     return updated
 
 # metodo delete a /id
 @router.delete("/{item_id}", status_code=204, summary="Eliminar item")
-def delete_item_route(item_id: int, db: Session = Depends(get_db)):
-    ok = crud.delete_item(db, item_id)
+async def delete_item_route(item_id: int, db: AsyncSession = Depends(get_db)):
+    item = await crud.get_item_by_id(db, item_id)
+    if item and hot.engine.handles(item.sku):
+        raise HTTPException(status_code=409, detail="No se puede borrar un item caliente")
+    ok = await crud.delete_item(db, item_id)
     if not ok:
         raise HTTPException(status_code=404, detail="Item no encontrado")
     return Response(status_code=204)
\ No newline at end of file
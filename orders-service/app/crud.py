@@ -1,12 +1,201 @@
-from sqlalchemy.orm import Session
-from .models import Order
+import time
+from collections import Counter
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from common import idempotency
+from .models import Order, OrderDailySales, OrderOutbox, idempotency_keys, reserve_generations
 
-def list_orders(db: Session):
-    return db.query(Order).all()
+PENDING, CONFIRMED, REJECTED = "PENDING", "CONFIRMED", "REJECTED"
 
-def create_order(db: Session, user_id: int, item_sku: str, qty: int = 1, status: str = "CREATED"):
-    o = Order(user_id=user_id, item_sku=item_sku, qty=qty, status=status)
+# keyset: ordenado por id, solo ids mayores al cursor; cada filtro tiene su indice (col, id)
+def list_orders_stmt(after: int | None = None, user_id: int | None = None, item_sku: str | None = None,
+                     status: str | None = None, created_from: float | None = None, created_to: float | None = None):
+    stmt = select(Order).order_by(Order.id)
+    if after is not None:
+        stmt = stmt.where(Order.id > after)
+    if user_id is not None:
+        stmt = stmt.where(Order.user_id == user_id)
+    if item_sku is not None:
+        stmt = stmt.where(Order.item_sku == item_sku)
+    if status is not None:
+        stmt = stmt.where(Order.status == status)
+    if created_from is not None:
+        stmt = stmt.where(Order.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Order.created_at < created_to)
+    return stmt
+
+async def list_orders(db: AsyncSession, limit: int | None = None, after: int | None = None, **filters):
+    stmt = list_orders_stmt(after, **filters)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return (await db.scalars(stmt)).all()
+
+# --- ventas por SKU y dia (rollup) ---
+
+def _day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+async def _add_sales(db: AsyncSession, orders) -> None:
+    """Suma al rollup las ordenes (item_sku, qty, created_at), sin commit: va en la transaccion de la orden."""
+    count, units = Counter(), Counter()
+    for sku, qty, created_at in orders:
+        count[sku, _day(created_at)] += 1
+        units[sku, _day(created_at)] += qty
+    if not count:
+        return
+    stmt = sqlite_insert(OrderDailySales)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[OrderDailySales.item_sku, OrderDailySales.day],
+            set_={"orders": OrderDailySales.orders + stmt.excluded.orders,
+                  "units": OrderDailySales.units + stmt.excluded.units},
+        ),
+        [{"item_sku": sku, "day": day, "orders": n, "units": units[sku, day]} for (sku, day), n in count.items()],
+    )
+
+async def get_sales(db: AsyncSession, item_sku: str | None = None, day_from: str | None = None,
+                    day_to: str | None = None, limit: int = 1000):
+    """Filas del rollup (por PK si hay item_sku, por el indice de day si no)."""
+    stmt = select(OrderDailySales).order_by(OrderDailySales.day, OrderDailySales.item_sku).limit(limit)
+    if item_sku is not None:
+        stmt = stmt.where(OrderDailySales.item_sku == item_sku)
+    if day_from is not None:
+        stmt = stmt.where(OrderDailySales.day >= day_from)
+    if day_to is not None:
+        stmt = stmt.where(OrderDailySales.day <= day_to)
+    return (await db.scalars(stmt)).all()
+
+async def get_order(db: AsyncSession, order_id: int):
+    return await db.get(Order, order_id)
+
+# Idempotency-Key del cliente: la respuesta se guarda en la misma transaccion que la orden; el mismo
+# request repetido a la vez choca con la PK de la clave (IntegrityError) y no crea una segunda orden
+async def _save_key(db: AsyncSession, key: tuple[str, str] | None, status_code: int, o: Order):
+    if key is not None:
+        await db.flush()  # para tener el id
+        body = {c.name: getattr(o, c.name) for c in Order.__table__.columns}
+        await idempotency.save(db, idempotency_keys, *key, status_code, body)
+
+async def lookup_key(db: AsyncSession, key: tuple[str, str]) -> tuple[int, dict] | None:
+    return await idempotency.lookup(db, idempotency_keys, *key)
+
+# clave de /reserve de un POST /orders con Idempotency-Key: el reintento del cliente reusa la misma
+# reserva (si se perdio la respuesta, items no descuenta dos veces). Cuando la reserva se devuelve
+# (compensacion) la generacion sube y el reintento reserva de nuevo con otra clave.
+def _reserve_base(key: tuple[str, str]) -> str:
+    return idempotency.fingerprint("POST /orders reserve", *key)[:40]
+
+async def reserve_key(db: AsyncSession, key: tuple[str, str]) -> str:
+    base = _reserve_base(key)
+    generation = await db.scalar(
+        select(reserve_generations.c.generation).where(reserve_generations.c.key == base)) or 0
+    return f"order-{base}-{generation}"
+
+async def next_reserve_key(db: AsyncSession, key: tuple[str, str]):
+    stmt = sqlite_insert(reserve_generations).values(key=_reserve_base(key), generation=1)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[reserve_generations.c.key], set_={"generation": reserve_generations.c.generation + 1}))
+    await db.commit()
+
+async def create_order(db: AsyncSession, user_id: int, item_sku: str, qty: int = 1, status: str = "CREATED",
+                       key: tuple[str, str] | None = None):
+    """`key`: (Idempotency-Key, fingerprint) del request, si vino."""
+    o = Order(user_id=user_id, item_sku=item_sku, qty=qty, status=status, created_at=time.time())
+    db.add(o)
+    await _add_sales(db, [(item_sku, qty, o.created_at)])
+    await _save_key(db, key, 201, o)
+    await db.commit()  # expire_on_commit=False: no hace falta refresh
+    return o
+
+# insert en lote: un solo INSERT (multi-values) y un solo commit para muchas ordenes
+async def create_orders(db: AsyncSession, rows: list[dict], status: str = "CREATED"):
+    """Inserta `rows` (user_id, item_sku, qty) y devuelve las filas creadas en el mismo orden."""
+    now = time.time()
+    created = (await db.execute(
+        insert(Order).returning(
+            Order.id, Order.user_id, Order.item_sku, Order.qty, Order.status, Order.created_at,
+            sort_by_parameter_order=True,
+        ),
+        [{**row, "status": status, "created_at": now} for row in rows],
+    )).all()
+    await _add_sales(db, [(o.item_sku, o.qty, o.created_at) for o in created])
+    await db.commit()
+    return created
+
+# --- outbox del modo async ---
+
+async def create_pending_order(db: AsyncSession, user_id: int, item_sku: str, qty: int = 1,
+                               key: tuple[str, str] | None = None):
+    """Guarda la orden PENDING y su fila de outbox en la misma transaccion."""
+    o = Order(user_id=user_id, item_sku=item_sku, qty=qty, status=PENDING, created_at=time.time())
     db.add(o)
-    db.commit()
-    db.refresh(o)
+    await db.flush()  # para tener el id
+    db.add(OrderOutbox(order_id=o.id))
+    await _save_key(db, key, 202, o)
+    await db.commit()
     return o
+
+async def claim_outbox(db: AsyncSession, owner: str, limit: int, lease: float) -> list:
+    """Toma hasta `limit` filas libres (sin lease vigente y sin backoff pendiente) con un solo UPDATE.
+
+    Devuelve (order_id, attempts). SQLite serializa las escrituras, asi que dos workers
+    (o dos procesos) nunca toman la misma fila.
+    """
+    now = time.time()
+    free = (
+        select(OrderOutbox.id)
+        .where(OrderOutbox.available_at <= now, OrderOutbox.lease_until < now)
+        .order_by(OrderOutbox.id)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    rows = (await db.execute(
+        update(OrderOutbox)
+        .where(OrderOutbox.id.in_(free))
+        .values(lease_owner=owner, lease_until=now + lease, attempts=OrderOutbox.attempts + 1)
+        .returning(OrderOutbox.order_id, OrderOutbox.attempts),
+        execution_options={"synchronize_session": False},
+    )).all()
+    await db.commit()
+    return rows
+
+async def get_orders(db: AsyncSession, order_ids: list[int]):
+    return (await db.scalars(select(Order).where(Order.id.in_(order_ids)).order_by(Order.id))).all()
+
+async def finish_outbox(db: AsyncSession, owner: str, statuses: dict[int, str], retry_at: dict[int, float]) -> set[int]:
+    """Resuelve las ordenes de `statuses` y reprograma las de `retry_at`, solo si el lease sigue siendo de `owner`.
+
+    Devuelve los ids resueltos. Si el lease vencio y lo tomo otro worker, la orden queda para ese worker.
+    """
+    done: set[int] = set()
+    if statuses:
+        done = set((await db.scalars(
+            delete(OrderOutbox)
+            .where(OrderOutbox.order_id.in_(list(statuses)), OrderOutbox.lease_owner == owner)
+            .returning(OrderOutbox.order_id),
+            execution_options={"synchronize_session": False},
+        )).all())
+        confirmed = [i for i in done if statuses[i] == CONFIRMED]
+        if confirmed:
+            # las confirmadas cuentan como vendidas (en el dia en que se crearon)
+            sold = (await db.execute(
+                update(Order).where(Order.id.in_(confirmed)).values(status=CONFIRMED)
+                .returning(Order.item_sku, Order.qty, Order.created_at),
+                execution_options={"synchronize_session": False},
+            )).all()
+            await _add_sales(db, sold)
+        rejected = [i for i in done if statuses[i] == REJECTED]
+        if rejected:
+            await db.execute(update(Order).where(Order.id.in_(rejected)).values(status=REJECTED),
+                             execution_options={"synchronize_session": False})
+    for order_id, available_at in retry_at.items():
+        await db.execute(
+            update(OrderOutbox)
+            .where(OrderOutbox.order_id == order_id, OrderOutbox.lease_owner == owner)
+            .values(lease_owner=None, lease_until=0, available_at=available_at),
+            execution_options={"synchronize_session": False},
+        )
+    await db.commit()
+    return done
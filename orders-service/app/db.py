@@ -1,13 +1,13 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase
+from common.db import make_engine, make_async_engines
 
-DATABASE_URL = "sqlite:///data/orders.db"
-
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+# ORDERS_DATABASE_URL, por defecto sqlite:///data/orders.db
+# engine sync solo para crear el esquema; las requests usan los async (aiosqlite)
+engine = make_engine("orders")
+async_engine, async_read_engine = make_async_engines("orders")
+SessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
 
 class Base(DeclarativeBase):
     pass
@@ -0,0 +1,118 @@
+import asyncio, os
+from common.auth import add_service_auth
+from common.logging import log_json
+from common import http
+from .user_cache import cache as user_cache
+
+# Llamadas a users-service e items-service que comparten las rutas y los workers del outbox
+USERS_SERVICE_URL  = os.getenv("USERS_SERVICE_URL",  "http://127.0.0.1:8001")
+ITEMS_SERVICE_URL  = os.getenv("ITEMS_SERVICE_URL",  "http://127.0.0.1:8002")
+BATCH_USER_CONCURRENCY = int(os.getenv("ORDERS_BATCH_USER_CONCURRENCY", "20"))
+# reintentos de las compensaciones (/release): si fallan, el stock queda reservado de mas
+RELEASE_RETRY = http.RetryPolicy(attempts=int(os.getenv("ORDERS_RELEASE_ATTEMPTS", "5")), backoff=0.2)
+# hedge (ver common.http) en las llamadas del camino de POST /orders: GET del usuario y /reserve con su clave
+HEDGE = os.getenv("ORDERS_HEDGE", "1") == "1"
+
+
+async def check_user(user_id: int) -> tuple[int, str | None]:
+    """Existe el usuario? Devuelve (status_code, error); pasa primero por el cache de usuarios."""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    version = user_cache.version
+    try:
+        r = await http.arequest("GET", f"{USERS_SERVICE_URL}/{user_id}", headers=add_service_auth({}), hedge=HEDGE)
+    except RuntimeError as e:
+        return 503, str(e)
+    if r.status_code == 404:
+        result = (404, "Usuario no encontrado")
+    elif r.is_error:
+        return 502, "Error consultando usuario"
+    else:
+        result = (200, None)
+    user_cache.put(user_id, result, version)
+    return result
+
+
+async def check_users(user_ids: set[int]) -> dict[int, tuple[int, str | None]]:
+    """Consulta cada usuario distinto una sola vez. Devuelve user_id -> (status_code, error)."""
+    sem = asyncio.Semaphore(BATCH_USER_CONCURRENCY)
+
+    async def check(user_id: int):
+        async with sem:
+            return user_id, await check_user(user_id)
+
+    return dict(await asyncio.gather(*(check(u) for u in user_ids)))
+
+
+async def reserve_lines(lines: list[dict]) -> list[tuple[int, str | None]]:
+    """Reserva muchas lineas {sku, qty, key} en una sola transaccion de items. Devuelve (status_code, error) por linea.
+
+    Con `key` en cada linea, una linea ya reservada con esa clave no se vuelve a descontar.
+    """
+    try:
+        r = await http.arequest("POST", f"{ITEMS_SERVICE_URL}/reserve/batch", json={"lines": lines},
+                                headers=add_service_auth({}))
+    except RuntimeError as e:
+        log_json("error", "item.service.unavailable", lines=len(lines))
+        return [(503, str(e))] * len(lines)
+    if r.is_error:
+        log_json("error", "item.service.error", status=r.status_code)
+        return [(502, "Error reservando stock")] * len(lines)
+    results = []
+    for line in r.json()["results"]:
+        if line["ok"]:
+            results.append((200, None))
+        elif line["error"] == "not_found":
+            results.append((404, "Item no encontrado"))
+        else:
+            results.append((409, "Stock insuficiente"))
+    return results
+
+
+async def release_lines(lines: list[dict]):
+    # compensacion: devolvemos el stock reservado de las filas que no se pudieron crear
+    try:
+        await http.arequest("POST", f"{ITEMS_SERVICE_URL}/release/batch", json={"lines": lines},
+                            headers=add_service_auth({}), retry=RELEASE_RETRY)
+        log_json("warn", "orders.batch.released", lines=len(lines))
+    except RuntimeError:
+        log_json("error", "orders.batch.release.failed", lines=lines)
+
+
+async def reserve_stock(sku: str, qty: int, key: str, hedge: bool = False, retry: http.RetryPolicy | None = None):
+    """`POST /reserve` con `key`: repetida con la misma clave, items devuelve la reserva ya hecha."""
+    return await http.arequest("POST", f"{ITEMS_SERVICE_URL}/reserve", json={"sku": sku, "qty": qty},
+                               headers=add_service_auth({http.IDEMPOTENCY_HEADER: key}), hedge=hedge, retry=retry)
+
+
+async def release_stock(sku: str, qty: int, key: str):
+    # compensacion: devolver una reserva que no termino en orden (con mas reintentos que una llamada normal)
+    try:
+        r = await http.arequest("POST", f"{ITEMS_SERVICE_URL}/release", json={"sku": sku, "qty": qty},
+                                headers=add_service_auth({http.IDEMPOTENCY_HEADER: key}), retry=RELEASE_RETRY)
+    except RuntimeError as e:
+        log_json("error", "order.release.failed", item_sku=sku, qty=qty, error=str(e))
+        return
+    if r.is_error:
+        log_json("error", "order.release.failed", item_sku=sku, qty=qty, status=r.status_code)
+    else:
+        log_json("warn", "order.released", item_sku=sku, qty=qty)
+
+
+async def release_reservation(sku: str, qty: int, key: str, confirmed: bool):
+    """Devuelve la reserva hecha con `key`. Sin `confirmed` (timeout o 5xx: no se sabe si items la hizo)
+    primero se repite con la misma clave: items devuelve la que ya hizo o la hace ahora, y en los dos
+    casos despues se devuelve una sola vez. Un 404/409 ahi es que no hubo reserva."""
+    if not confirmed:
+        try:
+            r = await reserve_stock(sku, qty, key, retry=RELEASE_RETRY)
+        except RuntimeError as e:
+            log_json("error", "order.release.failed", item_sku=sku, qty=qty, reserve_key=key, error=str(e))
+            return
+        if r.status_code in (404, 409):
+            return
+        if r.is_error:
+            log_json("error", "order.release.failed", item_sku=sku, qty=qty, reserve_key=key, status=r.status_code)
+            return
+    await release_stock(sku, qty, f"{key}-release")
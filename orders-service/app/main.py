@@ -1,18 +1,53 @@
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from sqlalchemy.exc import SQLAlchemyError
 from .routers import router
-from common.logging import log_json
+from . import outbox
+from .db import engine, async_engine, async_read_engine
+from .models import init_schema
+from common.db import INIT_SCHEMA, warm_up
+from common.logging import log_json, flush_logs
+from common.metrics import instrument_app
+from common.tracing import trace_app
+from common import http
 
 os.environ["SERVICE_NAME"] = "orders"
 
+# Crear tablas y migrar al importar (run.py lo hace una vez antes de forkear los workers)
+if INIT_SCHEMA:
+    init_schema(engine)
+    engine.dispose()
+
 app = FastAPI(title="Orders Service")
 app.include_router(router)
+instrument_app(app, "orders", engines=[async_engine, async_read_engine])
+trace_app(app, "orders", engines=[async_engine, async_read_engine])
 
 @app.on_event("startup")
-def startup():
+async def startup():
+    outbox.start()  # retoma las ordenes PENDING que hayan quedado en el outbox
     log_json("info", "service.started")
 
+# cerramos el pool de conexiones compartido de common.http y los de la db
+@app.on_event("shutdown")
+async def shutdown():
+    await outbox.stop()
+    await http.aclose()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
+    flush_logs()
+
 @app.get("/health")
-def health():
+async def health():
     log_json("info", "health.check")
     return {"status": "ok"}
+
+# listo para recibir trafico: la db responde y el pool queda con sus conexiones abiertas
+@app.get("/ready")
+async def ready():
+    try:
+        await warm_up(async_engine, async_read_engine)
+    except SQLAlchemyError as e:
+        log_json("error", "ready.failed", error=str(e))
+        raise HTTPException(status_code=503, detail="db no disponible")
+    return {"status": "ready", "pid": os.getpid()}
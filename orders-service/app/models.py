@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String
+import time
+from sqlalchemy import Column, Float, Index, Integer, String, Table, inspect, text
+from common.idempotency import keys_table
 from .db import Base
 
 class Order(Base):
@@ -9,3 +11,85 @@ class Order(Base):
     item_sku = Column(String(60), nullable=False)
     qty = Column(Integer, nullable=False, default=1) # quantity
     status = Column(String(20), nullable=False, default="CREATED")
+    created_at = Column(Float, nullable=False, default=time.time)  # epoch UTC (0 = orden de antes de la columna)
+
+    # los listados paginan por id (keyset): cada filtro por igualdad lleva el id al final,
+    # asi `WHERE user_id = ? AND id > ? ORDER BY id LIMIT n` es un solo recorrido del indice
+    __table_args__ = (
+        Index("ix_orders_user_id_id", "user_id", "id"),
+        Index("ix_orders_item_sku_id", "item_sku", "id"),
+        Index("ix_orders_status_id", "status", "id"),
+        Index("ix_orders_created_at_id", "created_at", "id"),
+    )
+
+# Outbox transaccional del modo async: una fila por orden PENDING, se inserta en la
+# misma transaccion que la orden y la borra el worker que la resuelve
+class OrderOutbox(Base):
+    __tablename__ = "order_outbox"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, nullable=False, unique=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(Float, nullable=False, default=0)  # epoch: no procesar antes (backoff)
+    lease_owner = Column(String(64), nullable=True)           # worker que la tomo
+    lease_until = Column(Float, nullable=False, default=0)    # si vence, otro worker la retoma
+
+# respuestas de POST /orders por Idempotency-Key (ver common.idempotency)
+idempotency_keys = keys_table(Base.metadata)
+
+# reservas de POST /orders con Idempotency-Key: la clave de /reserve sale de la del cliente mas
+# `generation`, que sube cada vez que se devuelve esa reserva (ver crud.reserve_key)
+reserve_generations = Table(
+    "reserve_generations", Base.metadata,
+    Column("key", String(64), primary_key=True),
+    Column("generation", Integer, nullable=False),
+)
+
+# Ventas por SKU y por dia (UTC), actualizadas en la misma transaccion que crea o confirma
+# la orden: /orders/stats lee de aca en vez de recorrer `orders`
+class OrderDailySales(Base):
+    __tablename__ = "order_daily_sales"
+
+    item_sku = Column(String(60), primary_key=True)
+    day = Column(String(10), primary_key=True)  # YYYY-MM-DD
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_order_daily_sales_day", "day"),)
+
+# migraciones de datos ya aplicadas (una fila por nombre): migrate() no las repite en cada arranque
+schema_migrations = Table(
+    "schema_migrations", Base.metadata,
+    Column("name", String(60), primary_key=True),
+    Column("applied_at", Float, nullable=False),
+)
+
+
+def migrate(engine):
+    """Migraciones chicas sobre una db que ya existia (create_all no toca tablas existentes)."""
+    with engine.begin() as conn:
+        columns = {c["name"] for c in inspect(conn).get_columns("orders")}
+        if "created_at" not in columns:
+            conn.execute(text("ALTER TABLE orders ADD COLUMN created_at FLOAT NOT NULL DEFAULT 0"))
+        for index in Order.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        # rollup nuevo sobre ordenes que ya existian: se llena una sola vez desde `orders`
+        if not _applied(conn, "order_daily_sales_backfill"):
+            # una db con el rollup ya lleno (de antes de la marca) no se vuelve a sumar
+            if conn.execute(text("SELECT 1 FROM order_daily_sales LIMIT 1")).first() is None:
+                conn.execute(text(
+                    "INSERT INTO order_daily_sales (item_sku, day, orders, units) "
+                    "SELECT item_sku, date(created_at, 'unixepoch'), count(*), sum(qty) FROM orders "
+                    "WHERE status IN ('CREATED', 'CONFIRMED') GROUP BY item_sku, date(created_at, 'unixepoch')"
+                ))
+            conn.execute(schema_migrations.insert().values(name="order_daily_sales_backfill", applied_at=time.time()))
+
+
+def _applied(conn, name: str) -> bool:
+    return conn.execute(schema_migrations.select().where(schema_migrations.c.name == name)).first() is not None
+
+
+def init_schema(engine):
+    """Crea las tablas que falten y migra una db vieja (al importar main.py, o una vez desde run.py)."""
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
@@ -0,0 +1,150 @@
+"""Workers del modo async: vacian el outbox en lotes y resuelven cada orden PENDING.
+
+Cada worker toma un lote con lease (`crud.claim_outbox`), consulta los usuarios
+una vez por usuario distinto, reserva el stock de todo el lote con un solo
+`/reserve/batch` y pasa cada orden a CONFIRMED o REJECTED. Los errores de red o
+5xx no rechazan: la fila vuelve al outbox con backoff hasta `OUTBOX_MAX_ATTEMPTS`.
+
+Si el proceso se cae, las filas tomadas quedan con lease vencido a los
+`OUTBOX_LEASE` segundos y otro worker (o el mismo servicio al reiniciar) las
+retoma; las que no se habian tomado se procesan apenas arrancan los workers.
+Cada reserva va con la clave `order-<id>`: una orden retomada (el worker murio
+entre la reserva y el commit, o no pudo guardar el resultado) no vuelve a
+descontar stock, items-service devuelve la reserva de la primera vez.
+"""
+import asyncio, os, socket, time, uuid
+from common.logging import log_json
+from common import tracing
+from .db import SessionLocal
+from . import crud
+from .downstream import check_users, reserve_lines
+
+OUTBOX_WORKERS = int(os.getenv("ORDERS_OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH = int(os.getenv("ORDERS_OUTBOX_BATCH", "100"))          # ordenes por lote
+OUTBOX_LEASE = float(os.getenv("ORDERS_OUTBOX_LEASE", "30"))         # segundos
+OUTBOX_POLL = float(os.getenv("ORDERS_OUTBOX_POLL", "0.5"))          # espera sin trabajo (segundos)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("ORDERS_OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_BACKOFF = float(os.getenv("ORDERS_OUTBOX_BACKOFF", "1"))      # base del backoff entre intentos
+
+# id de esta instancia para los leases
+INSTANCE = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+_tasks: list[asyncio.Task] = []
+_wakeup: asyncio.Event | None = None
+_stopping = False
+
+
+def notify():
+    """Despierta a los workers (hay una orden nueva en el outbox)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def process_batch(owner: str) -> int:
+    """Toma y resuelve un lote. Devuelve cuantas filas tomo (0 si no habia trabajo)."""
+    async with SessionLocal() as db:
+        claimed = await crud.claim_outbox(db, owner, OUTBOX_BATCH, OUTBOX_LEASE)
+        if not claimed:
+            return 0
+        attempts = dict(claimed)
+        orders = await crud.get_orders(db, list(attempts))
+
+    with tracing.span("outbox.batch", size=len(orders)):
+        # filas cuya orden ya no existe: se descartan
+        statuses: dict[int, str] = dict.fromkeys(set(attempts) - {o.id for o in orders}, crud.REJECTED)
+        reasons: dict[int, str] = {}
+        retry = []
+
+        #Verificar usuarios (cada uno una sola vez)
+        users = await check_users({o.user_id for o in orders})
+        pending = []
+        for o in orders:
+            status_code, error = users[o.user_id]
+            if status_code == 404:
+                statuses[o.id], reasons[o.id] = crud.REJECTED, error
+            elif error:
+                retry.append((o, error))
+            else:
+                pending.append(o)
+
+        #Reservar el stock de todo el lote en una sola transaccion de items-service
+        if pending:
+            results = await reserve_lines([{"sku": o.item_sku, "qty": o.qty, "key": f"order-{o.id}"} for o in pending])
+            for o, (status_code, error) in zip(pending, results):
+                if status_code == 200:
+                    statuses[o.id] = crud.CONFIRMED
+                elif status_code in (404, 409):
+                    statuses[o.id], reasons[o.id] = crud.REJECTED, error
+                else:
+                    retry.append((o, error))
+
+        #Errores transitorios: reintentar con backoff, o rechazar si ya se agotaron los intentos
+        retry_at = {}
+        for o, error in retry:
+            if attempts[o.id] >= OUTBOX_MAX_ATTEMPTS:
+                statuses[o.id], reasons[o.id] = crud.REJECTED, error
+            else:
+                retry_at[o.id] = time.time() + OUTBOX_BACKOFF * 2 ** (attempts[o.id] - 1)
+
+        try:
+            async with SessionLocal() as db:
+                done = await crud.finish_outbox(db, owner, statuses, retry_at)
+        except Exception as e:
+            log_json("error", "outbox.finish.failed", orders=len(orders), error=str(e))
+            done = set()
+
+        # reservas que no quedaron registradas (commit fallido o lease perdido): no se devuelven, la orden
+        # sigue en el outbox y quien la retome recibe esta misma reserva por su clave
+        leaked = [o.id for o in orders if statuses.get(o.id) == crud.CONFIRMED and o.id not in done]
+        if leaked:
+            log_json("warn", "outbox.reservation.kept", orders=leaked)
+
+        for o in orders:
+            if o.id not in done:
+                continue
+            if statuses[o.id] == crud.CONFIRMED:
+                log_json("info", "order.confirmed", order_id=o.id, item_sku=o.item_sku, qty=o.qty)
+            else:
+                log_json("warn", "order.rejected", order_id=o.id, item_sku=o.item_sku, reason=reasons.get(o.id))
+        if retry_at:
+            log_json("warn", "outbox.retry", orders=len(retry_at))
+    return len(orders)
+
+
+async def _worker(n: int):
+    owner = f"{INSTANCE}-{n}"
+    while not _stopping:
+        try:
+            claimed = await process_batch(owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_json("error", "outbox.worker.error", worker=n, error=str(e))
+            claimed = 0
+        if claimed == 0:
+            # sin trabajo: esperar a que llegue una orden o al siguiente poll (backoff, leases vencidos)
+            try:
+                await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+
+
+def start():
+    global _wakeup, _stopping
+    _wakeup, _stopping = asyncio.Event(), False
+    _tasks.extend(asyncio.create_task(_worker(n), name=f"outbox-{n}") for n in range(OUTBOX_WORKERS))
+    log_json("info", "outbox.started", workers=OUTBOX_WORKERS, batch=OUTBOX_BATCH)
+
+
+async def stop(timeout: float = 10.0):
+    """Deja terminar el lote en curso (cortarlo entre la reserva y el commit la repetiria) y frena los workers."""
+    global _stopping
+    _stopping = True
+    notify()
+    if _tasks:
+        _, pending = await asyncio.wait(_tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -1,27 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
-from common.auth import verify_service_token, add_service_auth
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+import asyncio, uuid
+import httpx
+from datetime import date, datetime, timezone
+from common.auth import verify_service_token
 from common.logging import log_json
-from common import http
+from common import idempotency, tracing
+from common.pagination import MAX_LIMIT, page_limit, wants_ndjson, paginate, set_next_cursor, ndjson_response
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from .db import SessionLocal, engine
-from .models import Base
-from . import crud
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import SessionLocal, ReadSessionLocal
+from . import crud, outbox
+from .user_cache import cache as user_cache
+from .downstream import (HEDGE, check_user, check_users, reserve_lines, release_lines, release_reservation,
+                         reserve_stock)
 import os
 
-USERS_SERVICE_URL  = os.getenv("USERS_SERVICE_URL",  "http://127.0.0.1:8001")
-ITEMS_SERVICE_URL  = os.getenv("ITEMS_SERVICE_URL",  "http://127.0.0.1:8002")
+BATCH_MAX = int(os.getenv("ORDERS_BATCH_MAX", "5000"))              # filas por POST /batch
+# modo async por defecto para POST /: 202 + outbox (tambien se pide por request con `Prefer: respond-async`)
+ASYNC_MODE = os.getenv("ORDERS_ASYNC_MODE", "0") == "1"
 
 router = APIRouter(tags=["orders"])
 
-Base.metadata.create_all(bind=engine)
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
 
-def get_db():
-    db = SessionLocal()
-    try:
+# sesion para rutas GET (engine de solo lectura si DB_SEPARATE_READ_ENGINE=1)
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class OrderIn(BaseModel):
     user_id: int = Field(gt=0)
@@ -31,53 +39,266 @@ class OrderIn(BaseModel):
 class OrderOut(OrderIn):
     id: int
     status: str
+    created_at: datetime
+
+class DailySalesOut(BaseModel):
+    item_sku: str
+    day: date
+    orders: int
+    units: int
+
+class OrderBatchIn(BaseModel):
+    orders: list[OrderIn] = Field(min_length=1, max_length=BATCH_MAX)
+
+class OrderBatchResult(BaseModel):
+    index: int
+    ok: bool
+    status_code: int
+    order: OrderOut | None = None
+    error: str | None = None
+
+class OrderBatchOut(BaseModel):
+    created: int
+    failed: int
+    results: list[OrderBatchResult]
 
 @router.get("/", response_model=list[OrderOut])
-def list_orders(db: Session = Depends(get_db)):
-    orders = crud.list_orders(db)
+async def list_orders(request: Request, response: Response,
+                limit: int | None = Query(default=None, ge=1, le=MAX_LIMIT),
+                after: int | None = Query(default=None, ge=0),
+                user_id: int | None = Query(default=None, gt=0),
+                item_sku: str | None = Query(default=None, min_length=1, max_length=60),
+                status: str | None = Query(default=None, min_length=1, max_length=20),
+                created_from: datetime | None = None,
+                created_to: datetime | None = None,
+                db: AsyncSession = Depends(get_read_db)):
+    # cada filtro usa su indice (col, id), asi el cursor `after` sigue siendo un rango
+    filters = {"user_id": user_id, "item_sku": item_sku, "status": status,
+               "created_from": _epoch(created_from), "created_to": _epoch(created_to)}
+    if wants_ndjson(request):
+        log_json("info", "orders.streamed", after=after)
+        stmt = crud.list_orders_stmt(after, **filters)
+        return ndjson_response(ReadSessionLocal, stmt if limit is None else stmt.limit(limit), OrderOut)
+    page = page_limit(limit, after)  # sin limit ni after: todas
+    orders, next_cursor = paginate(await crud.list_orders(db, page and page + 1, after, **filters), page)
+    set_next_cursor(request, response, next_cursor, page)
     log_json("info", "orders.listed", count=len(orders))
     return orders
 
+def _epoch(value: datetime | None) -> float | None:
+    # sin zona horaria se toma como UTC (created_at se guarda en epoch)
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc).timestamp()
+    return value.timestamp()
+
+@router.get("/stats", response_model=list[DailySalesOut])
+async def order_stats(item_sku: str | None = Query(default=None, min_length=1, max_length=60),
+                      day_from: date | None = None, day_to: date | None = None,
+                      limit: int = Query(default=MAX_LIMIT, ge=1, le=MAX_LIMIT),
+                      db: AsyncSession = Depends(get_read_db)):
+    """Ventas por SKU y dia (UTC) del rollup: no recorre las ordenes."""
+    if day_from and day_to and day_from > day_to:
+        raise HTTPException(status_code=400, detail="day_from es posterior a day_to")
+    rows = await crud.get_sales(db, item_sku, day_from and day_from.isoformat(),
+                                day_to and day_to.isoformat(), limit)
+    log_json("info", "orders.stats", item_sku=item_sku, rows=len(rows))
+    return rows
+
+class UsersChangedIn(BaseModel):
+    user_ids: list[int] = Field(min_length=1, max_length=1000)
+
+@router.post("/internal/users/changed", status_code=204, dependencies=[Depends(verify_service_token)])
+async def users_changed(payload: UsersChangedIn):
+    # aviso de users-service (alta, cambio o baja): sacar esos usuarios del cache
+    user_cache.invalidate(payload.user_ids)
+    log_json("info", "user.cache.invalidated", user_ids=payload.user_ids)
+    return Response(status_code=204)
+
+@router.get("/{order_id:int}", response_model=OrderOut)  # :int para no tapar /health ni /metrics
+async def get_order(order_id: int, db: AsyncSession = Depends(get_read_db)):
+    # en modo async el cliente consulta aca el estado: PENDING -> CONFIRMED / REJECTED
+    order = await crud.get_order(db, order_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    return order
+
+def _wants_async(request: Request) -> bool:
+    prefer = request.headers.get("prefer", "").lower()
+    return ASYNC_MODE or "respond-async" in prefer
+
 @router.post("/", response_model=OrderOut, status_code=201, dependencies=[Depends(verify_service_token)])
-def create_order(payload: OrderIn, db: Session = Depends(get_db)):
-    
-    #Verificar que usuario exista
+async def create_order(payload: OrderIn, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    #Idempotency-Key del cliente: si ya se creo la orden con esa clave, devolver la misma respuesta
+    #(el mismo request repetido mientras el primero sigue en curso lo espera)
+    key = idempotency.key_from(request)
+    async with idempotency.exclusive(key):
+        if key is not None:
+            key = (key, idempotency.fingerprint("POST /orders", payload.model_dump()))
+            stored = await crud.lookup_key(db, key)
+            if stored is not None:
+                return _replay(request, response, stored)
+        return await _create_order(payload, request, response, db, key)
+
+async def _create_order(payload: OrderIn, request: Request, response: Response, db: AsyncSession,
+                        key: tuple[str, str] | None):
+    #Modo async: guardar PENDING + outbox y responder 202 ya; los workers confirman o rechazan
+    if _wants_async(request):
+        try:
+            order = await crud.create_pending_order(db, payload.user_id, payload.item_sku, payload.qty, key=key)
+        except IntegrityError:
+            return await _replay_conflict(db, request, response, key)
+        outbox.notify()
+        tracing.annotate(order_id=order.id)
+        log_json("info", "order.accepted", order_id=order.id, user_id=order.user_id, item_sku=order.item_sku, qty=order.qty)
+        response.status_code = 202
+        response.headers["Location"] = _order_location(request, order.id)
+        response.headers["Preference-Applied"] = "respond-async"
+        return order
+
+    # async: mientras esperamos a users/items no ocupamos un worker del threadpool
+    #Verificar usuario y reservar stock a la vez: la latencia es la del mas lento, no la suma
+    #(la reserva sale con una clave que sale de la Idempotency-Key del cliente: reintentos, hedge
+    #y el reintento del cliente con la misma clave no descuentan dos veces)
+    reserve_key = await crud.reserve_key(db, key) if key is not None else f"order-{uuid.uuid4().hex}"
+    user_r, stock_r = await asyncio.gather(
+        check_user(payload.user_id),
+        reserve_stock(payload.item_sku, payload.qty, reserve_key, hedge=HEDGE),
+        return_exceptions=True,
+    )
+    reserved = isinstance(stock_r, httpx.Response) and stock_r.status_code == 200
+    # sin respuesta o con 5xx no se sabe si items reservo: se compensa igual (ver release_reservation)
+    unknown = not (isinstance(stock_r, httpx.Response) and stock_r.status_code < 500)
+
+    async def compensate():
+        if reserved or unknown:
+            await release_reservation(payload.item_sku, payload.qty, reserve_key, confirmed=reserved)
+            if key is not None:
+                await crud.next_reserve_key(db, key)  # el reintento del cliente reserva de nuevo
+
+    #Si el usuario o la reserva no sirven, devolver el stock que se haya (o quiza) reservado
     try:
-         r = http.request(
-            "GET",
-            f"{USERS_SERVICE_URL}/{payload.user_id}",
-            headers=add_service_auth({})  
-        )
-    except RuntimeError as e:
-        log_json("error", "user.service.unavailable", user_id=payload.user_id)
-        raise HTTPException(status_code=503, detail=str(e))
-    if r.status_code == 404:
-        log_json("warn", "user.not_found", user_id=payload.user_id)
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        _check_user_response(payload.user_id, user_r)
+        _check_reserve_response(payload, stock_r)
+    except BaseException:
+        await compensate()
+        raise
 
-    #Verificar reserva de stock
+    #Si todo sale bien, Crear orden; si el insert falla, compensar la reserva
     try:
-       r = http.request(
-            "POST",
-            f"{ITEMS_SERVICE_URL}/reserve",
-            json={"sku": payload.item_sku, "qty": payload.qty}, 
-            headers=add_service_auth({})  
-        )
-    except RuntimeError as e:
+        order = await crud.create_order(db, payload.user_id, payload.item_sku, payload.qty, key=key)
+    except IntegrityError:
+        # el mismo request llego dos veces a la vez y el otro ya creo la orden, con la misma
+        # clave de reserva: esa reserva es la de su orden y no se devuelve
+        return await _replay_conflict(db, request, response, key)
+    except Exception as e:
+        log_json("error", "order.create.failed", user_id=payload.user_id, item_sku=payload.item_sku)
+        await db.rollback()
+        await compensate()
+        raise HTTPException(status_code=400, detail=str(e))
+    tracing.annotate(order_id=order.id)  # para buscar el trace con --order-id
+    log_json("info", "order.created", order_id=order.id, user_id=order.user_id, item_sku=order.item_sku, qty=order.qty)
+    return order
+
+def _order_location(request: Request, order_id: int) -> str:
+    # URL absoluta de GET /{order_id} segun esta request (host y root_path incluidos);
+    # el gateway la pasa a su /orders/{id} (ver _public_location en gateway/app/main.py)
+    return str(request.url_for("get_order", order_id=order_id))
+
+def _replay(request: Request, response: Response, stored: tuple[int, dict]) -> dict:
+    status_code, body = stored
+    if status_code == 202:
+        response.headers["Location"] = _order_location(request, body["id"])
+        response.headers["Preference-Applied"] = "respond-async"
+    log_json("info", "order.idempotency.replayed", order_id=body["id"])
+    return idempotency.replay(response, stored)
+
+async def _replay_conflict(db: AsyncSession, request: Request, response: Response, key: tuple[str, str]) -> dict:
+    await db.rollback()
+    stored = await crud.lookup_key(db, key)
+    if stored is None:
+        raise HTTPException(status_code=409, detail=f"{idempotency.HEADER} en uso, reintentar")
+    return _replay(request, response, stored)
+
+def _check_user_response(user_id: int, r):
+    if isinstance(r, BaseException):
+        raise r
+    status_code, error = r
+    if status_code == 404:
+        log_json("warn", "user.not_found", user_id=user_id)
+        raise HTTPException(status_code=404, detail=error)
+    if status_code == 503:
+        log_json("error", "user.service.unavailable", user_id=user_id)
+        raise HTTPException(status_code=503, detail=error)
+    if error:
+        log_json("error", "user.service.error", user_id=user_id)
+        raise HTTPException(status_code=502, detail=error)
+
+def _check_reserve_response(payload: OrderIn, r):
+    if isinstance(r, RuntimeError):
         log_json("error", "item.service.unavailable", item_sku=payload.item_sku)
-        raise HTTPException(status_code=503, detail=str(e))
+        raise HTTPException(status_code=503, detail=str(r))
+    if isinstance(r, BaseException):
+        raise r
     if r.status_code == 404:
         log_json("warn", "item.not_found", item_sku=payload.item_sku)
         raise HTTPException(status_code=404, detail="Item no encontrado")
     if r.status_code == 409:
         log_json("warn", "item.no_stock", item_sku=payload.item_sku, requested=payload.qty)
         raise HTTPException(status_code=409, detail="Stock insuficiente")
+    if r.is_error:
+        log_json("error", "item.service.error", item_sku=payload.item_sku, status=r.status_code)
+        raise HTTPException(status_code=502, detail="Error reservando stock")
 
-    #Si todo sale bien, Crear orden
-    try:
-        order = crud.create_order(db, payload.user_id, payload.item_sku, payload.qty)
-        log_json("info", "order.created", order_id=order.id, user_id=order.user_id, item_sku=order.item_sku, qty=order.qty)
-        return order
-    except Exception as e:
-        log_json("error", "order.create.failed", user_id=payload.user_id, item_sku=payload.item_sku)
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+@router.post("/batch", response_model=OrderBatchOut, dependencies=[Depends(verify_service_token)])
+async def create_orders_batch(payload: OrderBatchIn, db: AsyncSession = Depends(get_db)):
+    """Crea muchas ordenes: un lookup por usuario distinto, una reserva en lote y un insert en lote."""
+    rows = payload.orders
+    results: list[OrderBatchResult | None] = [None] * len(rows)
+
+    def fail(i: int, status_code: int, error: str):
+        results[i] = OrderBatchResult(index=i, ok=False, status_code=status_code, error=error)
+
+    #Verificar usuarios (cada uno una sola vez)
+    users = await check_users({o.user_id for o in rows})
+    pending = []
+    for i, o in enumerate(rows):
+        status_code, error = users[o.user_id]
+        if error:
+            fail(i, status_code, error)
+        else:
+            pending.append(i)
+
+    #Reservar stock de todas las filas validas en una sola transaccion de items-service
+    #(cada linea con su clave: si se pierde la respuesta, el reintento no reserva dos veces)
+    reserved = []
+    keys = {i: uuid.uuid4().hex for i in pending}
+    if pending:
+        reserve_results = await reserve_lines([{"sku": rows[i].item_sku, "qty": rows[i].qty, "key": keys[i]}
+                                               for i in pending])
+        for i, (status_code, error) in zip(pending, reserve_results):
+            if error:
+                fail(i, status_code, error)
+            else:
+                reserved.append(i)
+
+    #Crear todas las ordenes reservadas con un solo insert; si falla, devolver el stock
+    if reserved:
+        try:
+            created = await crud.create_orders(
+                db, [{"user_id": rows[i].user_id, "item_sku": rows[i].item_sku, "qty": rows[i].qty} for i in reserved]
+            )
+        except Exception as e:
+            log_json("error", "orders.batch.create.failed", rows=len(reserved))
+            await release_lines([{"sku": rows[i].item_sku, "qty": rows[i].qty, "key": f"{keys[i]}-release"}
+                                 for i in reserved])
+            for i in reserved:
+                fail(i, 400, str(e))
+        else:
+            for i, order in zip(reserved, created):
+                results[i] = OrderBatchResult(index=i, ok=True, status_code=201, order=OrderOut(**order._asdict()))
+
+    ok = sum(1 for r in results if r.ok)
+    log_json("info", "orders.batch.created", created=ok, failed=len(rows) - ok)
+    return OrderBatchOut(created=ok, failed=len(rows) - ok, results=results)
@@ -0,0 +1,158 @@
+import os, sqlite3, time
+from collections import OrderedDict
+from common.logging import log_json
+from common.metrics import REGISTRY
+
+# Cache LRU + TTL de "existe el usuario?" (positivos y negativos) para no consultar users en cada orden.
+# users-service avisa los cambios a POST /internal/users/changed; el TTL acota lo que quede viejo
+# si un aviso se pierde.
+CACHE_SIZE = int(os.getenv("ORDERS_USER_CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("ORDERS_USER_CACHE_TTL", "300"))                  # usuario existe (segundos)
+CACHE_NEGATIVE_TTL = float(os.getenv("ORDERS_USER_CACHE_NEGATIVE_TTL", "30"))  # usuario no existe
+# Con varios workers (run.py) el aviso llega a uno solo: lo anota en este archivo SQLite compartido
+# y los demas lo leen a lo sumo cada CACHE_SYNC segundos. Vacio = un solo proceso, sin archivo.
+CACHE_STATE_FILE = os.getenv("ORDERS_USER_CACHE_STATE", "")
+CACHE_SYNC = float(os.getenv("ORDERS_USER_CACHE_SYNC", "0.25"))
+CACHE_STATE_KEEP = 10000  # avisos que quedan en el archivo; un worker mas atrasado vacia su cache
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "orders_user_cache_total", "Consultas al cache de usuarios de orders", ("result",))
+CACHE_INVALIDATIONS = REGISTRY.counter(
+    "orders_user_cache_invalidations_total", "Usuarios sacados del cache por avisos de users-service")
+CACHE_ENTRIES = REGISTRY.gauge("orders_user_cache_entries", "Usuarios en el cache")
+
+
+class SharedChanges:
+    """Usuarios avisados como cambiados, en un archivo SQLite que comparten los workers de orders.
+
+    Cada aviso es una fila con un `seq` creciente; cada proceso recuerda el ultimo que leyo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+
+    def _db(self) -> sqlite3.Connection:
+        # tambien tras un fork: la conexion del padre no se comparte
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS user_changes "
+                         "(seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def last(self) -> int:
+        return self._db().execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes").fetchone()[0]
+
+    def publish(self, user_ids):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT INTO user_changes (user_id) VALUES (?)", [(u,) for u in user_ids])
+            db.execute("DELETE FROM user_changes WHERE seq <= (SELECT MAX(seq) FROM user_changes) - ?",
+                       (CACHE_STATE_KEEP,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def since(self, seq: int) -> tuple[int, list[int] | None]:
+        """(ultimo seq, usuarios avisados despues de `seq`); None si ya se borraron avisos que no leyo."""
+        rows = self._db().execute("SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq",
+                                  (seq,)).fetchall()
+        if not rows:
+            return seq, []
+        if rows[0][0] > seq + 1:  # falta el siguiente: lo borro el recorte de CACHE_STATE_KEEP
+            return rows[-1][0], None
+        return rows[-1][0], [user_id for _, user_id in rows]
+
+
+class UserCache:
+    """LRU acotado con TTL. Guarda (status_code, error) de las consultas 200 y 404.
+
+    Con `shared` las invalidaciones se anotan ahi y cada proceso aplica las de los demas
+    antes de responder desde el cache (releyendo a lo sumo cada `CACHE_SYNC` segundos).
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL, negative_ttl: float = CACHE_NEGATIVE_TTL,
+                 shared: SharedChanges | None = None):
+        self.size, self.ttl, self.negative_ttl = size, ttl, negative_ttl
+        self._entries: OrderedDict[int, tuple[float, tuple[int, str | None]]] = OrderedDict()
+        # sube con cada invalidacion: una consulta que empezo antes no guarda su resultado
+        self.version = 0
+        self.shared = shared
+        self._seen: tuple[int, int] | None = None  # (pid, ultimo seq aplicado del archivo compartido)
+        self._synced = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _sync(self):
+        # aplica los avisos que recibieron otros workers; si el archivo falla, no usa el cache
+        if self.shared is None:
+            return
+        fresh = self._seen is not None and self._seen[0] == os.getpid()
+        if fresh and time.monotonic() - self._synced < CACHE_SYNC:
+            return
+        try:
+            if not fresh:
+                # proceso nuevo (o recien forkeado): lo que tenga en memoria no se sabe de cuando es
+                self._seen = (os.getpid(), self.shared.last())
+                self.clear()
+            else:
+                seq, user_ids = self.shared.since(self._seen[1])
+                if user_ids is None:
+                    self.clear()
+                elif user_ids:
+                    self._drop(user_ids)
+                self._seen = (self._seen[0], seq)
+        except sqlite3.Error as e:
+            log_json("warn", "user.cache.state.error", error=str(e))
+            self._seen = None
+            self.clear()
+            return
+        self._synced = time.monotonic()
+
+    def get(self, user_id: int) -> tuple[int, str | None] | None:
+        self._sync()
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            CACHE_LOOKUPS.inc("hit")
+            return entry[1]
+        if entry is not None:
+            del self._entries[user_id]
+        CACHE_LOOKUPS.inc("miss")
+        return None
+
+    def put(self, user_id: int, result: tuple[int, str | None], version: int):
+        if version != self.version or self.size <= 0:
+            return
+        ttl = self.ttl if result[0] == 200 else self.negative_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _drop(self, user_ids):
+        self.version += 1
+        for user_id in user_ids:
+            if self._entries.pop(user_id, None) is not None:
+                CACHE_INVALIDATIONS.inc()
+
+    def invalidate(self, user_ids):
+        """Saca a estos usuarios del cache de este proceso y, con `shared`, del de los demas workers."""
+        self._drop(user_ids)
+        if self.shared is not None:
+            self.shared.publish(user_ids)  # si falla, el aviso responde 500 y users-service lo reintenta
+
+    def clear(self):
+        self.version += 1
+        self._entries.clear()
+
+
+cache = UserCache(shared=SharedChanges(CACHE_STATE_FILE) if CACHE_STATE_FILE else None)
+REGISTRY.register_collector(lambda: CACHE_ENTRIES.set(value=len(cache)))
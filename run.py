@@ -0,0 +1,300 @@
+"""Launcher para Linux: users, items, orders y el gateway, con varios workers cada uno.
+
+    python run.py                                  # 1 worker por servicio
+    python run.py --workers orders=4,gateway=2     # o USERS_WORKERS, ITEMS_WORKERS, ORDERS_WORKERS, GATEWAY_WORKERS
+
+En orden:
+
+1. Abre el socket de cada servicio (puerto de `USERS_SERVICE_URL`, `ITEMS_SERVICE_URL`,
+   `ORDERS_SERVICE_URL`; el gateway en `GATEWAY_HOST`:`GATEWAY_PORT`). Los workers de un
+   servicio comparten el socket y el kernel les reparte las conexiones.
+2. Importa las cuatro apps con `DB_INIT_SCHEMA=0` y crea el esquema de cada db una sola vez.
+3. Forkea los workers: arrancan con todo importado y solo corren el startup de su app.
+   Cada worker se pide a si mismo `/ready` (chequea la db y llena el pool de *su* proceso)
+   y avisa al launcher por un pipe.
+4. Con todos listos (y un `/ready` por la red a cada servicio) loguea `launcher.ready` con
+   lo que tardo cada etapa.
+5. Si un worker muere lo vuelve a forkear (con backoff si muere apenas arranca).
+   SIGTERM o Ctrl+C: SIGTERM a los workers, que terminan lo que tienen en curso.
+
+Estado de cada proceso: los breakers de `common.http` se comparten entre workers por un
+archivo SQLite (`HTTP_BREAKER_STATE`, por defecto `data/http_breakers.db`, se vacia al
+arrancar). El cache de usuarios de orders es de cada worker, pero el aviso
+`/internal/users/changed` llega a uno solo: lo anota en el mismo archivo
+(`ORDERS_USER_CACHE_STATE`) y los demas lo aplican antes de la siguiente consulta al
+cache (a lo sumo `ORDERS_USER_CACHE_SYNC` segundos despues). El cache y la admision del
+gateway y el single-flight de idempotencia quedan por worker (entre procesos la PK de
+`idempotency_keys` sigue evitando el doble efecto). Con `ITEMS_HOT_SKUS` items corre con
+un solo worker: el stock en memoria es del proceso.
+"""
+import time
+
+_T0 = time.perf_counter()
+
+import argparse, asyncio, importlib, os, select, signal, socket, sys, traceback
+from urllib.parse import urlsplit
+
+# antes de importar `common`: los workers no crean el esquema (lo hace el launcher una vez)
+# y los breakers y los avisos de usuarios cambiados van al archivo compartido
+os.environ["DB_INIT_SCHEMA"] = "0"
+os.environ.setdefault("HTTP_BREAKER_STATE", os.path.join("data", "http_breakers.db"))
+os.environ.setdefault("ORDERS_USER_CACHE_STATE", os.environ["HTTP_BREAKER_STATE"])
+
+import httpx
+import uvicorn
+
+from common.logging import log_json, flush_logs
+from gateway.app import settings
+
+SERVICES = {
+    "users": "users-service.app",
+    "items": "items-service.app",
+    "orders": "orders-service.app",
+    "gateway": "gateway.app",
+}
+WITH_DB = ("users", "items", "orders")
+
+READY_TIMEOUT = float(os.getenv("LAUNCHER_READY_TIMEOUT", "60"))        # segundos hasta que todos respondan /ready
+GRACEFUL_TIMEOUT = float(os.getenv("LAUNCHER_GRACEFUL_TIMEOUT", "15"))  # segundos para terminar antes del SIGKILL
+MIN_UPTIME = 5.0          # un worker que muere antes de esto cuenta como caida seguida (backoff)
+MAX_BACKOFF = 10.0
+
+
+def _address(name: str) -> tuple[str, int]:
+    if name == "gateway":
+        return os.getenv("GATEWAY_HOST", "127.0.0.1"), int(os.getenv("GATEWAY_PORT", "8080"))
+    url = urlsplit(getattr(settings, f"{name.upper()}_SERVICE_URL"))
+    return url.hostname or "127.0.0.1", url.port or 80
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _worker_counts(spec: str) -> dict[str, int]:
+    counts = {name: int(os.getenv(f"{name.upper()}_WORKERS", "1")) for name in SERVICES}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, n = part.partition("=")
+        if name not in SERVICES or not n.isdigit():
+            raise SystemExit(f"--workers invalido: {part!r} (ej: orders=4,gateway=2)")
+        counts[name] = int(n)
+    if any(n < 1 for n in counts.values()):
+        raise SystemExit("cada servicio necesita al menos 1 worker")
+    return counts
+
+
+def _reset_shared_state():
+    for path in {os.environ["HTTP_BREAKER_STATE"], os.environ["ORDERS_USER_CACHE_STATE"]}:
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+class Launcher:
+    def __init__(self, counts: dict[str, int], log_level: str):
+        self.counts = counts
+        self.log_level = log_level
+        self.sockets: dict[str, socket.socket] = {}
+        self.apps: dict[str, object] = {}
+        self.timings: dict[str, dict] = {name: {"workers": n} for name, n in counts.items()}
+        # pid -> [servicio, indice, forkeado en, listo en]
+        self.workers: dict[int, list] = {}
+        self.crashes: dict[tuple[str, int], int] = {}
+        self.restarts: list[tuple[float, str, int]] = []
+        self.ready_r, self.ready_w = os.pipe()
+        self.stopping = False
+
+    def preload(self):
+        for name, package in SERVICES.items():
+            start = time.perf_counter()
+            self.apps[name] = importlib.import_module(f"{package}.main").app
+            self.timings[name]["import_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        # cada main.py pisa SERVICE_NAME al importarse
+        os.environ["SERVICE_NAME"] = "launcher"
+        for name in WITH_DB:
+            start = time.perf_counter()
+            models = importlib.import_module(f"{SERVICES[name]}.models")
+            db = importlib.import_module(f"{SERVICES[name]}.db")
+            models.init_schema(db.engine)
+            db.engine.dispose()  # que los workers no hereden conexiones abiertas
+            self.timings[name]["schema_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if self.counts["items"] > 1 and importlib.import_module(f"{SERVICES['items']}.hot").HOT_SKUS:
+            log_json("warn", "launcher.workers.limited", app="items", requested=self.counts["items"],
+                     reason="ITEMS_HOT_SKUS")
+            self.counts["items"] = self.timings["items"]["workers"] = 1
+
+    def spawn(self, name: str, index: int):
+        flush_logs()  # que el thread de logs no quede a mitad de un write al forkear
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._run_worker(name)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                flush_logs()
+                os._exit(code)
+        self.workers[pid] = [name, index, time.perf_counter(), None]
+
+    def _run_worker(self, name: str) -> int:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        os.close(self.ready_r)
+        for other, sock in self.sockets.items():
+            if other != name:
+                sock.close()
+        os.environ["SERVICE_NAME"] = name
+        config = uvicorn.Config(self.apps[name], log_level=self.log_level, access_log=False, lifespan="on",
+                                timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+        server = uvicorn.Server(config)
+        asyncio.run(self._serve(server, self.apps[name], self.sockets[name]))
+        return 0 if server.started else 3  # 3: fallo el startup (como uvicorn)
+
+    async def _serve(self, server: uvicorn.Server, app, sock: socket.socket):
+        serving = asyncio.ensure_future(server.serve(sockets=[sock]))
+        while not server.started and not serving.done():
+            await asyncio.sleep(0.005)
+        # el mismo /ready que pide el launcher, pero en proceso: llena el pool de este worker
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+            while server.started and not server.should_exit:
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        os.write(self.ready_w, f"{os.getpid()}\n".encode())
+                        break
+                except Exception as e:
+                    log_json("warn", "worker.ready.error", error=str(e))
+                await asyncio.sleep(0.5)
+        await serving
+
+    def _on_ready(self, data: bytes):
+        for line in data.decode().split():
+            worker = self.workers.get(int(line))
+            if worker is not None and worker[3] is None:
+                worker[3] = time.perf_counter()
+
+    def _not_ready(self) -> list[str]:
+        ready = dict.fromkeys(SERVICES, 0)
+        for name, _, _, ready_at in self.workers.values():
+            ready[name] += ready_at is not None
+        return [name for name, n in self.counts.items() if ready[name] < n]
+
+    def _check_network(self) -> list[str]:
+        failed = []
+        with httpx.Client(timeout=5) as client:
+            for name in SERVICES:
+                host, port = _address(name)
+                try:
+                    if client.get(f"http://{host}:{port}/ready").status_code != 200:
+                        failed.append(name)
+                except httpx.TransportError:
+                    failed.append(name)
+        return failed
+
+    def _report(self, started: float):
+        for name, timing in self.timings.items():
+            times = [ready - forked for n, _, forked, ready in self.workers.values() if n == name and ready]
+            timing["ready_ms"] = round(max(times) * 1000, 1)
+        log_json("info", "launcher.ready", total_ms=round((time.perf_counter() - _T0) * 1000, 1),
+                 fork_to_ready_ms=round((time.perf_counter() - started) * 1000, 1), services=self.timings)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            name, index, forked, ready_at = self.workers.pop(pid)
+            uptime = time.perf_counter() - forked
+            if self.stopping:
+                continue
+            crashes = self.crashes.get((name, index), 0) + 1 if uptime < MIN_UPTIME else 0
+            self.crashes[name, index] = crashes
+            delay = min(MAX_BACKOFF, 0.1 * 2 ** crashes) if crashes else 0.0
+            log_json("error", "worker.exited", app=name, pid=pid, code=os.waitstatus_to_exitcode(status),
+                     uptime_s=round(uptime, 1), restart_in_s=round(delay, 2))
+            self.restarts.append((time.monotonic() + delay, name, index))
+
+    def _restart_due(self):
+        now = time.monotonic()
+        due = [r for r in self.restarts if r[0] <= now]
+        self.restarts = [r for r in self.restarts if r[0] > now]
+        for _, name, index in due:
+            self.spawn(name, index)
+            log_json("info", "worker.restarted", app=name, index=index)
+
+    def _stop(self, signum, _frame):
+        self.stopping = True
+
+    def run(self) -> int:
+        for name in SERVICES:
+            self.sockets[name] = _listen(*_address(name))
+        _reset_shared_state()
+        self.preload()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        started = time.perf_counter()
+        for name, n in self.counts.items():
+            for index in range(n):
+                self.spawn(name, index)
+        reported, code = False, 0
+        while not self.stopping:
+            if select.select([self.ready_r], [], [], 0.1)[0]:
+                self._on_ready(os.read(self.ready_r, 4096))
+            self._reap()
+            self._restart_due()
+            if not reported and not self._not_ready():
+                failed = self._check_network()
+                if not failed:
+                    self._report(started)
+                    reported = True
+            if not reported and time.perf_counter() - started > READY_TIMEOUT:
+                log_json("error", "launcher.ready.timeout", timeout_s=READY_TIMEOUT,
+                         not_ready=self._not_ready())
+                self.stopping, code = True, 1
+        self.shutdown()
+        return code
+
+    def shutdown(self):
+        log_json("info", "launcher.stopping", workers=len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+            log_json("warn", "worker.killed", app=self.workers[pid][0], pid=pid)
+        flush_logs()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="", help="workers por servicio, ej: orders=4,gateway=2 (por defecto 1)")
+    parser.add_argument("--log-level", default="warning", help="nivel de los logs propios de uvicorn")
+    args = parser.parse_args()
+    if sys.platform == "win32":
+        raise SystemExit("run.py usa fork (Linux/macOS); en Windows, run.ps1")
+    if settings.MONOLITH:
+        raise SystemExit("run.py levanta cada servicio por separado: sin GATEWAY_MONOLITH=1")
+    os.environ["SERVICE_NAME"] = "launcher"
+    sys.exit(Launcher(_worker_counts(args.workers), args.log_level).run())
+
+
+if __name__ == "__main__":
+    main()
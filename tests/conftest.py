@@ -0,0 +1,81 @@
+"""Los tres servicios en este proceso, llamados con `httpx.ASGITransport` (sin red ni procesos).
+
+Cada app se monta en `common.http` con su URL, como en el modo monolito: las llamadas de
+orders a users/items y las del gateway a los servicios van en memoria. Las dbs son
+archivos en un directorio temporal, uno por sesion de pytest.
+"""
+import importlib, os, tempfile
+
+_workdir = tempfile.mkdtemp(prefix="microservicios-tests-")
+for _name in ("users", "items", "orders"):
+    os.environ[f"{_name.upper()}_DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, _name + '.db')}"
+os.environ.setdefault("ITEMS_HOT_SKUS", "HOT-1")
+os.environ.setdefault("LOG_LEVEL", "warn")
+
+import httpx, pytest
+
+from common import http, tracing
+from common.auth import add_service_auth
+
+URLS = {
+    "users": os.getenv("USERS_SERVICE_URL", "http://127.0.0.1:8001"),
+    "items": os.getenv("ITEMS_SERVICE_URL", "http://127.0.0.1:8002"),
+    "orders": os.getenv("ORDERS_SERVICE_URL", "http://127.0.0.1:8003"),
+}
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    # un solo event loop para toda la sesion: los pools de aiosqlite quedan atados al loop
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def apps(anyio_backend):
+    apps = {}
+    for name, base_url in URLS.items():
+        apps[name] = importlib.import_module(f"{name}-service.app.main").app
+        http.mount(base_url, apps[name])
+    # el ASGITransport no manda eventos lifespan: corremos los on_event de cada servicio
+    for name, app in apps.items():
+        token = tracing.current_service.set(name)
+        try:
+            await app.router.startup()
+        finally:
+            tracing.current_service.reset(token)
+    yield apps
+    for name, app in reversed(list(apps.items())):
+        await app.router.shutdown()
+
+
+def _client(app, base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=base_url,
+                             headers=add_service_auth({}))
+
+
+@pytest.fixture(scope="session")
+async def users(apps):
+    async with _client(apps["users"], URLS["users"]) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+async def items(apps):
+    async with _client(apps["items"], URLS["items"]) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+async def orders(apps):
+    async with _client(apps["orders"], URLS["orders"]) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+async def gateway(apps):
+    # el gateway hacia los servicios montados: sus clientes toman el transport de `http.transport_for`
+    from gateway.app import main
+    await main.app.router.startup()
+    async with _client(main.app, "http://gateway") as client:
+        yield client
+    await main.app.router.shutdown()
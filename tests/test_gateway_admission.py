@@ -0,0 +1,38 @@
+import pytest
+
+from gateway.app import admission, settings
+
+INVALID = ["GET /items=0", "GET /items=-5", "GET /items=nan", "GET /items=5:0.5", "GET /items=muchas", "=5"]
+
+
+@pytest.mark.parametrize("spec", INVALID)
+def test_invalid_route_limit_names_the_rule(spec):
+    with pytest.raises(ValueError, match=f"GATEWAY_ROUTE_LIMITS {spec!r}"):
+        admission._parse_routes(spec)
+
+
+def test_gateway_does_not_start_with_invalid_limits(monkeypatch):
+    monkeypatch.setattr(settings, "ROUTE_LIMITS", "GET /items=1,GET /users=0")
+    with pytest.raises(ValueError, match="'GET /users=0'"):
+        admission.Admission()
+    monkeypatch.setattr(settings, "ROUTE_LIMITS", "")
+    monkeypatch.setattr(settings, "CLIENT_RATE", -1.0)
+    with pytest.raises(ValueError, match="GATEWAY_CLIENT_RATE"):
+        admission.Admission()
+
+
+def test_route_limit_without_burst_allows_one_request():
+    assert admission._parse_routes("GET /items=0.5, post /orders/=200:400") == {
+        "GET /items": (0.5, 1.0), "POST /orders": (200.0, 400.0)}
+
+
+@pytest.mark.anyio
+async def test_route_limit_and_removing_it(gateway):
+    r = await gateway.put("/admin/limits", json={"routes": {"GET /items": {"rate": 1, "burst": 1}}})
+    assert r.status_code == 200, r.text
+    first, second = await gateway.get("/items/"), await gateway.get("/items/")
+    assert (first.status_code, second.status_code) == (200, 429)
+    assert "retry-after" in second.headers
+
+    (await gateway.put("/admin/limits", json={"routes": {"GET /items": {"rate": 0}}})).raise_for_status()
+    assert (await gateway.get("/items/")).status_code == 200
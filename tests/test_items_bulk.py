@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+# un SKU frio y uno caliente (en memoria, ver hot.py)
+SKUS = ("BULK-COLD", os.environ["ITEMS_HOT_SKUS"].split(",")[0])
+
+# filas sin stock: (content type, header, fila)
+CASES = {
+    "csv-sin-columna": ("text/csv", "name,sku\n", "{name},{sku}\n"),
+    "csv-vacio": ("text/csv", "name,sku,stock\n", "{name},{sku},\n"),
+    "ndjson": ("application/x-ndjson", "", '{{"name": "{name}", "sku": "{sku}"}}\n'),
+}
+
+
+async def _bulk(items, content_type: str, body: str) -> dict:
+    r = await items.post("/bulk", content=body.encode(), headers={"Content-Type": content_type})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def _item(items, sku: str) -> dict:
+    row = (await items.get("/", params={"sku_prefix": sku})).json()[0]
+    # el stock que ve /reserve (el de memoria si es caliente): una reserva que no alcanza no descuenta
+    r = await items.post("/reserve/batch", json={"lines": [{"sku": sku, "qty": 10**9}]})
+    r.raise_for_status()
+    return {**row, "reserve_stock": r.json()["results"][0]["stock"]}
+
+
+@pytest.fixture(scope="module")
+async def loaded(items):
+    out = await _bulk(items, "text/csv", "name,sku,stock\n" + "".join(f"original,{sku},5\n" for sku in SKUS))
+    assert out["failed"] == 0, out
+
+
+@pytest.mark.parametrize("case", CASES)
+async def test_row_without_stock_keeps_stock(loaded, items, case):
+    content_type, header, row = CASES[case]
+    name = f"renombrado {case}"
+    out = await _bulk(items, content_type, header + "".join(row.format(name=name, sku=sku) for sku in SKUS))
+    assert (out["updated"], out["failed"]) == (len(SKUS), 0), out
+    for sku in SKUS:
+        item = await _item(items, sku)
+        assert item["name"] == name
+        assert item["stock"] == item["reserve_stock"] == 5
+
+
+async def test_new_sku_without_stock_starts_at_zero(items):
+    out = await _bulk(items, "text/csv", "name,sku\nnuevo,BULK-NEW\n")
+    assert out["inserted"] == 1, out
+    assert (await _item(items, "BULK-NEW"))["stock"] == 0
+
+
+async def test_negative_stock_is_rejected(loaded, items):
+    body = "name,sku,stock\n" + "".join(f"negativo,{sku},-3\n" for sku in SKUS + ("BULK-NEG",))
+    out = await _bulk(items, "text/csv", body)
+    assert (out["received"], out["failed"]) == (len(SKUS) + 1, len(SKUS) + 1), out
+    assert [e["line"] for e in out["errors"]] == list(range(2, len(SKUS) + 3))
+    for sku in SKUS:
+        assert (await _item(items, sku))["reserve_stock"] == 5
+    assert (await items.get("/", params={"sku_prefix": "BULK-NEG"})).json() == []
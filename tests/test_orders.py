@@ -0,0 +1,70 @@
+import importlib
+
+import pytest
+
+from common import http
+
+pytestmark = pytest.mark.anyio
+
+orders_routers = importlib.import_module("orders-service.app.routers")
+
+
+async def _setup(users, items, sku: str, stock: int) -> tuple[int, int]:
+    """Un usuario y un item con `stock`; devuelve sus ids."""
+    user = await users.post("/", json={"name": sku, "email": f"{sku.lower()}@tests.local"})
+    user.raise_for_status()
+    item = await items.post("/", json={"name": sku, "sku": sku, "stock": stock})
+    item.raise_for_status()
+    return user.json()["id"], item.json()["id"]
+
+
+async def _stock(items, item_id: int) -> int:
+    return (await items.get("/", params={"after": item_id - 1, "limit": 1})).json()[0]["stock"]
+
+
+async def test_batch_has_one_result_per_row(users, items, orders):
+    user_id, item_id = await _setup(users, items, "BATCH-1", 10)
+    rows = [
+        {"user_id": user_id, "item_sku": "BATCH-1", "qty": 2},
+        {"user_id": user_id + 1000, "item_sku": "BATCH-1", "qty": 2},
+        {"user_id": user_id, "item_sku": "NO-EXISTE", "qty": 2},
+    ]
+    r = await orders.post("/batch", json={"orders": rows})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert [row["index"] for row in body["results"]] == [0, 1, 2]
+    assert [row["ok"] for row in body["results"]] == [True, False, False]
+    assert [row["status_code"] for row in body["results"]] == [201, 404, 404]
+    assert (body["created"], body["failed"]) == (1, 2)
+    assert await _stock(items, item_id) == 8
+
+
+async def test_lost_reserve_reply_is_released(users, items, orders, monkeypatch):
+    user_id, item_id = await _setup(users, items, "LOST-1", 10)
+    reserve_stock = orders_routers.reserve_stock
+
+    async def reserve_and_lose_reply(*args, **kwargs):
+        await reserve_stock(*args, **kwargs)  # items reserva, pero la respuesta no llega
+        raise http.UpstreamError("timeout")
+
+    monkeypatch.setattr(orders_routers, "reserve_stock", reserve_and_lose_reply)
+    order = {"user_id": user_id, "item_sku": "LOST-1", "qty": 3}
+    r = await orders.post("/", json=order, headers={"Idempotency-Key": "lost-1"})
+    assert r.status_code == 503
+    assert await _stock(items, item_id) == 10
+
+    # el reintento del cliente con la misma clave reserva de nuevo (no le devuelven la ya devuelta)
+    monkeypatch.setattr(orders_routers, "reserve_stock", reserve_stock)
+    r = await orders.post("/", json=order, headers={"Idempotency-Key": "lost-1"})
+    assert r.status_code == 201, r.text
+    assert await _stock(items, item_id) == 7
+
+
+async def test_keyed_retry_does_not_reserve_twice(users, items, orders):
+    user_id, item_id = await _setup(users, items, "RETRY-1", 10)
+    order = {"user_id": user_id, "item_sku": "RETRY-1", "qty": 2}
+    first = await orders.post("/", json=order, headers={"Idempotency-Key": "retry-1"})
+    again = await orders.post("/", json=order, headers={"Idempotency-Key": "retry-1"})
+    assert (first.status_code, again.status_code) == (201, 201)
+    assert again.json()["id"] == first.json()["id"]
+    assert await _stock(items, item_id) == 8
@@ -1,38 +1,53 @@
-from sqlalchemy.orm import Session
-from .models import User
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from common import etag
+from .models import User, table_versions
 
-def list_users(db: Session):
-    return db.query(User).all()
+# keyset: ordenado por id, solo ids mayores al cursor
+def list_users_stmt(after: int | None = None):
+    stmt = select(User).order_by(User.id)
+    if after is not None:
+        stmt = stmt.where(User.id > after)
+    return stmt
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def list_users(db: AsyncSession, limit: int | None = None, after: int | None = None):
+    stmt = list_users_stmt(after)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return (await db.scalars(stmt)).all()
 
-def get_user_by_id(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+async def get_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(User).where(User.email == email))
 
-def create_user(db: Session, name: str, email: str):
-    if get_user_by_email(db, email):
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    return await db.get(User, user_id)
+
+async def create_user(db: AsyncSession, name: str, email: str):
+    if await get_user_by_email(db, email):
         raise ValueError("Email ya registrado")
     u = User(name=name, email=email)
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await etag.bump(db, table_versions, "users")
+    await db.commit()  # expire_on_commit=False: no hace falta refresh
     return u
 
-def update_user(db: Session, user_id: int, name: str | None = None, email: str | None = None):
-    user = get_user_by_id(db, user_id)
+async def update_user(db: AsyncSession, user_id: int, name: str | None = None, email: str | None = None):
+    user = await get_user_by_id(db, user_id)
     if not user:
         return None
-    if email and db.query(User).filter(User.email == email, User.id != user_id).first():
+    if email and await db.scalar(select(User.id).where(User.email == email, User.id != user_id)):
         raise ValueError("Email ya registrado")
     if name  is not None: user.name  = name
     if email is not None: user.email = email
-    db.commit(); db.refresh(user)
+    await etag.bump(db, table_versions, "users")
+    await db.commit()
     return user
 
-def delete_user(db: Session, user_id: int) -> bool:
-    user = get_user_by_id(db, user_id)
+async def delete_user(db: AsyncSession, user_id: int) -> bool:
+    user = await get_user_by_id(db, user_id)
     if not user:
         return False
-    db.delete(user); db.commit()
-    return True
\ No newline at end of file
+    await db.delete(user)
+    await etag.bump(db, table_versions, "users")
+    await db.commit()
+    return True
@@ -0,0 +1,39 @@
+import asyncio, os
+from common.auth import add_service_auth
+from common.logging import log_json
+from common import http
+
+# Avisos de cambios de usuarios a quien los cachea (orders guarda "existe el usuario?").
+# Lista separada por comas de URLs que reciben POST {"user_ids": [...]}; vacia = sin avisos.
+_ORDERS_URL = os.getenv("ORDERS_SERVICE_URL", "http://127.0.0.1:8003")
+SUBSCRIBERS = [u.strip() for u in os.getenv(
+    "USERS_CHANGE_SUBSCRIBERS", f"{_ORDERS_URL}/internal/users/changed").split(",") if u.strip()]
+NOTIFY_RETRY = http.RetryPolicy(attempts=3, timeout=2.0, backoff=0.2)
+
+# referencias a los avisos en vuelo (si no, el GC puede cortar la tarea a mitad)
+_pending: set[asyncio.Task] = set()
+
+
+async def _notify(url: str, user_ids: list[int]):
+    try:
+        r = await http.arequest("POST", url, json={"user_ids": user_ids},
+                                headers=add_service_auth({}), retry=NOTIFY_RETRY)
+    except RuntimeError as e:
+        log_json("error", "user.change.notify.failed", url=url, user_ids=user_ids, error=str(e))
+        return
+    if r.is_error:
+        log_json("error", "user.change.notify.failed", url=url, user_ids=user_ids, status=r.status_code)
+
+
+def user_changed(*user_ids: int):
+    """Avisa (sin esperar la respuesta) que estos usuarios se crearon, cambiaron o borraron."""
+    for url in SUBSCRIBERS:
+        task = asyncio.create_task(_notify(url, list(user_ids)))
+        _pending.add(task)
+        task.add_done_callback(_pending.discard)
+
+
+async def drain(timeout: float = 5.0):
+    """Espera los avisos en vuelo antes de cerrar el cliente http."""
+    if _pending:
+        await asyncio.wait(list(_pending), timeout=timeout)
@@ -1,4 +1,5 @@
 from sqlalchemy import Column, Integer, String
+from common.etag import versions_table
 from .db import Base
 
 class User(Base):
@@ -7,3 +8,10 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     email = Column(String(120), unique=True, index=True, nullable=False)
+
+# version de cada tabla para los ETags (ver common.etag)
+table_versions = versions_table(Base.metadata)
+
+def init_schema(engine):
+    """Crea las tablas que falten (al importar main.py, o una vez desde run.py)."""
+    Base.metadata.create_all(bind=engine)
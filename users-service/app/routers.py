@@ -1,22 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from .db import SessionLocal, engine
-from .models import Base
-from . import crud
+from sqlalchemy.ext.asyncio import AsyncSession
+from .db import SessionLocal, ReadSessionLocal
+from .models import table_versions
+from . import crud, events
 from common.logging import log_json
+from common import etag
+from common.pagination import MAX_LIMIT, page_limit, wants_ndjson, paginate, set_next_cursor, ndjson_response
 
 router = APIRouter(tags=["users"])
 
-# Crear tablas al importar
-Base.metadata.create_all(bind=engine)
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
 
-def get_db():
-    db = SessionLocal()
-    try:
+# sesion para rutas GET (engine de solo lectura si DB_SEPARATE_READ_ENGINE=1)
+async def get_read_db():
+    async with ReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class UserIn(BaseModel):
     name: str = Field(min_length=1, max_length=100)
@@ -30,41 +31,63 @@ class UserUpdate(BaseModel):
     email: str | None = Field(min_length=None, max_length=120)
 
 @router.get("/", response_model=list[UserOut])
-def list_users(db: Session = Depends(get_db)):
-    users = crud.list_users(db)
+async def list_users(request: Request, response: Response,
+               limit: int | None = Query(default=None, ge=1, le=MAX_LIMIT),
+               after: int | None = Query(default=None, ge=0),
+               db: AsyncSession = Depends(get_read_db)):
+    # GET condicional: con la version de la tabla alcanza para responder 304 sin listar
+    tag = etag.make_etag("users", await etag.current(db, table_versions, "users"), request)
+    if etag.matches(request, tag):
+        return etag.not_modified(tag)
+    if wants_ndjson(request):
+        log_json("info", "users.streamed", after=after)
+        stmt = crud.list_users_stmt(after)
+        return etag.set_headers(ndjson_response(ReadSessionLocal, stmt if limit is None else stmt.limit(limit), UserOut), tag)
+    etag.set_headers(response, tag)
+    page = page_limit(limit, after)  # sin limit ni after: todas
+    users, next_cursor = paginate(await crud.list_users(db, page and page + 1, after), page)
+    set_next_cursor(request, response, next_cursor, page)
     log_json("info", "users.listed", count=len(users))
-    return crud.list_users(db)
+    return users
 
 @router.post("/", response_model=UserOut, status_code=201)
-def create_user(payload: UserIn, db: Session = Depends(get_db)):
+async def create_user(payload: UserIn, db: AsyncSession = Depends(get_db)):
     try:
-        user = crud.create_user(db, payload.name, payload.email)
+        user = await crud.create_user(db, payload.name, payload.email)
         log_json("info", "user.created", user_id=user.id, email=user.email)
+        events.user_changed(user.id)  # orders pudo haber cacheado este id como inexistente
         return user
     except ValueError as e:
         log_json("warn", "user.create.conflict", email=payload.email)
         raise HTTPException(status_code=409, detail=str(e))
     
 @router.get("/{user_id}", response_model=UserOut, summary="Obtener usuario por ID")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    u = crud.get_user_by_id(db, user_id)
+async def get_user(user_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_read_db)):
+    # ETag de la fila: cambios en otros usuarios no invalidan este (una lectura por PK igual que la version)
+    u = await crud.get_user_by_id(db, user_id)
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    tag = etag.row_etag("user", UserOut.model_validate(u, from_attributes=True).model_dump())
+    if etag.matches(request, tag):
+        return etag.not_modified(tag)
+    etag.set_headers(response, tag)
     return u
 
 @router.put("/{user_id}", response_model=UserOut, summary="Actualizar usuario")
-def update_user_route(user_id: int, payload: UserUpdate, db: Session = Depends(get_db)):
+async def update_user_route(user_id: int, payload: UserUpdate, db: AsyncSession = Depends(get_db)):
     try:
-        u = crud.update_user(db, user_id, payload.name, payload.email)
+        u = await crud.update_user(db, user_id, payload.name, payload.email)
     except ValueError as e:
         raise HTTPException(status_code=409, detail=str(e))
     if not u:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    events.user_changed(user_id)
     return u
 
 @router.delete("/{user_id}", status_code=204, summary="Eliminar usuario")
-def delete_user_route(user_id: int, db: Session = Depends(get_db)):
-    ok = crud.delete_user(db, user_id)
+async def delete_user_route(user_id: int, db: AsyncSession = Depends(get_db)):
+    ok = await crud.delete_user(db, user_id)
     if not ok:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    events.user_changed(user_id)
     return Response(status_code=204)